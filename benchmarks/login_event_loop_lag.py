@@ -0,0 +1,73 @@
+"""Event-loop lag during a burst of concurrent logins.
+
+    python benchmarks/login_event_loop_lag.py [--logins 20] [--workers 2]
+
+A ticker coroutine wakes every 5 ms and records how late it was; that lateness
+is what every WebSocket on the worker experiences. The burst is verified once
+inline (the old behaviour) and once through ``users.auth.PasswordHashPool``.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("database_url", "sqlite+aiosqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+from users.auth import PasswordHashPool  # noqa: E402
+from users.services import pwd_context  # noqa: E402
+
+TICK_SEC = 0.005
+
+
+async def ticker(lags: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_SEC)
+        lags.append(time.perf_counter() - started - TICK_SEC)
+
+
+async def inline_login(hashed: str):
+    pwd_context.verify("secret123", hashed)
+
+
+async def measure(name: str, logins: int, login):
+    lags: list[float] = []
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+    await asyncio.sleep(TICK_SEC * 2)
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    lags.sort()
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+    print(
+        f"{name:8s} burst {elapsed * 1000:7.0f} ms | loop lag "
+        f"median {statistics.median(lags) * 1000:6.1f} ms, "
+        f"p99 {p99 * 1000:6.1f} ms, max {lags[-1] * 1000:6.1f} ms"
+    )
+
+
+async def main(logins: int, workers: int):
+    hashed = pwd_context.hash("secret123")
+    pool = PasswordHashPool(max_workers=workers, max_pending=logins)
+    print(f"{logins} concurrent bcrypt verifications, pool of {workers} threads")
+    await measure("inline", logins, lambda: inline_login(hashed))
+    await measure(
+        "pool", logins, lambda: pool.run(pwd_context.verify, "secret123", hashed)
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    asyncio.run(main(args.logins, args.workers))
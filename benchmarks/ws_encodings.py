@@ -0,0 +1,175 @@
+"""Bytes on the wire and CPU per frame for each negotiable /ws wire format.
+
+    python benchmarks/ws_encodings.py [--repeat 2000] [--output run.json]
+
+Encodes a set of representative server frames (message, presence snapshot,
+presence batch, typing state, read watermark, ping) with every format in
+``messages.codec.WireFormat`` and reports the average size and encode/decode
+time per frame. It then times a 1000-recipient broadcast with a mix of formats,
+both encoding per socket and through ``ConnectionManager._deliver``, which
+encodes once per format.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("database_url", "sqlite+aiosqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+from messages.codec import WireFormat, msgpack  # noqa: E402
+from messages.ws_manager import ConnectionManager  # noqa: E402
+
+FORMATS = [
+    ("json", None),
+    ("json", "deflate"),
+    ("msgpack", None),
+    ("msgpack", "deflate"),
+]
+RECIPIENTS = 1000
+
+
+def ids(count: int) -> list[str]:
+    return [str(uuid.uuid4()) for _ in range(count)]
+
+
+def sample_frames() -> dict[str, dict]:
+    chat_id, sender_id = ids(2)
+    return {
+        "message": {
+            "id": str(uuid.uuid4()),
+            "chat_id": chat_id,
+            "sender_id": sender_id,
+            "client_msg_id": str(uuid.uuid4()),
+            "text": "See you at the station at 7, I'll bring the tickets.",
+            "timestamp": "2026-10-18T12:00:00.123456+00:00",
+        },
+        "presence.snapshot_all": {
+            "type": "presence.snapshot_all",
+            "online_by_chat": {cid: ids(10) for cid in ids(50)},
+        },
+        "presence.batch": {
+            "type": "presence.batch",
+            "updates": [
+                {"user_id": uid, "status": "online", "chat_ids": ids(3)}
+                for uid in ids(20)
+            ],
+        },
+        "typing.state": {
+            "type": "typing.state",
+            "chat_id": chat_id,
+            "user_ids": ids(3),
+        },
+        "read.watermark": {
+            "type": "read.watermark",
+            "chat_id": chat_id,
+            "user_id": sender_id,
+            "last_read_message_id": str(uuid.uuid4()),
+            "last_read_at": "2026-10-18T12:00:00.123456+00:00",
+        },
+        "ping": {"type": "ping"},
+    }
+
+
+def per_frame(wire: WireFormat, frame: dict, repeat: int) -> dict:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        data = wire.dumps(frame)
+    encode = (time.perf_counter() - started) / repeat
+    started = time.perf_counter()
+    for _ in range(repeat):
+        wire.loads(data)
+    decode = (time.perf_counter() - started) / repeat
+    size = len(data.encode() if isinstance(data, str) else data)
+    return {"bytes": size, "encode_us": encode * 1e6, "decode_us": decode * 1e6}
+
+
+class NullSocket:
+    async def send_text(self, data):
+        pass
+
+    async def send_bytes(self, data):
+        pass
+
+    async def close(self, code=1000):
+        pass
+
+
+async def fanout(wires: list[WireFormat], frame: dict, repeat: int) -> dict:
+    manager = ConnectionManager(max_queue_size=repeat + 1)
+    chat_id = uuid.uuid4()
+    conns = []
+    for index in range(RECIPIENTS):
+        wire = wires[index % len(wires)]
+        user_id = uuid.uuid4()
+        conns.append(await manager.connect(user_id, NullSocket(), wire))
+        manager.subscribe(user_id, chat_id)
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for conn in conns:
+            conn.wire.dumps(frame)
+    per_socket = (time.perf_counter() - started) / repeat
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        manager._deliver(chat_id, frame, None, False)
+    cached = (time.perf_counter() - started) / repeat
+
+    for conn in conns:
+        manager.disconnect(conn.user_id)
+    await asyncio.sleep(0)
+    return {"per_socket_ms": per_socket * 1e3, "once_per_format_ms": cached * 1e3}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--fanout-repeat", type=int, default=20)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    formats = [
+        (encoding, compression)
+        for encoding, compression in FORMATS
+        if encoding != "msgpack" or msgpack is not None
+    ]
+    wires = [WireFormat(encoding, compression) for encoding, compression in formats]
+    frames = sample_frames()
+    results: dict = {"frames": {}, "fanout": {}}
+
+    print(
+        f"{'frame':22s} {'format':16s} {'bytes':>7s} {'encode us':>10s} {'decode us':>10s}"
+    )
+    for name, frame in frames.items():
+        results["frames"][name] = {}
+        for wire in wires:
+            stats = per_frame(wire, frame, args.repeat)
+            results["frames"][name][wire.name] = stats
+            print(
+                f"{name:22s} {wire.name:16s} {stats['bytes']:7d} "
+                f"{stats['encode_us']:10.2f} {stats['decode_us']:10.2f}"
+            )
+
+    results["fanout"] = asyncio.run(
+        fanout(wires, frames["message"], args.fanout_repeat)
+    )
+    print(
+        f"\n{RECIPIENTS}-recipient broadcast over {len(wires)} formats: "
+        f"{results['fanout']['per_socket_ms']:.2f} ms encoding per socket, "
+        f"{results['fanout']['once_per_format_ms']:.2f} ms via _deliver "
+        "(encode once per format + enqueue)"
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
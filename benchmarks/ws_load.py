@@ -0,0 +1,385 @@
+"""WebSocket load generator: delivery latency and throughput of one worker.
+
+Starts ``uvicorn main:app`` as a subprocess, seeds users and chats directly in
+the database, opens N authenticated ``/ws`` clients and drives ``send_message``,
+``typing`` and ``read_messages`` at fixed rates:
+
+    python benchmarks/ws_load.py --clients 200 --chats 40 --duration 30
+    python benchmarks/ws_load.py --database-url postgresql+asyncpg://... \\
+        --server-env WS_INGEST_ENABLED=true --output run.json --baseline base.json
+
+Without ``--database-url`` a temporary SQLite file stands in for Postgres.
+Latency is measured from the sender's ``send`` to each other member's receive
+(all clients live in this process, so one monotonic clock covers both ends).
+Server CPU/RSS are sampled when ``psutil`` is installed.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("database_url", "sqlite+aiosqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+import websockets  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from chats.models import Chat, ChatParticipant, ChatType  # noqa: E402
+from database import Base  # noqa: E402
+from messages.models import Messages  # noqa: E402,F401
+from users.models import User  # noqa: E402
+from users.services import UserService  # noqa: E402
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover - optional
+    psutil = None
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def chat_sizes(chats: int, clients: int, dist: str, zipf_s: float) -> list[int]:
+    if dist == "uniform":
+        weights = [1.0] * chats
+    else:
+        weights = [1 / (rank**zipf_s) for rank in range(1, chats + 1)]
+    total = sum(weights)
+    # About two memberships per client; seeding also puts every client in a chat.
+    return [max(2, min(clients, round(clients * 2 * w / total))) for w in weights]
+
+
+async def seed(database_url: str, clients: int, sizes: list[int], rng: random.Random):
+    engine = create_async_engine(database_url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    run = uuid.uuid4().hex[:8]
+    users = [
+        User(
+            id=uuid.uuid4(),
+            name=f"load-{i}",
+            email=f"load-{run}-{i}@example.com",
+            password="!",
+        )
+        for i in range(clients)
+    ]
+    chats = [
+        Chat(id=uuid.uuid4(), title=f"load-{run}-{i}", type=ChatType.group)
+        for i in range(len(sizes))
+    ]
+    members = {
+        chat.id: {u.id for u in rng.sample(users, size)}
+        for chat, size in zip(chats, sizes)
+    }
+    for index, user in enumerate(users):
+        if not any(user.id in ids for ids in members.values()):
+            members[chats[index % len(chats)].id].add(user.id)
+
+    async with session_factory() as session:
+        session.add_all(users + chats)
+        await session.flush()
+        session.add_all(
+            ChatParticipant(chat_id=chat_id, user_id=user_id)
+            for chat_id, ids in members.items()
+            for user_id in ids
+        )
+        await session.commit()
+    await engine.dispose()
+    return [u.id for u in users], members
+
+
+class Client:
+    def __init__(self, user_id: uuid.UUID, chat_ids: list[uuid.UUID], stats: "Stats"):
+        self.user_id = user_id
+        self.chat_ids = chat_ids
+        self.stats = stats
+        self.ws = None
+        self.recent_messages: dict[uuid.UUID, str] = {}
+
+    async def connect(self, url: str):
+        self.ws = await websockets.connect(url, max_queue=None)
+        token = UserService.create_access_token({"sub": str(self.user_id)})
+        await self.ws.send(json.dumps({"action": "auth", "token": token}))
+
+    async def reader(self):
+        try:
+            async for raw in self.ws:
+                received = time.perf_counter()
+                frame = json.loads(raw)
+                kind = frame.get("type")
+                if kind is None and "text" in frame:
+                    self.recent_messages[uuid.UUID(frame["chat_id"])] = frame["id"]
+                    if frame["sender_id"] != str(self.user_id):
+                        sent = float(frame["text"].split(":", 1)[1])
+                        self.stats.latencies.append(received - sent)
+                    else:
+                        self.stats.acked += 1
+                elif kind == "error":
+                    self.stats.errors += 1
+                self.stats.received += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    async def send(self, frame: dict):
+        await self.ws.send(json.dumps(frame))
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.sent = {"send_message": 0, "typing": 0, "read_messages": 0}
+        self.received = 0
+        self.acked = 0
+        self.errors = 0
+
+
+async def drive(
+    clients: list[Client], action: str, rate: float, stop: float, stats: Stats, rng
+):
+    if rate <= 0:
+        return
+    interval = 1 / rate
+    next_at = time.perf_counter()
+    while time.perf_counter() < stop:
+        client = rng.choice(clients)
+        chat_id = rng.choice(client.chat_ids)
+        if action == "send_message":
+            frame = {
+                "action": "send_message",
+                "chat_id": str(chat_id),
+                "text": f"t:{time.perf_counter():.9f}",
+                "client_msg_id": str(uuid.uuid4()),
+            }
+        elif action == "typing":
+            frame = {"action": "typing", "chat_id": str(chat_id), "is_typing": True}
+        else:
+            last = client.recent_messages.get(chat_id)
+            if last is None:
+                frame = None
+            else:
+                frame = {"action": "read_messages", "message_ids": [last]}
+        if frame is not None:
+            await client.send(frame)
+            stats.sent[action] += 1
+        next_at += interval
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif delay < -1:
+            next_at = time.perf_counter()  # fell behind; do not burst to catch up
+
+
+async def sample_server(
+    pid: int, stop: asyncio.Event, samples: list[tuple[float, float]]
+):
+    if psutil is None:
+        return
+    process = psutil.Process(pid)
+    process.cpu_percent()
+    while not stop.is_set():
+        await asyncio.sleep(0.5)
+        try:
+            with process.oneshot():
+                samples.append((process.cpu_percent(), process.memory_info().rss))
+        except psutil.Error:
+            return
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def wait_for_port(port: int, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"server did not start on port {port}")
+
+
+def start_server(args, database_url: str) -> subprocess.Popen:
+    env = dict(os.environ, database_url=database_url, DB_PROFILE="prod")
+    env.pop("DATABASE_URL", None)
+    if database_url.startswith("sqlite"):
+        # SQLite allows one writer; queue in the pool instead of "database is locked".
+        env.update(DB_POOL_SIZE="1", DB_MAX_OVERFLOW="0", DB_POOL_TIMEOUT_SEC="60")
+    for pair in args.server_env:
+        key, _, value = pair.partition("=")
+        env[key] = value
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(args.port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=ROOT,
+        env=env,
+    )
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    tmpdir = None
+    database_url = args.database_url
+    if database_url is None:
+        tmpdir = tempfile.mkdtemp(prefix="ws-load-")
+        database_url = f"sqlite+aiosqlite:///{tmpdir}/load.db"
+
+    sizes = chat_sizes(args.chats, args.clients, args.dist, args.zipf_s)
+    user_ids, members = await seed(database_url, args.clients, sizes, rng)
+    chats_by_user: dict[uuid.UUID, list[uuid.UUID]] = {}
+    for chat_id, ids in members.items():
+        for user_id in ids:
+            chats_by_user.setdefault(user_id, []).append(chat_id)
+
+    server = start_server(args, database_url)
+    stats = Stats()
+    samples: list[tuple[float, float]] = []
+    try:
+        await wait_for_port(args.port)
+        url = f"ws://127.0.0.1:{args.port}/ws"
+        clients = [Client(uid, chats_by_user[uid], stats) for uid in user_ids]
+        # Ramp up so the connect storm itself does not exhaust the DB pool.
+        for start in range(0, len(clients), args.connect_batch):
+            batch = clients[start : start + args.connect_batch]
+            await asyncio.gather(*(c.connect(url) for c in batch))
+            await asyncio.sleep(0.05)
+        readers = [asyncio.create_task(c.reader()) for c in clients]
+        await asyncio.sleep(1.0)
+
+        sampling_done = asyncio.Event()
+        sampler = asyncio.create_task(sample_server(server.pid, sampling_done, samples))
+        started = time.perf_counter()
+        stop = started + args.duration
+        await asyncio.gather(
+            drive(clients, "send_message", args.send_rate, stop, stats, rng),
+            drive(clients, "typing", args.typing_rate, stop, stats, rng),
+            drive(clients, "read_messages", args.read_rate, stop, stats, rng),
+        )
+        await asyncio.sleep(args.drain)
+        elapsed = time.perf_counter() - started
+        sampling_done.set()
+        await sampler
+
+        for client in clients:
+            await client.ws.close()
+        await asyncio.gather(*readers, return_exceptions=True)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    latencies = sorted(stats.latencies)
+    cpu = [c for c, _ in samples]
+    return {
+        "config": {
+            "clients": args.clients,
+            "chats": args.chats,
+            "dist": args.dist,
+            "chat_sizes": sorted(sizes, reverse=True)[:10],
+            "duration_sec": args.duration,
+            "send_rate": args.send_rate,
+            "typing_rate": args.typing_rate,
+            "read_rate": args.read_rate,
+            "database": "sqlite" if args.database_url is None else "postgres",
+            "server_env": args.server_env,
+        },
+        "results": {
+            "delivery_latency_ms": {
+                "count": len(latencies),
+                "p50": percentile(latencies, 0.50) * 1000,
+                "p95": percentile(latencies, 0.95) * 1000,
+                "p99": percentile(latencies, 0.99) * 1000,
+                "max": (latencies[-1] if latencies else 0.0) * 1000,
+            },
+            "sent": stats.sent,
+            "messages_stored_per_sec": stats.acked / elapsed,
+            "deliveries_per_sec": len(latencies) / elapsed,
+            "frames_received": stats.received,
+            "errors": stats.errors,
+            "server_cpu_percent_avg": sum(cpu) / len(cpu) if cpu else None,
+            "server_rss_mb_max": (
+                max(r for _, r in samples) / 2**20 if samples else None
+            ),
+        },
+    }
+
+
+def compare(current: dict, baseline: dict):
+    keys = [
+        ("delivery_latency_ms", "p50"),
+        ("delivery_latency_ms", "p95"),
+        ("delivery_latency_ms", "p99"),
+        ("messages_stored_per_sec", None),
+        ("deliveries_per_sec", None),
+        ("server_cpu_percent_avg", None),
+        ("server_rss_mb_max", None),
+    ]
+    print(f"{'metric':32s} {'baseline':>12s} {'current':>12s} {'change':>9s}")
+    for key, sub in keys:
+        old = baseline["results"].get(key)
+        new = current["results"].get(key)
+        if sub is not None:
+            old, new = (old or {}).get(sub), (new or {}).get(sub)
+        name = f"{key}.{sub}" if sub else key
+        if old is None or new is None:
+            print(f"{name:32s} {'-':>12s} {'-':>12s}")
+            continue
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+        print(f"{name:32s} {old:12.2f} {new:12.2f} {change:>9s}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--chats", type=int, default=40)
+    parser.add_argument("--dist", choices=("uniform", "zipf"), default="zipf")
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--drain", type=float, default=2.0)
+    parser.add_argument("--send-rate", type=float, default=100.0)
+    parser.add_argument("--typing-rate", type=float, default=200.0)
+    parser.add_argument("--read-rate", type=float, default=50.0)
+    parser.add_argument("--connect-batch", type=int, default=20)
+    parser.add_argument("--database-url")
+    parser.add_argument(
+        "--server-env", action="append", default=[], metavar="KEY=VALUE"
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""Microbenchmarks for ``messages.ws_manager.ConnectionManager`` hot paths.
+
+Drives the manager in-process with fake sockets (no server, no database):
+
+    python benchmarks/ws_manager_hot_paths.py
+    python benchmarks/ws_manager_hot_paths.py --connections 1000,10000 \\
+        --dist uniform --output run.json --baseline base.json
+
+Each size builds a fresh manager with that many connected users subscribed to
+chats whose sizes follow a zipf (default) or uniform distribution. Every
+operation is timed over pre-generated arguments until ``--min-time`` has
+passed (batches double from 1 to 200 ops), then replayed up to ``--alloc-ops``
+times under ``tracemalloc`` for allocation figures. Writers are drained
+between batches, outside the timing.
+"""
+
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("database_url", "sqlite+aiosqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+from messages.ws_manager import ConnectionManager  # noqa: E402
+
+MAX_BATCH = 200
+MEMBERSHIPS_PER_USER = 3
+
+
+class FakeWebSocket:
+    __slots__ = ()
+
+    async def send_text(self, data: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def chat_sizes(users: int, dist: str, zipf_s: float) -> list[int]:
+    chats = max(1, users // 10)
+    if dist == "uniform":
+        weights = [1.0] * chats
+    else:
+        weights = [1 / (rank**zipf_s) for rank in range(1, chats + 1)]
+    total = sum(weights)
+    memberships = users * MEMBERSHIPS_PER_USER
+    return [max(2, min(users, round(memberships * w / total))) for w in weights]
+
+
+class Fixture:
+    def __init__(self, users: int, dist: str, zipf_s: float, rng: random.Random):
+        self.manager = ConnectionManager(max_queue_size=10 * MAX_BATCH)
+        self.user_ids = [uuid.uuid4() for _ in range(users)]
+        self.sizes = chat_sizes(users, dist, zipf_s)
+        self.chat_ids = [uuid.uuid4() for _ in self.sizes]
+        self.user_chats: dict[uuid.UUID, list[uuid.UUID]] = {
+            uid: [] for uid in self.user_ids
+        }
+        for chat_id, size in zip(self.chat_ids, self.sizes):
+            for uid in rng.sample(self.user_ids, size):
+                self.user_chats[uid].append(chat_id)
+        self.cum_weights = list(itertools.accumulate(self.sizes))
+        self.rng = rng
+
+    async def connect_all(self) -> dict:
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        for uid in self.user_ids:
+            await self.manager.connect(uid, FakeWebSocket())
+            self.manager.subscribe_many(uid, self.user_chats[uid])
+        elapsed = time.perf_counter() - started
+        retained = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        await self.drain()
+        return {
+            "setup_sec": elapsed,
+            "bytes_per_connection": retained / len(self.user_ids),
+        }
+
+    async def drain(self):
+        # Let woken writers flush into the fake sockets and cancelled ones exit.
+        await asyncio.sleep(0)
+        while any(conn.outbox for conn in self.manager.active_users.values()):
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+    def busy_chat(self) -> uuid.UUID:
+        # Bigger chats carry proportionally more traffic.
+        return self.rng.choices(self.chat_ids, cum_weights=self.cum_weights)[0]
+
+    def operations(self) -> dict:
+        manager = self.manager
+        rng = self.rng
+
+        async def broadcast(chat_id, message, sender):
+            await manager.broadcast(chat_id, message, exclude_user_id=sender)
+
+        def broadcast_args():
+            chat_id = self.busy_chat()
+            sender = rng.choice(self.user_ids)
+            message = {
+                "type": "message",
+                "message": {
+                    "id": str(uuid.uuid4()),
+                    "chat_id": str(chat_id),
+                    "sender_id": str(sender),
+                    "text": "x" * rng.randint(10, 200),
+                    "timestamp": "2026-10-18T12:00:00+00:00",
+                },
+            }
+            return chat_id, message, sender
+
+        async def connect_disconnect(user_id):
+            await manager.connect(user_id, FakeWebSocket())
+            manager.subscribe_many(user_id, self.user_chats[self.user_ids[0]])
+            manager.disconnect(user_id)
+
+        return {
+            # (callable, is_async, argument factory)
+            "broadcast": (broadcast, True, broadcast_args),
+            "subscribe_many": (
+                manager.subscribe_many,
+                False,
+                lambda: (uid := rng.choice(self.user_ids), self.user_chats[uid]),
+            ),
+            "get_online_user_ids_in_chat": (
+                manager.get_online_user_ids_in_chat,
+                False,
+                lambda: (self.busy_chat(),),
+            ),
+            "typing_allowed": (
+                manager.typing_allowed,
+                False,
+                lambda: (rng.choice(self.user_ids), self.busy_chat()),
+            ),
+            "connect_disconnect": (connect_disconnect, True, lambda: (uuid.uuid4(),)),
+        }
+
+
+async def run_batch(fixture: Fixture, func, is_async: bool, batch: list) -> float:
+    started = time.perf_counter()
+    if is_async:
+        for args in batch:
+            await func(*args)
+    else:
+        for args in batch:
+            func(*args)
+    elapsed = time.perf_counter() - started
+    await fixture.drain()
+    return elapsed
+
+
+async def measure(fixture: Fixture, operation: tuple, min_time: float, alloc_ops: int):
+    func, is_async, make_args = operation
+    ops = 0
+    elapsed = 0.0
+    size = 1
+    while elapsed < min_time:
+        batch = [make_args() for _ in range(size)]
+        elapsed += await run_batch(fixture, func, is_async, batch)
+        ops += size
+        size = min(size * 2, MAX_BATCH)
+
+    # Replay under tracemalloc (several times slower), capped at the timed count.
+    alloc_ops = min(alloc_ops, ops)
+    batch = [make_args() for _ in range(alloc_ops)]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    for start in range(0, alloc_ops, MAX_BATCH):
+        await run_batch(fixture, func, is_async, batch[start : start + MAX_BATCH])
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "ops": ops,
+        "ops_per_sec": ops / elapsed,
+        "usec_per_op": elapsed / ops * 1e6,
+        "retained_bytes_per_op": (current - before) / alloc_ops,
+        "peak_kb": (peak - before) / 1024,
+    }
+
+
+async def run_size(users: int, args) -> dict:
+    rng = random.Random(args.seed)
+    fixture = Fixture(users, args.dist, args.zipf_s, rng)
+    result = {"connections": users, "chats": len(fixture.chat_ids)}
+    result["largest_chat"] = max(fixture.sizes)
+    result.update(await fixture.connect_all())
+    result["operations"] = {}
+    for name, operation in fixture.operations().items():
+        if args.only and name not in args.only:
+            continue
+        result["operations"][name] = await measure(
+            fixture, operation, args.min_time, args.alloc_ops
+        )
+    for uid in fixture.user_ids:
+        fixture.manager.disconnect(uid)
+    await fixture.drain()
+    return result
+
+
+def print_table(result: dict):
+    print(
+        f"{'connections':>11s} {'operation':30s} {'ops/s':>12s} {'us/op':>9s} "
+        f"{'B/op kept':>10s} {'peak KB':>9s}"
+    )
+    for size in result["results"]:
+        for name, stats in size["operations"].items():
+            print(
+                f"{size['connections']:>11d} {name:30s} "
+                f"{stats['ops_per_sec']:12.0f} {stats['usec_per_op']:9.2f} "
+                f"{stats['retained_bytes_per_op']:10.1f} {stats['peak_kb']:9.1f}"
+            )
+        print(
+            f"{size['connections']:>11d} {'(bytes per connection)':30s} "
+            f"{size['bytes_per_connection']:12.0f}"
+        )
+
+
+def compare(current: dict, baseline: dict):
+    old_sizes = {size["connections"]: size for size in baseline["results"]}
+    print(f"{'connections':>11s} {'operation':30s} {'ops/s change':>13s}")
+    for size in current["results"]:
+        old = old_sizes.get(size["connections"])
+        if old is None:
+            continue
+        for name, stats in size["operations"].items():
+            previous = old["operations"].get(name)
+            if previous is None:
+                continue
+            change = (stats["ops_per_sec"] - previous["ops_per_sec"]) / previous[
+                "ops_per_sec"
+            ]
+            print(f"{size['connections']:>11d} {name:30s} {change * 100:+12.1f}%")
+
+
+async def run(args) -> dict:
+    results = []
+    for users in args.connections:
+        results.append(await run_size(users, args))
+    config = vars(args).copy()
+    config.pop("output")
+    config.pop("baseline")
+    return {"config": config, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--connections",
+        type=lambda value: [int(n) for n in value.split(",")],
+        default=[1_000, 10_000, 100_000],
+    )
+    parser.add_argument("--dist", choices=("uniform", "zipf"), default="zipf")
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--min-time", type=float, default=0.5)
+    parser.add_argument("--alloc-ops", type=int, default=1_000)
+    parser.add_argument("--only", action="append", metavar="OPERATION")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_table(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
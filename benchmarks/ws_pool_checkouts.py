@@ -0,0 +1,135 @@
+"""Pool checkouts per 1k WebSocket frames, legacy loop vs. current endpoint.
+
+Runs against an in-memory SQLite database so it needs no server:
+
+    python benchmarks/ws_pool_checkouts.py [--frames 1000]
+
+"legacy" replays what the receive loop did before: one session per frame and a
+chat_participants lookup for every action. "current" drives the real
+``messages.api_ws.websocket_endpoint`` with a fake socket.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("database_url", "sqlite+aiosqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+from starlette.websockets import WebSocketDisconnect, WebSocketState  # noqa: E402
+
+import messages.api_ws as api_ws  # noqa: E402
+from chats.models import Chat, ChatParticipant, ChatType  # noqa: E402
+from chats.repositories import ChatRepository  # noqa: E402
+from database import Base  # noqa: E402
+from users.models import User  # noqa: E402
+from users.services import UserService  # noqa: E402
+
+MIX = ("typing", "typing", "typing", "unsubscribe", "subscribe", "ping")
+
+
+class FakeWebSocket:
+    application_state = WebSocketState.CONNECTED
+
+    def __init__(self, frames: list[str]):
+        self.frames = frames
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self) -> str:
+        if not self.frames:
+            raise WebSocketDisconnect(code=1000)
+        return self.frames.pop(0)
+
+    async def receive(self):
+        try:
+            return {"type": "websocket.receive", "text": await self.receive_text()}
+        except WebSocketDisconnect as e:
+            return {"type": "websocket.disconnect", "code": e.code}
+
+    async def send_text(self, data: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        self.application_state = WebSocketState.DISCONNECTED
+
+
+async def setup():
+    engine = create_async_engine(
+        "sqlite+aiosqlite://",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False},
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as session:
+        user = User(name="bench", email="bench@example.com", password="x")
+        chat = Chat(title="bench", type=ChatType.group)
+        session.add_all([user, chat])
+        await session.flush()
+        session.add(ChatParticipant(chat_id=chat.id, user_id=user.id))
+        await session.commit()
+    return engine, session_factory, user.id, chat.id
+
+
+def frames_for(chat_id: uuid.UUID, count: int) -> list[dict]:
+    return [
+        {"action": MIX[i % len(MIX)], "chat_id": str(chat_id), "is_typing": True}
+        for i in range(count)
+    ]
+
+
+async def run_legacy(session_factory, user_id, chat_id, frames):
+    for frame in frames:
+        async with session_factory() as session:
+            if frame["action"] != "ping":
+                await ChatRepository.is_participant(session, chat_id, user_id)
+
+
+async def run_current(user_id, frames):
+    token = UserService.create_access_token({"sub": str(user_id)})
+    raw = [json.dumps({"action": "auth", "token": token})]
+    raw += [json.dumps(frame) for frame in frames]
+    await api_ws.websocket_endpoint(FakeWebSocket(raw))
+
+
+async def main(frame_count: int):
+    engine, session_factory, user_id, chat_id = await setup()
+    api_ws.async_session = session_factory
+    checkouts = 0
+
+    def on_checkout(*args):
+        nonlocal checkouts
+        checkouts += 1
+
+    event.listen(engine.sync_engine, "checkout", on_checkout)
+    frames = frames_for(chat_id, frame_count)
+    per_1k = 1000 / frame_count
+
+    await run_legacy(session_factory, user_id, chat_id, frames)
+    legacy = checkouts
+    checkouts = 0
+    await run_current(user_id, frames)
+    current = checkouts
+
+    print(f"frames: {frame_count} (mix: {', '.join(MIX)})")
+    print(f"legacy  checkouts per 1k frames: {legacy * per_1k:.0f}")
+    print(f"current checkouts per 1k frames: {current * per_1k:.0f}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=1000)
+    asyncio.run(main(parser.parse_args().frames))
@@ -1,6 +1,7 @@
 import uuid
+from typing import Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from chats.models import Chat
@@ -10,10 +11,11 @@ from chats.schemas import (
     ChatParticipantReadSchema,
     ChatReadSchema,
     DetailResponseSchema,
+    InboxPageSchema,
 )
 from chats.services import ChatService
 from dependencies import get_current_user, get_session
-from users.models import User
+from users.auth import Principal
 
 chat_router = APIRouter(prefix="/api/chats", tags=["chat"])
 
@@ -21,7 +23,7 @@ chat_router = APIRouter(prefix="/api/chats", tags=["chat"])
 @chat_router.post("/", response_model=ChatReadSchema)
 async def create_chat(
     data: ChatCreateSchema,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
     return await ChatService.create_chat(session, data, current_user.id)
@@ -29,17 +31,27 @@ async def create_chat(
 
 @chat_router.get("/my", response_model=list[ChatReadSchema])
 async def get_my_chat(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
 
     return await ChatService.get_user_chats(session, current_user.id)
 
 
+@chat_router.get("/inbox", response_model=InboxPageSchema)
+async def get_inbox(
+    current_user: Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+    limit: int = Query(30, ge=1, le=100),
+    cursor: Optional[str] = None,
+):
+    return await ChatService.get_inbox(session, current_user.id, limit, cursor)
+
+
 @chat_router.get("/{chat_id}", response_model=ChatReadSchema)
 async def get_chat(
     chat_id: uuid.UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
     await ChatService.ensure_member(session, chat_id, current_user.id)
@@ -50,7 +62,7 @@ async def get_chat(
 async def add_member(
     chat_id: uuid.UUID,
     user_id: uuid.UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
     return await ChatService.add_member(session, chat_id, user_id, current_user.id)
@@ -60,7 +72,7 @@ async def add_member(
 async def remove_member(
     chat_id: uuid.UUID,
     user_id: uuid.UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
     await ChatService.remove_member(session, chat_id, user_id, current_user.id)
@@ -70,7 +82,7 @@ async def remove_member(
 @chat_router.delete("/{chat_id}/leave_chat", response_model=DetailResponseSchema)
 async def leave_chat(
     chat_id: uuid.UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
     await ChatService.leave_chat(session, chat_id, current_user.id)
@@ -80,7 +92,7 @@ async def leave_chat(
 @chat_router.get("/{chat_id}/participants", response_model=ChatParticipantListSchema)
 async def get_participants(
     chat_id: uuid.UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
     await ChatService.ensure_member(session, chat_id, current_user.id)
@@ -0,0 +1,116 @@
+import time
+import uuid
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from config import settings
+from metrics import StatsCollector
+
+GENERATION_STRIPES = 4096
+
+
+class MembershipCache:
+    """Per-process answers to "is this user in this chat".
+
+    Invalidations are shared with other workers through ``broker``. Each one
+    also bumps a generation stripe, so a miss whose read raced it does not
+    write its stale answer back.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 100_000,
+        ttl_sec: float = 30.0,
+        negative_ttl_sec: float = 5.0,
+    ):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self.negative_ttl_sec = negative_ttl_sec
+        self._entries: OrderedDict[tuple[uuid.UUID, uuid.UUID], tuple[bool, float]] = (
+            OrderedDict()
+        )
+        self._generations = [0] * GENERATION_STRIPES
+        self.broker = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _stripe(key: tuple[uuid.UUID, uuid.UUID]) -> int:
+        return hash(key) % GENERATION_STRIPES
+
+    def generation(self, chat_id: uuid.UUID, user_id: uuid.UUID) -> int:
+        """Read before querying the DB and pass it back to ``set``."""
+        return self._generations[self._stripe((chat_id, user_id))]
+
+    def get(self, chat_id: uuid.UUID, user_id: uuid.UUID) -> Optional[bool]:
+        key = (chat_id, user_id)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(
+        self,
+        chat_id: uuid.UUID,
+        user_id: uuid.UUID,
+        is_member: bool,
+        generation: Optional[int] = None,
+    ):
+        key = (chat_id, user_id)
+        if (
+            generation is not None
+            and generation != self._generations[self._stripe(key)]
+        ):
+            return
+        ttl = self.ttl_sec if is_member else self.negative_ttl_sec
+        self._entries[key] = (is_member, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(
+        self,
+        chat_id: uuid.UUID,
+        user_ids: Iterable[uuid.UUID],
+        publish: bool = True,
+    ):
+        user_ids = list(user_ids)
+        for user_id in user_ids:
+            key = (chat_id, user_id)
+            self._entries.pop(key, None)
+            self._generations[self._stripe(key)] += 1
+        if publish and self.broker is not None and self.broker.has_peers:
+            self.broker.publish(
+                {
+                    "kind": "membership",
+                    "chat_id": str(chat_id),
+                    "user_ids": [str(user_id) for user_id in user_ids],
+                }
+            )
+
+    def apply_remote(self, event: dict):
+        self.invalidate(
+            uuid.UUID(event["chat_id"]),
+            [uuid.UUID(user_id) for user_id in event["user_ids"]],
+            publish=False,
+        )
+
+    def clear(self):
+        self._entries.clear()
+        self._generations = [g + 1 for g in self._generations]
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+membership_cache = MembershipCache(
+    max_size=settings.membership_cache_size,
+    ttl_sec=settings.membership_cache_ttl_sec,
+    negative_ttl_sec=settings.membership_cache_negative_ttl_sec,
+)
+StatsCollector("membership_cache", membership_cache.stats)
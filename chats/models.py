@@ -2,7 +2,16 @@ import enum
 import uuid
 from datetime import datetime, timezone
 
-from sqlalchemy import Column, DateTime, Enum, ForeignKey, String, UniqueConstraint
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+    String,
+    UniqueConstraint,
+)
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 
@@ -32,6 +41,18 @@ class Chat(Base):
     created_at = Column(
         DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
     )
+    # Denormalized from messages on insert so the inbox needs no per-chat lookup.
+    last_message_at = Column(DateTime(timezone=True), nullable=True)
+    last_message_id = Column(UUID(as_uuid=True), nullable=True)
+    # Highest messages.seq handed out in this chat.
+    last_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
+    # Canonical (smaller, larger) user pair, set for personal chats only.
+    user_low = Column(ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    user_high = Column(ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_low", "user_high", name="uq_chats_personal_pair"),
+    )
 
     participants = relationship(
         "ChatParticipant", back_populates="chat", cascade="all, delete-orphan"
@@ -47,6 +68,7 @@ class ChatParticipant(Base):
         UniqueConstraint(
             "chat_id", "user_id", name="uq_chat_participants_chat_id_user_id"
         ),
+        Index("ix_chat_participants_user_id_chat_id", "user_id", "chat_id"),
     )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -1,10 +1,14 @@
 import uuid
+from datetime import datetime
 
 from fastapi import HTTPException
-from sqlalchemy import distinct, func, select
+from sqlalchemy import and_, func, or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
 from chats.models import Chat, ChatParticipant, ChatType, ParticipantRole
+from messages.models import ChatReadState, Messages
 
 
 class ChatRepository:
@@ -15,6 +19,55 @@ class ChatRepository:
         )
         return list(result.scalars().all())
 
+    @staticmethod
+    async def get_inbox(
+        session: AsyncSession,
+        user_id: uuid.UUID,
+        limit: int,
+        before: tuple[datetime, uuid.UUID] | None = None,
+    ) -> list[tuple[Chat, Messages | None, ChatReadState | None, int]]:
+        activity_at = func.coalesce(Chat.last_message_at, Chat.created_at)
+        last_message = aliased(Messages)
+        unread_count = (
+            select(func.count(Messages.id))
+            .where(
+                Messages.chat_id == Chat.id,
+                Messages.sender_id != user_id,
+                or_(
+                    ChatReadState.last_read_at.is_(None),
+                    tuple_(Messages.timestamp, Messages.id)
+                    > tuple_(
+                        ChatReadState.last_read_at, ChatReadState.last_read_message_id
+                    ),
+                ),
+            )
+            .correlate(Chat, ChatReadState)
+            .scalar_subquery()
+        )
+        stmt = (
+            select(Chat, last_message, ChatReadState, unread_count)
+            .join(
+                ChatParticipant,
+                and_(
+                    ChatParticipant.chat_id == Chat.id,
+                    ChatParticipant.user_id == user_id,
+                ),
+            )
+            .outerjoin(last_message, last_message.id == Chat.last_message_id)
+            .outerjoin(
+                ChatReadState,
+                and_(
+                    ChatReadState.chat_id == Chat.id,
+                    ChatReadState.user_id == user_id,
+                ),
+            )
+        )
+        if before is not None:
+            stmt = stmt.where(tuple_(activity_at, Chat.id) < tuple_(*before))
+        stmt = stmt.order_by(activity_at.desc(), Chat.id.desc()).limit(limit)
+        result = await session.execute(stmt)
+        return [tuple(row) for row in result.all()]
+
     @staticmethod
     async def list_user_chat_ids(
         session: AsyncSession, user_id: uuid.UUID
@@ -46,6 +99,18 @@ class ChatRepository:
         )
         return result.scalars().first()
 
+    @staticmethod
+    async def get_participants_by_user(
+        session: AsyncSession, chat_id: uuid.UUID, user_ids: list[uuid.UUID]
+    ) -> dict[uuid.UUID, ChatParticipant]:
+        result = await session.execute(
+            select(ChatParticipant).where(
+                ChatParticipant.chat_id == chat_id,
+                ChatParticipant.user_id.in_(user_ids),
+            )
+        )
+        return {p.user_id: p for p in result.scalars().all()}
+
     @staticmethod
     async def get_participants(
         session: AsyncSession, chat_id: uuid.UUID
@@ -71,6 +136,11 @@ class ChatRepository:
             await session.delete(participant)
             await session.flush()
 
+    @staticmethod
+    async def delete_participant(session: AsyncSession, participant: ChatParticipant):
+        await session.delete(participant)
+        await session.flush()
+
     @staticmethod
     async def is_participant(
         session: AsyncSession, chat_id: uuid.UUID, user_id: uuid.UUID
@@ -85,26 +155,56 @@ class ChatRepository:
     @staticmethod
     async def change_role(
         session: AsyncSession,
-        chat_id: uuid.UUID,
-        user_id: uuid.UUID,
+        participant: ChatParticipant,
         new_role: ParticipantRole,
     ):
-        participant = await ChatRepository.get_participant(session, chat_id, user_id)
         participant.role = new_role
         await session.flush()
 
+    @staticmethod
+    def personal_pair(
+        user1: uuid.UUID, user2: uuid.UUID
+    ) -> tuple[uuid.UUID, uuid.UUID]:
+        return (user1, user2) if user1 < user2 else (user2, user1)
+
     @staticmethod
     async def find_personal_chat(
         session: AsyncSession, user1: uuid.UUID, user2: uuid.UUID
     ) -> Chat | None:
+        user_low, user_high = ChatRepository.personal_pair(user1, user2)
         result = await session.execute(
-            select(Chat)
-            .join(ChatParticipant)
-            .where(
-                Chat.type == ChatType.personal,
-                ChatParticipant.user_id.in_([user1, user2]),
+            select(Chat).where(Chat.user_low == user_low, Chat.user_high == user_high)
+        )
+        return result.scalars().first()
+
+    @staticmethod
+    async def release_personal_pair(session: AsyncSession, chat_id: uuid.UUID):
+        """Detach a personal chat from its pair so the pair can open a new one."""
+        await session.execute(
+            update(Chat)
+            .where(Chat.id == chat_id, Chat.type == ChatType.personal)
+            .values(user_low=None, user_high=None)
+        )
+
+    @staticmethod
+    async def create_personal_chat(
+        session: AsyncSession,
+        user1: uuid.UUID,
+        user2: uuid.UUID,
+        title: str | None = None,
+    ) -> Chat | None:
+        """Insert the chat for this pair, or return None if it already exists."""
+        user_low, user_high = ChatRepository.personal_pair(user1, user2)
+        result = await session.execute(
+            insert(Chat)
+            .values(
+                id=uuid.uuid4(),
+                title=title,
+                type=ChatType.personal,
+                user_low=user_low,
+                user_high=user_high,
             )
-            .group_by(Chat.id)
-            .having(func.count(distinct(ChatParticipant.user_id)) == 2)
+            .on_conflict_do_nothing(index_elements=["user_low", "user_high"])
+            .returning(Chat)
         )
         return result.scalars().first()
@@ -1,9 +1,12 @@
 import uuid
+from datetime import datetime
 from enum import Enum
 from typing import List, Optional
 
 from pydantic import BaseModel
 
+from messages.schemas import MessageReadSchema
+
 
 class ChatTypeSchema(str, Enum):
     personal = "personal"
@@ -20,7 +23,7 @@ class ChatReadSchema(BaseModel):
     id: uuid.UUID
     title: Optional[str]
     type: ChatTypeSchema
-    created_at: Optional[str]
+    created_at: Optional[datetime]
 
     class Config:
         from_attributes = True
@@ -58,3 +61,16 @@ class ChatDetailSchema(ChatReadSchema):
 
 class DetailResponseSchema(BaseModel):
     detail: str
+
+
+class InboxItemSchema(BaseModel):
+    chat: ChatReadSchema
+    last_message_at: Optional[datetime] = None
+    last_message: Optional[MessageReadSchema] = None
+    last_read_message_id: Optional[uuid.UUID] = None
+    unread_count: int = 0
+
+
+class InboxPageSchema(BaseModel):
+    items: List[InboxItemSchema]
+    next_cursor: Optional[str] = None
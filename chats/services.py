@@ -3,9 +3,11 @@ import uuid
 from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from chats.cache import membership_cache
 from chats.models import Chat, ChatParticipant, ChatType, ParticipantRole
 from chats.repositories import ChatRepository
 from chats.schemas import ChatCreateSchema
+from pagination import decode_cursor, encode_cursor
 
 
 class ChatService:
@@ -14,7 +16,7 @@ class ChatService:
     async def create_chat(
         session: AsyncSession, data: ChatCreateSchema, creator_id: uuid.UUID
     ) -> Chat:
-        chat_type = data.type
+        chat_type = ChatType(data.type)
         if chat_type == ChatType.personal:
             if len(data.participant_ids) != 1:
                 raise HTTPException(
@@ -26,42 +28,56 @@ class ChatService:
                 raise HTTPException(
                     status_code=400, detail="Cannot create personal chat with yourself"
                 )
-
-            existing = await ChatRepository.find_personal_chat(
-                session, creator_id, other_id
+            return await ChatService.get_or_create_personal_chat(
+                session, creator_id, other_id, data.title
             )
-            if existing:
-                return existing
 
         chat = Chat(title=data.title, type=chat_type)
         chat = await ChatRepository.create(session, chat)
 
-        if chat.type == ChatType.group:
-            participants: list[ChatParticipant] = [
+        participants: list[ChatParticipant] = [
+            ChatParticipant(
+                chat_id=chat.id, user_id=creator_id, role=ParticipantRole.owner
+            )
+        ]
+        for uid in data.participant_ids:
+            participants.append(
                 ChatParticipant(
-                    chat_id=chat.id, user_id=creator_id, role=ParticipantRole.owner
+                    chat_id=chat.id, user_id=uid, role=ParticipantRole.member
                 )
-            ]
-            for uid in data.participant_ids:
-                participants.append(
-                    ChatParticipant(
-                        chat_id=chat.id, user_id=uid, role=ParticipantRole.member
-                    )
-                )
-        else:
-            participants = [
-                ChatParticipant(
-                    chat_id=chat.id, user_id=creator_id, role=ParticipantRole.member
-                ),
-                ChatParticipant(
-                    chat_id=chat.id,
-                    user_id=data.participant_ids[0],
-                    role=ParticipantRole.member,
-                ),
-            ]
+            )
 
         await ChatRepository.add_participants(session, participants)
         await session.commit()
+        membership_cache.invalidate(chat.id, [p.user_id for p in participants])
+        return chat
+
+    @staticmethod
+    async def get_or_create_personal_chat(
+        session: AsyncSession,
+        user_id: uuid.UUID,
+        other_id: uuid.UUID,
+        title: str | None = None,
+    ) -> Chat:
+        existing = await ChatRepository.find_personal_chat(session, user_id, other_id)
+        if existing:
+            return existing
+
+        # A concurrent create of the same pair blocks on the unique index and
+        # then finds the winner's chat instead of inserting a duplicate.
+        chat = await ChatRepository.create_personal_chat(
+            session, user_id, other_id, title
+        )
+        if chat is None:
+            return await ChatRepository.find_personal_chat(session, user_id, other_id)
+
+        participants = [
+            ChatParticipant(chat_id=chat.id, user_id=uid, role=ParticipantRole.member)
+            for uid in (user_id, other_id)
+        ]
+        await ChatRepository.add_participants(session, participants)
+        await session.commit()
+        membership_cache.invalidate(chat.id, [user_id, other_id])
         return chat
 
     @staticmethod
@@ -75,6 +91,40 @@ class ChatService:
     async def get_user_chats(session: AsyncSession, user_id: uuid.UUID) -> list[Chat]:
         return await ChatRepository.get_user_chats(session, user_id)
 
+    @staticmethod
+    async def get_inbox(
+        session: AsyncSession,
+        user_id: uuid.UUID,
+        limit: int,
+        cursor: str | None = None,
+    ) -> dict:
+        rows = await ChatRepository.get_inbox(
+            session,
+            user_id,
+            limit + 1,
+            before=decode_cursor(cursor) if cursor else None,
+        )
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last_chat = rows[-1][0]
+            next_cursor = encode_cursor(
+                last_chat.last_message_at or last_chat.created_at, last_chat.id
+            )
+        items = [
+            {
+                "chat": chat,
+                "last_message_at": chat.last_message_at,
+                "last_message": last_message,
+                "last_read_message_id": (
+                    read_state.last_read_message_id if read_state else None
+                ),
+                "unread_count": unread_count,
+            }
+            for chat, last_message, read_state, unread_count in rows
+        ]
+        return {"items": items, "next_cursor": next_cursor}
+
     @staticmethod
     async def list_user_chat_ids(
         session: AsyncSession, user_id: uuid.UUID
@@ -85,7 +135,12 @@ class ChatService:
     async def ensure_member(
         session: AsyncSession, chat_id: uuid.UUID, user_id: uuid.UUID
     ):
-        if not await ChatRepository.is_participant(session, chat_id, user_id):
+        is_member = membership_cache.get(chat_id, user_id)
+        if is_member is None:
+            generation = membership_cache.generation(chat_id, user_id)
+            is_member = await ChatRepository.is_participant(session, chat_id, user_id)
+            membership_cache.set(chat_id, user_id, is_member, generation)
+        if not is_member:
             raise HTTPException(status_code=403, detail="User not in chat")
 
     @staticmethod
@@ -110,13 +165,15 @@ class ChatService:
         if new_role == ParticipantRole.owner:
             raise HTTPException(status_code=403, detail="You cant give owner role")
 
-        requester = await ChatRepository.get_participant(session, chat_id, requester_id)
-        user = await ChatRepository.get_participant(session, chat_id, user_id)
+        found = await ChatRepository.get_participants_by_user(
+            session, chat_id, [requester_id, user_id]
+        )
+        requester, user = found.get(requester_id), found.get(user_id)
         if requester is None or user is None:
             raise HTTPException(status_code=403, detail="User not in chat")
         if requester.role == ParticipantRole.member:
             raise HTTPException(status_code=403, detail="Not allowed to change role")
-        await ChatRepository.change_role(session, chat_id, user_id, new_role)
+        await ChatRepository.change_role(session, user, new_role)
         await session.commit()
 
     @staticmethod
@@ -126,13 +183,15 @@ class ChatService:
         user_id: uuid.UUID,
         requester_id: uuid.UUID,
     ) -> ChatParticipant:
-        requester = await ChatRepository.get_participant(session, chat_id, requester_id)
+        found = await ChatRepository.get_participants_by_user(
+            session, chat_id, [requester_id, user_id]
+        )
+        requester = found.get(requester_id)
         if requester is None:
             raise HTTPException(403, "You are not in this chat")
         if requester.role == ParticipantRole.member:
             raise HTTPException(403, "Not allowed to add members")
-        existing = await ChatRepository.get_participant(session, chat_id, user_id)
-        if existing:
+        if user_id in found:
             raise HTTPException(status_code=409, detail="User already in chat")
         new_member = [
             ChatParticipant(
@@ -141,6 +200,7 @@ class ChatService:
         ]
         await ChatRepository.add_participants(session, new_member)
         await session.commit()
+        membership_cache.invalidate(chat_id, [user_id])
         return new_member[0]
 
     @staticmethod
@@ -150,8 +210,10 @@ class ChatService:
         user_id: uuid.UUID,
         requester_id: uuid.UUID,
     ) -> ChatParticipant:
-        requester = await ChatRepository.get_participant(session, chat_id, requester_id)
-        existing = await ChatRepository.get_participant(session, chat_id, user_id)
+        found = await ChatRepository.get_participants_by_user(
+            session, chat_id, [requester_id, user_id]
+        )
+        requester, existing = found.get(requester_id), found.get(user_id)
         if requester is None or existing is None:
             raise HTTPException(404, "User not found in chat")
         if requester.role == ParticipantRole.member:
@@ -161,13 +223,18 @@ class ChatService:
             and existing.role != ParticipantRole.member
         ):
             raise HTTPException(403, "Admin can remove only members")
-        await ChatRepository.remove_participant(session, chat_id, user_id)
+        await ChatRepository.delete_participant(session, existing)
         await session.commit()
+        membership_cache.invalidate(chat_id, [user_id])
 
     @staticmethod
     async def leave_chat(session: AsyncSession, chat_id: uuid.UUID, user_id: uuid.UUID):
         participant = await ChatRepository.get_participant(session, chat_id, user_id)
         if not participant:
             raise HTTPException(status_code=404, detail="You are not in this chat")
-        await ChatRepository.remove_participant(session, chat_id, user_id)
+        await ChatRepository.delete_participant(session, participant)
+        # Otherwise get_or_create_personal_chat keeps returning a chat the
+        # leaver is no longer in.
+        await ChatRepository.release_personal_pair(session, chat_id)
         await session.commit()
+        membership_cache.invalidate(chat_id, [user_id])
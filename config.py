@@ -1,3 +1,5 @@
+from typing import Literal, Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -6,6 +8,52 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str
 
+    # "dev" and "prod" pick defaults in database.DB_PROFILES; any db_* value
+    # set here overrides the profile.
+    db_profile: Literal["dev", "prod"] = "dev"
+    db_echo: Optional[bool] = None
+    db_pool_size: Optional[int] = None
+    db_max_overflow: Optional[int] = None
+    db_pool_timeout_sec: Optional[float] = None
+    db_pool_recycle_sec: Optional[int] = None
+    db_pool_pre_ping: Optional[bool] = None
+    db_statement_cache_size: Optional[int] = None
+    db_prewarm_connections: Optional[int] = None
+    sql_slow_query_ms: float = 200.0
+    sql_repeat_threshold: int = 5
+
+    ws_send_queue_size: int = 256
+    ws_slow_consumer_policy: Literal["drop_ephemeral", "disconnect"] = "drop_ephemeral"
+    ws_json_codec: Literal["auto", "orjson", "json"] = "auto"
+    ws_broker: Literal["memory", "postgres"] = "memory"
+    ws_broker_channel: str = "chat_events"
+    ws_presence_flush_ms: float = 250.0
+    ws_presence_grace_sec: float = 10.0
+    ws_ping_interval_sec: float = 20.0
+    ws_idle_timeout_sec: float = 60.0
+    ws_typing_mode: Literal["relay", "aggregate"] = "relay"
+    ws_typing_interval_ms: float = 1000.0
+    ws_typing_ttl_sec: float = 5.0
+    ws_typing_large_chat: int = 100
+    ws_typing_suppress_above: int = 1000
+    ws_ingest_enabled: bool = False
+    ws_ingest_max_batch: int = 64
+    ws_ingest_max_delay_ms: float = 5.0
+    ws_resume_max_gap: int = 1000
+    ws_resume_batch_size: int = 100
+
+    # None enables the cache only with the postgres broker: with the memory
+    # broker, writes on other uvicorn workers would never reach it.
+    history_cache_enabled: Optional[bool] = None
+    history_cache_per_chat: int = 100
+    history_cache_max_mb: int = 64
+    membership_cache_size: int = 100_000
+    membership_cache_ttl_sec: float = 30.0
+    membership_cache_negative_ttl_sec: float = 5.0
+
+    password_hash_workers: int = 2
+    password_hash_max_pending: int = 64
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
 
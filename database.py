@@ -1,13 +1,156 @@
+import asyncio
+import logging
+import time
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from config import Settings, settings
+from metrics import DB_QUERY_SECONDS, StatsCollector
+from sql_instrumentation import instrument_engine
 
-from config import settings
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = settings.database_url
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+DB_PROFILES = {
+    "dev": {
+        "echo": True,
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_timeout_sec": 30.0,
+        "pool_recycle_sec": -1,
+        "pool_pre_ping": False,
+        "statement_cache_size": 100,
+        "prewarm_connections": 0,
+    },
+    "prod": {
+        "echo": False,
+        "pool_size": 20,
+        "max_overflow": 10,
+        "pool_timeout_sec": 5.0,
+        "pool_recycle_sec": 1800,
+        "pool_pre_ping": True,
+        "statement_cache_size": 500,
+        "prewarm_connections": 20,
+    },
+}
+
+
+def db_options(config: Settings) -> dict:
+    options = dict(DB_PROFILES[config.db_profile])
+    for key in options:
+        value = getattr(config, f"db_{key}")
+        if value is not None:
+            options[key] = value
+    return options
+
+
+class PoolStats:
+    def __init__(self):
+        self.waits_total = 0
+        self.wait_seconds_total = 0.0
+        self.max_wait_sec = 0.0
+        self.timeouts_total = 0
+
+    def record_wait(self, seconds: float):
+        self.waits_total += 1
+        self.wait_seconds_total += seconds
+        self.max_wait_sec = max(self.max_wait_sec, seconds)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long checkouts wait and how often they time out."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.stats.timeouts_total += 1
+            raise
+        finally:
+            self.stats.record_wait(time.perf_counter() - started)
+
+
+def build_engine(url: str, config: Settings = settings):
+    options = db_options(config)
+    connect_args = {}
+    if make_url(url).get_driver_name() == "asyncpg":
+        connect_args["statement_cache_size"] = options["statement_cache_size"]
+    return create_async_engine(
+        url,
+        echo=options["echo"],
+        poolclass=InstrumentedPool,
+        pool_size=options["pool_size"],
+        max_overflow=options["max_overflow"],
+        pool_timeout=options["pool_timeout_sec"],
+        pool_recycle=options["pool_recycle_sec"],
+        pool_pre_ping=options["pool_pre_ping"],
+        connect_args=connect_args,
+    )
+
+
+engine = build_engine(DATABASE_URL)
+instrument_engine(engine, on_statement=DB_QUERY_SECONDS.observe)
 
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
 Base = declarative_base()
+
+
+async def prewarm_pool(count: int | None = None):
+    """Open pool connections up front so the first requests do not pay for them."""
+    if count is None:
+        count = db_options(settings)["prewarm_connections"]
+    count = min(count, engine.pool.size())
+    if count <= 0:
+        return
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(engine.connect() for _ in range(count)), return_exceptions=True
+    )
+    failures = [r for r in results if isinstance(r, BaseException)]
+    for connection in results:
+        if not isinstance(connection, BaseException):
+            await connection.close()
+    if failures:
+        logger.warning("Database pool pre-warm failed: %r", failures[0])
+        return
+    # Connection setup is not queueing; keep it out of the wait statistics.
+    engine.pool.stats = PoolStats()
+    logger.info(
+        "Pre-warmed %d database connections in %.0f ms",
+        count,
+        (time.perf_counter() - started) * 1000,
+    )
+
+
+def pool_stats() -> dict:
+    pool = engine.pool
+    stats = pool.stats
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "waits_total": stats.waits_total,
+        "avg_wait_ms": (
+            stats.wait_seconds_total * 1000 / stats.waits_total
+            if stats.waits_total
+            else 0.0
+        ),
+        "max_wait_ms": stats.max_wait_sec * 1000,
+        "timeouts_total": stats.timeouts_total,
+    }
+
+
+StatsCollector("db_pool", pool_stats)
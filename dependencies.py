@@ -5,6 +5,8 @@ from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database import async_session
+from users.auth import Principal
+from users.models import User
 from users.services import UserService
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/users/login")
@@ -19,12 +21,18 @@ async def get_session() -> AsyncSession:
 async def get_current_user(
     request: Request,
     token: Optional[str] = Depends(oauth2_scheme),
-    session: AsyncSession = Depends(get_session),
-):
+) -> Principal:
     if not token:
         token = request.cookies.get("access_token")
 
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    return await UserService.get_current_user_by_token(session, token)
+    return UserService.get_principal_by_token(token)
+
+
+async def get_current_user_model(
+    principal: Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+) -> User:
+    return await UserService.get_user_by_principal(session, principal)
@@ -1,18 +1,53 @@
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
 
 from chats.api import chat_router
+from config import settings
+from database import pool_stats, prewarm_pool
 from messages.api import messages_router
-from messages.api_ws import ws_router
+from messages.api_ws import start_realtime, stop_realtime, ws_router
+from metrics import MetricsMiddleware, metrics_router, preallocate_routes
 from users.api import user_router
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await prewarm_pool()
+    await start_realtime()
+    yield
+    await stop_realtime()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(user_router)
 app.include_router(chat_router)
 app.include_router(messages_router)
 app.include_router(ws_router)
+app.include_router(metrics_router)
+
+
+@app.get("/api/stats/db-pool")
+async def get_db_pool_stats():
+    return pool_stats()
+
+
+preallocate_routes(app)
+
+
+# Protocol-level pings are answered by every client's WebSocket stack, so
+# uvicorn closes a half-open socket after a missed pong (plus the 10 s
+# websockets waits for the close handshake) and the endpoint cleans up as on
+# any disconnect. Keep the Dockerfile/docker-compose flags in sync.
+UVICORN_WS_OPTIONS = {
+    "ws": "websockets",
+    "ws_ping_interval": settings.ws_ping_interval_sec,
+    "ws_ping_timeout": settings.ws_ping_interval_sec,
+}
 
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", reload=True)
+    uvicorn.run("main:app", reload=True, **UVICORN_WS_OPTIONS)
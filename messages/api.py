@@ -1,13 +1,23 @@
 import uuid
+from typing import Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from chats.services import ChatService
 from dependencies import get_current_user, get_session
-from messages.schemas import MarkReadSchema, MessageCreateSchema, MessageReadSchema
+from messages.schemas import (
+    HistoryOrderSchema,
+    MarkReadSchema,
+    MessageBatchCreateSchema,
+    MessageCreateSchema,
+    MessagePageSchema,
+    MessageReadSchema,
+    ReadUpToSchema,
+    ReadWatermarkSchema,
+)
 from messages.services import MessageService
-from users.models import User
+from users.auth import Principal
 
 messages_router = APIRouter(prefix="/api/messages", tags=["messages"])
 
@@ -15,7 +25,7 @@ messages_router = APIRouter(prefix="/api/messages", tags=["messages"])
 @messages_router.post("/", response_model=MessageReadSchema)
 async def send_message(
     data: MessageCreateSchema,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
     await ChatService.ensure_member(session, data.chat_id, current_user.id)
@@ -24,10 +34,21 @@ async def send_message(
     )
 
 
+@messages_router.post("/batch", response_model=list[MessageReadSchema])
+async def send_messages(
+    data: MessageBatchCreateSchema,
+    current_user: Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    return await MessageService.create_messages(
+        session=session, items=data.messages, sender_id=current_user.id
+    )
+
+
 @messages_router.get("/{chat_id}", response_model=list[MessageReadSchema])
 async def get_chat_history(
     chat_id: uuid.UUID,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
     limit: int = 50,
     offset: int = 0,
@@ -38,13 +59,63 @@ async def get_chat_history(
     )
 
 
-@messages_router.patch("/read")
+@messages_router.get("/{chat_id}/history", response_model=MessagePageSchema)
+async def get_chat_history_page(
+    chat_id: uuid.UUID,
+    current_user: Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    order: HistoryOrderSchema = HistoryOrderSchema.newest,
+):
+    await ChatService.ensure_member(session, chat_id, current_user.id)
+    if before is None and after is None and order == HistoryOrderSchema.newest:
+        cached = await MessageService.get_cached_newest_page(session, chat_id, limit)
+        if cached is not None:
+            return Response(content=cached, media_type="application/json")
+    return await MessageService.get_chat_page(
+        session=session,
+        chat_id=chat_id,
+        limit=limit,
+        before=before,
+        after=after,
+        order=order,
+    )
+
+
+@messages_router.get("/{chat_id}/read", response_model=list[ReadWatermarkSchema])
+async def get_read_states(
+    chat_id: uuid.UUID,
+    current_user: Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    await ChatService.ensure_member(session, chat_id, current_user.id)
+    return await MessageService.get_read_states(session=session, chat_id=chat_id)
+
+
+@messages_router.post("/{chat_id}/read", response_model=ReadWatermarkSchema)
+async def mark_read_up_to(
+    chat_id: uuid.UUID,
+    data: ReadUpToSchema,
+    current_user: Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    state, _ = await MessageService.mark_read_up_to(
+        session=session,
+        chat_id=chat_id,
+        message_id=data.message_id,
+        user_id=current_user.id,
+    )
+    return state
+
+
+@messages_router.patch("/read", response_model=list[ReadWatermarkSchema])
 async def mark_as_read(
     data: MarkReadSchema,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     session: AsyncSession = Depends(get_session),
 ):
-    messages = await MessageService.mark_as_read(
+    return await MessageService.mark_as_read(
         message_ids=data.message_ids, session=session, user_id=current_user.id
     )
-    return {"updated": [str(m.id) for m in messages]}
@@ -1,20 +1,304 @@
 import uuid
+import zlib
+from typing import Optional
 
-from fastapi import APIRouter, Depends, Query
-from jose import jwt
-from sqlalchemy.ext.asyncio import AsyncSession
-from starlette.websockets import WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, HTTPException
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from starlette.websockets import WebSocket, WebSocketDisconnect, WebSocketState
 
+from chats.cache import membership_cache
 from chats.services import ChatService
-from config import get_auth_data
-from database import async_session
-from dependencies import get_session
-from messages.schemas import MessageCreateSchema, MessageReadSchema
+from config import settings
+from database import async_session, engine
+from messages.broker import InMemoryBroker, PostgresBroker
+from messages.cache import history_cache
+from messages.codec import WireFormat, get_codec
+from messages.ingest import IngestPipeline
+from messages.schemas import (
+    MessageBatchCreateSchema,
+    MessageCreateSchema,
+    MessageReadSchema,
+    ReadWatermarkSchema,
+)
 from messages.services import MessageService
-from messages.ws_manager import ConnectionManager
+from messages.ws_manager import Connection, ConnectionManager
+from metrics import (
+    WS_FRAME_DB_QUERIES,
+    WS_FRAME_DB_SECONDS,
+    WS_RESUME_TOO_FAR,
+    WS_RESUMED_MESSAGES,
+    StatsCollector,
+)
+from sql_instrumentation import track_queries
+from users.services import UserService
 
 ws_router = APIRouter(tags=["websockets"])
-manager = ConnectionManager()
+codec = get_codec(settings.ws_json_codec)
+SERVER_BUSY = {"type": "error", "status": 503, "detail": "Server busy, try again later"}
+
+
+def build_broker():
+    if settings.ws_broker == "postgres":
+        return PostgresBroker(engine, channel=settings.ws_broker_channel, codec=codec)
+    return InMemoryBroker()
+
+
+manager = ConnectionManager(
+    max_queue_size=settings.ws_send_queue_size,
+    slow_consumer_policy=settings.ws_slow_consumer_policy,
+    codec=codec,
+    broker=build_broker(),
+    presence_flush_ms=settings.ws_presence_flush_ms,
+    presence_grace_sec=settings.ws_presence_grace_sec,
+    ping_interval_sec=settings.ws_ping_interval_sec,
+    idle_timeout_sec=settings.ws_idle_timeout_sec,
+    typing_mode=settings.ws_typing_mode,
+    typing_options={
+        "interval_ms": settings.ws_typing_interval_ms,
+        "ttl_sec": settings.ws_typing_ttl_sec,
+        "large_chat_size": settings.ws_typing_large_chat,
+        "suppress_above": settings.ws_typing_suppress_above,
+    },
+)
+ingest = (
+    IngestPipeline(
+        async_session,
+        max_batch_size=settings.ws_ingest_max_batch,
+        max_delay_ms=settings.ws_ingest_max_delay_ms,
+    )
+    if settings.ws_ingest_enabled
+    else None
+)
+history_cache.broker = manager.broker
+manager.event_handlers["history"] = history_cache.apply_remote
+membership_cache.broker = manager.broker
+manager.event_handlers["membership"] = membership_cache.apply_remote
+manager.broker.on_reconnect.append(history_cache.clear)
+manager.broker.on_reconnect.append(membership_cache.clear)
+StatsCollector("ws", manager.stats)
+StatsCollector("ws_presence", manager.presence.stats)
+if manager.typing is not None:
+    StatsCollector("ws_typing", manager.typing.stats)
+if ingest is not None:
+    StatsCollector("ws_ingest", ingest.stats)
+
+
+async def start_realtime():
+    await manager.start()
+    if ingest is not None:
+        await ingest.start()
+
+
+async def stop_realtime():
+    if ingest is not None:
+        await ingest.stop()
+    await manager.stop()
+
+
+# Ephemeral actions are answered from in-memory state; typing opens a session
+# only for the membership check, which the membership cache usually answers
+# without a statement (so no pool checkout). Persistent actions open a session
+# just for the statements they run.
+
+
+async def handle_ping(conn: Connection, data: dict):
+    await manager.send_to_user(conn.user_id, {"type": "pong", "ts": data.get("ts")})
+
+
+async def handle_pong(conn: Connection, data: dict):
+    manager.record_pong(conn)
+
+
+async def handle_unsubscribe(conn: Connection, data: dict):
+    manager.unsubscribe(conn.user_id, uuid.UUID(data.get("chat_id")))
+
+
+async def handle_typing(conn: Connection, data: dict):
+    chat_id = uuid.UUID(data.get("chat_id"))
+    if chat_id not in conn.subscriptions:
+        raise HTTPException(status_code=403, detail="Not subscribed to chat")
+    # The subscription outlives a removal from the chat, so re-check membership.
+    async with async_session() as session:
+        await ChatService.ensure_member(session, chat_id, conn.user_id)
+    is_typing = bool(data.get("is_typing", True))
+    if manager.typing is not None:
+        manager.typing.update(chat_id, conn.user_key, is_typing)
+        return
+    if not manager.typing_allowed(conn.user_id, chat_id, min_interval_sec=1.0):
+        return
+    await manager.broadcast(
+        chat_id,
+        {
+            "type": "typing",
+            "chat_id": str(chat_id),
+            "user_id": str(conn.user_id),
+            "is_typing": is_typing,
+        },
+        exclude_user_id=conn.user_id,
+        ephemeral=True,
+    )
+
+
+async def handle_subscribe(conn: Connection, data: dict):
+    chat_id = uuid.UUID(data.get("chat_id"))
+    async with async_session() as session:
+        await ChatService.ensure_member(session, chat_id, conn.user_id)
+    manager.subscribe(conn.user_id, chat_id)
+
+
+async def handle_send_message(conn: Connection, data: dict):
+    message_create = MessageCreateSchema(
+        chat_id=uuid.UUID(data.get("chat_id")),
+        text=data.get("text"),
+        client_msg_id=uuid.UUID(data.get("client_msg_id")),
+    )
+    async with async_session() as session:
+        await ChatService.ensure_member(session, message_create.chat_id, conn.user_id)
+        if ingest is None:
+            message = await MessageService.create_message(
+                session, message_create, conn.user_id
+            )
+    if ingest is not None:
+        message = await ingest.submit(message_create, conn.user_id)
+
+    await manager.broadcast(
+        message_create.chat_id,
+        MessageReadSchema.model_validate(message).model_dump(mode="json"),
+    )
+
+
+async def handle_send_messages(conn: Connection, data: dict):
+    batch = MessageBatchCreateSchema(messages=data.get("messages"))
+    async with async_session() as session:
+        messages = await MessageService.create_messages(
+            session, batch.messages, conn.user_id
+        )
+
+    # A client_msg_id repeated in the batch maps to the same row every time.
+    for message in {message.id: message for message in messages}.values():
+        await manager.broadcast(
+            message.chat_id,
+            MessageReadSchema.model_validate(message).model_dump(mode="json"),
+        )
+
+
+def read_watermark_event(state) -> dict:
+    return {
+        "type": "read.watermark",
+        **ReadWatermarkSchema.model_validate(state).model_dump(mode="json"),
+    }
+
+
+async def handle_read_up_to(conn: Connection, data: dict):
+    chat_id = uuid.UUID(data.get("chat_id"))
+    async with async_session() as session:
+        state, advanced = await MessageService.mark_read_up_to(
+            session, chat_id, uuid.UUID(data.get("message_id")), conn.user_id
+        )
+    if advanced:
+        await manager.broadcast(chat_id, read_watermark_event(state))
+
+
+async def handle_read_messages(conn: Connection, data: dict):
+    message_ids = [uuid.UUID(mid) for mid in data.get("message_ids", [])]
+    async with async_session() as session:
+        states = await MessageService.mark_as_read(session, message_ids, conn.user_id)
+
+    for state in states:
+        await manager.broadcast(state.chat_id, read_watermark_event(state))
+
+
+ACTION_HANDLERS = {
+    "ping": handle_ping,
+    "pong": handle_pong,
+    "typing": handle_typing,
+    "unsubscribe": handle_unsubscribe,
+    "subscribe": handle_subscribe,
+    "send_message": handle_send_message,
+    "send_messages": handle_send_messages,
+    "read_up_to": handle_read_up_to,
+    "read_messages": handle_read_messages,
+}
+
+
+def negotiate_wire(auth_data: dict) -> Optional[WireFormat]:
+    """Wire format requested in the auth frame; None when the client asked for nothing."""
+    encoding = auth_data.get("encoding", "json")
+    compression = auth_data.get("compression")
+    if encoding == "json" and compression is None:
+        return None
+    try:
+        return manager.wire_format(encoding, compression)
+    except ValueError:
+        return manager.default_wire
+
+
+def parse_resume(auth_data: dict) -> dict[uuid.UUID, int]:
+    """``{chat_id: last_seq}`` the client already has, from the auth frame."""
+    resume = auth_data.get("resume") or {}
+    return {uuid.UUID(chat_id): int(seq) for chat_id, seq in resume.items()}
+
+
+async def resume_chats(
+    conn: Connection, resume: dict[uuid.UUID, int], chat_ids: list[uuid.UUID]
+):
+    """Stream what the client missed in each chat, then switch it to live delivery.
+
+    Live broadcasts are held since the connection subscribed, and released
+    afterwards minus the messages the catch-up already covered.
+    """
+    member_of = set(chat_ids)
+    wanted = {chat_id: seq for chat_id, seq in resume.items() if chat_id in member_of}
+    caught_up: dict[uuid.UUID, int] = {}
+    try:
+        async with async_session() as session:
+            last_seqs = await MessageService.get_last_seqs(session, list(wanted))
+        for chat_id, after in wanted.items():
+            last_seq = last_seqs.get(chat_id, 0)
+            if after > last_seq or last_seq - after > settings.ws_resume_max_gap:
+                WS_RESUME_TOO_FAR.inc()
+                manager.send(
+                    conn,
+                    {
+                        "type": "resume.too_far",
+                        "chat_id": str(chat_id),
+                        "last_seq": last_seq,
+                    },
+                )
+                continue
+            while after < last_seq and conn.writer is not None:
+                # Let the client drain so a long catch-up never trips the
+                # slow-consumer limit.
+                await manager.wait_writable(conn, manager.max_queue_size // 2)
+                async with async_session() as session:
+                    messages = await MessageService.get_messages_after_seq(
+                        session, chat_id, after, settings.ws_resume_batch_size
+                    )
+                if not messages:
+                    break
+                after = messages[-1].seq
+                manager.send(
+                    conn,
+                    {
+                        "type": "resume.batch",
+                        "chat_id": str(chat_id),
+                        "messages": [
+                            MessageReadSchema.model_validate(m).model_dump(mode="json")
+                            for m in messages
+                        ],
+                    },
+                )
+                WS_RESUMED_MESSAGES.inc(amount=len(messages))
+            caught_up[chat_id] = after
+    finally:
+        manager.release(conn, caught_up)
+    manager.send(
+        conn,
+        {
+            "type": "resume.done",
+            "last_seq": {str(chat_id): seq for chat_id, seq in caught_up.items()},
+        },
+    )
 
 
 @ws_router.websocket("/ws")
@@ -23,7 +307,7 @@ async def websocket_endpoint(
 ):
     await websocket.accept()
     try:
-        auth_data = await websocket.receive_json()
+        auth_data = manager.codec.loads(await websocket.receive_text())
         if auth_data.get("action") != "auth":
             await websocket.close(code=1008)
             return
@@ -31,16 +315,30 @@ async def websocket_endpoint(
         if not token:
             await websocket.close(code=1008)
             return
-        token_data = get_auth_data()
-        payload = jwt.decode(
-            token, token_data["secret_key"], algorithms=[token_data["algorithm"]]
-        )
-        user_id = uuid.UUID(payload.get("sub"))
+        user_id = UserService.get_principal_by_token(token).id
+        wire = negotiate_wire(auth_data)
+        heartbeat = bool(auth_data.get("heartbeat", False))
+        resume = parse_resume(auth_data)
     except Exception:
         await websocket.close(code=1008)
         return
 
-    await manager.connect(user_id, websocket)
+    if wire is not None or heartbeat:
+        ack = {
+            "type": "auth.ok",
+            "encoding": (wire or manager.default_wire).encoding,
+            "compression": (wire or manager.default_wire).compression,
+        }
+        if heartbeat:
+            # The client must answer {"type": "ping"} with {"action": "pong"}
+            # (or send any frame) within idle_timeout_sec.
+            ack["ping_interval_sec"] = manager.ping_interval_sec
+            ack["idle_timeout_sec"] = manager.idle_timeout_sec
+        # Sent as JSON text so the client learns the format before switching.
+        await websocket.send_text(manager.codec.dumps(ack))
+    connection = await manager.connect(user_id, websocket, wire, heartbeat)
+    if resume:
+        manager.hold(connection)
 
     async with async_session() as session:
         chat_ids = await ChatService.list_user_chat_ids(session, user_id)
@@ -51,112 +349,47 @@ async def websocket_endpoint(
         user_id,
         {
             "type": "presence.snapshot_all",
-            "online_by_chat": {
-                str(cid): manager.get_online_user_ids_in_chat(cid) for cid in chat_ids
-            },
+            "online_by_chat": manager.presence.snapshot(chat_ids),
         },
     )
-
-    for cid in chat_ids:
-        await manager.broadcast(
-            cid,
-            {
-                "type": "presence.update",
-                "chat_id": str(cid),
-                "user_id": str(user_id),
-                "status": "online",
-            },
-            exclude_user_id=user_id,
-        )
+    manager.presence.connected(connection)
 
     try:
-        while True:
-            data = await websocket.receive_json()
-            action = data.get("action")
-            async with async_session() as session:
-                if action == "subscribe":
-                    chat_id = uuid.UUID(data.get("chat_id"))
-                    await ChatService.ensure_member(session, chat_id, user_id)
-                    manager.subscribe(user_id, chat_id)
-
-                elif action == "unsubscribe":
-                    chat_id = uuid.UUID(data.get("chat_id"))
-                    await ChatService.ensure_member(session, chat_id, user_id)
-                    manager.unsubscribe(user_id, chat_id)
-
-                elif action == "send_message":
-                    chat_id = uuid.UUID(data.get("chat_id"))
-                    await ChatService.ensure_member(session, chat_id, user_id)
-                    text = data.get("text")
-                    client_msg_id = uuid.UUID(data.get("client_msg_id"))
-
-                    message_create = MessageCreateSchema(
-                        chat_id=chat_id, text=text, client_msg_id=client_msg_id
-                    )
-                    message = await MessageService.create_message(
-                        session, message_create, user_id
-                    )
-                    await session.commit()
-
-                    await manager.broadcast(
-                        chat_id,
-                        MessageReadSchema.model_validate(message).model_dump(
-                            mode="json"
-                        ),
-                    )
-
-                elif action == "typing":
-                    chat_id = uuid.UUID(data.get("chat_id"))
-                    is_typing = bool(data.get("is_typing", True))
-
-                    await ChatService.ensure_member(session, chat_id, user_id)
-
-                    if not manager.typing_allowed(
-                        user_id, chat_id, min_interval_sec=1.0
-                    ):
-                        continue
-
-                    await manager.broadcast(
-                        chat_id,
-                        {
-                            "type": "typing",
-                            "chat_id": str(chat_id),
-                            "user_id": str(user_id),
-                            "is_typing": is_typing,
-                        },
-                        exclude_user_id=user_id,
-                    )
-
-                elif action == "read_messages":
-                    message_ids = [
-                        uuid.UUID(mid) for mid in data.get("message_ids", [])
-                    ]
-                    messages = await MessageService.mark_as_read(
-                        session, message_ids, user_id
-                    )
-                    await session.commit()
-
-                    for msg in messages:
-                        await manager.broadcast(
-                            msg.chat_id,
-                            MessageReadSchema.model_validate(msg).model_dump(
-                                mode="json"
-                            ),
-                        )
-                else:
-                    pass
-
+        if resume:
+            try:
+                await resume_chats(connection, resume, chat_ids)
+            except PoolTimeoutError:
+                await manager.send_to_user(user_id, SERVER_BUSY)
+        # The writer or slow-consumer eviction may close the socket first.
+        while websocket.application_state == WebSocketState.CONNECTED:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            manager.touch(connection)
+            try:
+                raw = frame.get("text")
+                data = connection.wire.loads(raw if raw is not None else frame["bytes"])
+                action = data.get("action")
+                handler = ACTION_HANDLERS.get(action)
+                if handler is not None:
+                    with track_queries(f"ws:{action}") as usage:
+                        await handler(connection, data)
+                    WS_FRAME_DB_QUERIES.observe(usage.count, action)
+                    WS_FRAME_DB_SECONDS.observe(usage.seconds, action)
+            except HTTPException as e:
+                await manager.send_to_user(
+                    user_id,
+                    {"type": "error", "status": e.status_code, "detail": e.detail},
+                )
+            except PoolTimeoutError:
+                await manager.send_to_user(user_id, SERVER_BUSY)
+            except (ValueError, TypeError, AttributeError, KeyError, zlib.error):
+                await manager.send_to_user(
+                    user_id, {"type": "error", "status": 400, "detail": "Invalid frame"}
+                )
     except WebSocketDisconnect:
-        subs = manager.get_user_subscriptions(user_id)
-        for cid in subs:
-            await manager.broadcast(
-                cid,
-                {
-                    "type": "presence.update",
-                    "chat_id": str(cid),
-                    "user_id": str(user_id),
-                    "status": "offline",
-                },
-                exclude_user_id=user_id,
-            )
-        manager.disconnect(user_id)
+        pass
+    finally:
+        manager.disconnect(user_id, websocket)
+        if user_id not in manager.active_users and not connection.reaped:
+            manager.presence.disconnected(user_id, connection.subscriptions)
@@ -0,0 +1,255 @@
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from typing import Callable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from messages.codec import get_codec
+
+logger = logging.getLogger(__name__)
+
+EventHandler = Callable[[dict], None]
+
+# NOTIFY payloads are capped at 8000 bytes; leave room for the chunk envelope.
+NOTIFY_CHUNK_SIZE = 7000
+
+
+class InMemoryHub:
+    def __init__(self):
+        self.brokers: list["InMemoryBroker"] = []
+
+
+class InMemoryBroker:
+    def __init__(self, hub: Optional[InMemoryHub] = None):
+        self.node_id = uuid.uuid4().hex
+        self.hub = hub or InMemoryHub()
+        self._handler: Optional[EventHandler] = None
+        self.on_reconnect: list[Callable[[], None]] = []
+
+    @property
+    def has_peers(self) -> bool:
+        return len(self.hub.brokers) > 1
+
+    async def start(self, handler: EventHandler):
+        self._handler = handler
+        self.hub.brokers.append(self)
+
+    async def stop(self):
+        if self in self.hub.brokers:
+            self.hub.brokers.remove(self)
+
+    def publish(self, event: dict):
+        event["origin"] = self.node_id
+        loop = asyncio.get_running_loop()
+        for broker in self.hub.brokers:
+            if broker is not self:
+                loop.call_soon(broker._handler, event)
+
+
+class PostgresBroker:
+    def __init__(self, engine: AsyncEngine, channel: str = "chat_events", codec=None):
+        self.node_id = uuid.uuid4().hex
+        self.engine = engine
+        self.channel = channel
+        self.codec = codec or get_codec()
+        self._handler: Optional[EventHandler] = None
+        self._connection: Optional[AsyncConnection] = None
+        self._driver = None
+        self._pending: list[str] = []
+        self._wakeup = asyncio.Event()
+        self._sender: Optional[asyncio.Task] = None
+        self._seq = itertools.count()
+        self._chunks: dict[tuple[str, int], tuple[float, list]] = {}
+        # Called after the listener comes back; events sent meanwhile are lost.
+        self.on_reconnect: list[Callable[[], None]] = []
+
+    @property
+    def has_peers(self) -> bool:
+        return True
+
+    async def start(self, handler: EventHandler):
+        self._handler = handler
+        await self._listen()
+        self._sender = asyncio.create_task(self._send_loop())
+
+    async def stop(self):
+        if self._sender is not None:
+            self._sender.cancel()
+            self._sender = None
+        if self._pending and self._driver is not None:
+            try:
+                await self._notify(self._pending)
+            except Exception:
+                logger.warning("Failed to flush broker events", exc_info=True)
+            self._pending = []
+        await self._close_connection()
+
+    async def _listen(self):
+        self._connection = await self.engine.connect()
+        raw = await self._connection.get_raw_connection()
+        self._driver = raw.driver_connection
+        await self._driver.add_listener(self.channel, self._on_notify)
+
+    async def _close_connection(self):
+        if self._connection is None:
+            return
+        try:
+            await self._driver.remove_listener(self.channel, self._on_notify)
+            await self._connection.close()
+        except Exception:
+            logger.warning("Failed to close broker connection", exc_info=True)
+        self._connection = None
+        self._driver = None
+
+    def publish(self, event: dict):
+        event["origin"] = self.node_id
+        event["seq"] = next(self._seq)
+        payload = self.codec.dumps(event)
+        if len(payload.encode()) <= NOTIFY_CHUNK_SIZE:
+            self._pending.append(payload)
+        else:
+            self._pending.extend(self._split(event["seq"], payload))
+        self._wakeup.set()
+
+    def _split(self, seq: int, payload: str) -> list[str]:
+        # Split by characters so a multi-byte character never straddles two parts;
+        # a character costs at most six bytes once escaped inside a JSON string.
+        step = NOTIFY_CHUNK_SIZE // 6
+        parts = [payload[i : i + step] for i in range(0, len(payload), step)]
+        return [
+            self.codec.dumps(
+                {
+                    "kind": "chunk",
+                    "origin": self.node_id,
+                    "id": seq,
+                    "part": index,
+                    "total": len(parts),
+                    "data": part,
+                }
+            )
+            for index, part in enumerate(parts)
+        ]
+
+    async def _send_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            batch, self._pending = self._pending, []
+            if not batch:
+                continue
+            try:
+                await self._notify(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Broker publish failed, reconnecting")
+                await self._reconnect()
+
+    async def _notify(self, payloads: list[str]):
+        await self._driver.execute(
+            "SELECT pg_notify($1, payload) FROM unnest($2::text[]) AS payload",
+            self.channel,
+            payloads,
+        )
+
+    async def _reconnect(self):
+        await self._close_connection()
+        delay = 0.5
+        while True:
+            try:
+                await self._listen()
+                break
+            except Exception:
+                logger.warning("Broker reconnect failed", exc_info=True)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10.0)
+        for callback in self.on_reconnect:
+            callback()
+
+    def _on_notify(self, connection, pid, channel, payload: str):
+        try:
+            event = self.codec.loads(payload)
+        except ValueError:
+            logger.warning("Dropping malformed broker payload")
+            return
+        if event.get("origin") == self.node_id:
+            return
+        if event.get("kind") == "chunk":
+            event = self._reassemble(event)
+            if event is None:
+                return
+        self._handler(event)
+
+    def _reassemble(self, chunk: dict) -> Optional[dict]:
+        now = time.monotonic()
+        key = (chunk["origin"], chunk["id"])
+        _, parts = self._chunks.setdefault(key, (now, [None] * chunk["total"]))
+        parts[chunk["part"]] = chunk["data"]
+        for stale_key, (started, _) in list(self._chunks.items()):
+            if now - started > 30.0:
+                del self._chunks[stale_key]
+        if any(part is None for part in parts):
+            return None
+        self._chunks.pop(key, None)
+        return self.codec.loads("".join(parts))
+
+
+class RemotePresence:
+    def __init__(self, ttl_sec: float = 15.0):
+        self.ttl_sec = ttl_sec
+        self._nodes: dict[str, dict[str, frozenset[str]]] = {}
+        self._chats: dict[str, dict[str, int]] = {}
+        self._last_seen: dict[str, float] = {}
+
+    def touch(self, node_id: str):
+        self._last_seen[node_id] = time.monotonic()
+
+    def set_user(self, node_id: str, user_id: str, chat_ids: list[str]):
+        users = self._nodes.setdefault(node_id, {})
+        self._unlink(user_id, users.pop(user_id, ()))
+        if chat_ids:
+            users[user_id] = frozenset(chat_ids)
+            self._link(user_id, users[user_id])
+
+    def replace_node(self, node_id: str, users: dict[str, list[str]]):
+        self.drop_node(node_id)
+        self.touch(node_id)
+        for user_id, chat_ids in users.items():
+            self.set_user(node_id, user_id, chat_ids)
+
+    def drop_node(self, node_id: str):
+        for user_id, chat_ids in self._nodes.pop(node_id, {}).items():
+            self._unlink(user_id, chat_ids)
+        self._last_seen.pop(node_id, None)
+
+    def prune(self) -> list[str]:
+        deadline = time.monotonic() - self.ttl_sec
+        stale = [node for node, seen in self._last_seen.items() if seen < deadline]
+        for node_id in stale:
+            self.drop_node(node_id)
+        return stale
+
+    def users_in_chat(self, chat_id: str):
+        return self._chats.get(chat_id, {}).keys()
+
+    def is_online(self, user_id: str) -> bool:
+        return any(user_id in users for users in self._nodes.values())
+
+    def _link(self, user_id: str, chat_ids):
+        for chat_id in chat_ids:
+            users = self._chats.setdefault(chat_id, {})
+            users[user_id] = users.get(user_id, 0) + 1
+
+    def _unlink(self, user_id: str, chat_ids):
+        for chat_id in chat_ids:
+            users = self._chats.get(chat_id)
+            if users is None or user_id not in users:
+                continue
+            users[user_id] -= 1
+            if users[user_id] <= 0:
+                del users[user_id]
+            if not users:
+                del self._chats[chat_id]
@@ -0,0 +1,226 @@
+import uuid
+from bisect import insort
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, Optional
+
+from config import settings
+from messages.codec import get_codec
+from messages.schemas import MessageReadSchema
+from metrics import StatsCollector
+from pagination import encode_cursor
+
+# Rough per-message cost of the key tuple, datetime, UUID and bytes headers.
+ENTRY_OVERHEAD = 250
+
+Entry = tuple[tuple[datetime, uuid.UUID], bytes]
+
+
+class ChatHistory:
+    __slots__ = ("entries", "exhaustive", "size", "last_seq")
+
+    def __init__(self):
+        # Oldest first, ordered by (timestamp, id) like history pages.
+        self.entries: list[Entry] = []
+        # True when the chat has no messages older than entries[0].
+        self.exhaustive = False
+        self.size = 0
+        # Highest seq seen; must equal chats.last_seq for the head to be current.
+        self.last_seq = 0
+
+
+class HistoryCache:
+    """Newest messages of recently active chats, kept as serialized JSON.
+
+    Each chat holds up to ``per_chat`` messages; chats are evicted least
+    recently used first once the total passes ``max_bytes``. Writes on other
+    workers only arrive through the broker, so the cache must be disabled
+    unless every worker shares one.
+    """
+
+    def __init__(
+        self,
+        per_chat: int = 100,
+        max_bytes: int = 64 * 1024 * 1024,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        self.per_chat = per_chat
+        self.max_bytes = max_bytes
+        self.codec = get_codec()
+        self._chats: OrderedDict[uuid.UUID, ChatHistory] = OrderedDict()
+        self.bytes = 0
+        self.broker = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _serialize(self, message: dict) -> Entry:
+        key = (datetime.fromisoformat(message["timestamp"]), uuid.UUID(message["id"]))
+        return key, self.codec.dumps(message).encode()
+
+    def _add(
+        self,
+        chat_id: uuid.UUID,
+        entries: Iterable[Entry],
+        last_seq: int,
+        exhaustive: bool = False,
+        from_head: bool = False,
+    ):
+        history = self._chats.get(chat_id)
+        if history is None:
+            history = self._chats[chat_id] = ChatHistory()
+        self._chats.move_to_end(chat_id)
+        history.last_seq = max(history.last_seq, last_seq)
+        history.exhaustive = history.exhaustive or exhaustive
+        known = {key for key, _ in history.entries}
+        for entry in entries:
+            key = entry[0]
+            if key in known:
+                continue
+            if (
+                not from_head
+                and not history.exhaustive
+                and history.entries
+                and key < history.entries[0][0]
+            ):
+                # Would leave a gap between it and the cached run.
+                continue
+            known.add(key)
+            insort(history.entries, entry)
+            history.size += len(entry[1]) + ENTRY_OVERHEAD
+            self.bytes += len(entry[1]) + ENTRY_OVERHEAD
+        while len(history.entries) > self.per_chat:
+            _, data = history.entries.pop(0)
+            history.size -= len(data) + ENTRY_OVERHEAD
+            self.bytes -= len(data) + ENTRY_OVERHEAD
+            history.exhaustive = False
+        while self.bytes > self.max_bytes and self._chats:
+            _, evicted = self._chats.popitem(last=False)
+            self.bytes -= evicted.size
+            self.evictions += 1
+
+    def add_messages(self, messages: Iterable, publish: bool = True):
+        """Record freshly committed messages (ORM rows) and share them with peers."""
+        if not self.enabled:
+            return
+        by_chat: dict[uuid.UUID, list[dict]] = {}
+        broken: set[uuid.UUID] = set()
+        for message in messages:
+            try:
+                payload = MessageReadSchema.model_validate(message).model_dump(
+                    mode="json"
+                )
+            except ValueError:
+                # A committed message we cannot cache would leave a hole.
+                broken.add(message.chat_id)
+                continue
+            by_chat.setdefault(message.chat_id, []).append(payload)
+        for chat_id in broken:
+            self.invalidate(chat_id)
+            by_chat.pop(chat_id, None)
+        for chat_id, payloads in by_chat.items():
+            self._add(
+                chat_id,
+                [self._serialize(p) for p in payloads],
+                max(p["seq"] for p in payloads),
+            )
+            if publish and self.broker is not None and self.broker.has_peers:
+                self.broker.publish(
+                    {"kind": "history", "chat_id": str(chat_id), "messages": payloads}
+                )
+
+    def apply_remote(self, event: dict):
+        if not self.enabled:
+            return
+        self._add(
+            uuid.UUID(event["chat_id"]),
+            [self._serialize(payload) for payload in event["messages"]],
+            max(payload["seq"] for payload in event["messages"]),
+        )
+
+    def fill(self, chat_id: uuid.UUID, newest_first: list, exhaustive: bool):
+        """Read-through: ``newest_first`` is the head of the chat as loaded from the DB."""
+        if not self.enabled:
+            return
+        exhaustive = exhaustive and len(newest_first) <= self.per_chat
+        try:
+            payloads = [
+                MessageReadSchema.model_validate(m).model_dump(mode="json")
+                for m in newest_first[: self.per_chat]
+            ]
+        except ValueError:
+            self.invalidate(chat_id)
+            return
+        self._add(
+            chat_id,
+            [self._serialize(p) for p in payloads],
+            max((p["seq"] for p in payloads), default=0),
+            exhaustive=exhaustive,
+            from_head=True,
+        )
+
+    def newest_page(
+        self, chat_id: uuid.UUID, limit: int, last_seq: int
+    ) -> Optional[bytes]:
+        """JSON body of the newest ``limit`` messages, or None if not fully cached.
+
+        ``last_seq`` is the chat's current ``chats.last_seq``; a ring behind it
+        missed a write and is dropped.
+        """
+        history = self._chats.get(chat_id)
+        if history is not None and history.last_seq != last_seq:
+            self.invalidate(chat_id)
+            history = None
+        if history is None or (
+            len(history.entries) <= limit and not history.exhaustive
+        ):
+            self.misses += 1
+            return None
+        self._chats.move_to_end(chat_id)
+        self.hits += 1
+        page = history.entries[-limit:][::-1]
+        next_cursor = None
+        if len(history.entries) > limit:
+            next_cursor = encode_cursor(*page[-1][0])
+        return (
+            b'{"items":['
+            + b",".join(data for _, data in page)
+            + b'],"next_cursor":'
+            + self.codec.dumps(next_cursor).encode()
+            + b"}"
+        )
+
+    def invalidate(self, chat_id: uuid.UUID):
+        history = self._chats.pop(chat_id, None)
+        if history is not None:
+            self.bytes -= history.size
+
+    def clear(self):
+        self._chats.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "chats": len(self._chats),
+            "messages": sum(len(h.entries) for h in self._chats.values()),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "hits_total": self.hits,
+            "misses_total": self.misses,
+            "evictions_total": self.evictions,
+        }
+
+
+history_cache = HistoryCache(
+    per_chat=settings.history_cache_per_chat,
+    max_bytes=settings.history_cache_max_mb * 1024 * 1024,
+    enabled=(
+        settings.ws_broker == "postgres"
+        if settings.history_cache_enabled is None
+        else settings.history_cache_enabled
+    ),
+)
+StatsCollector("history_cache", history_cache.stats)
@@ -0,0 +1,174 @@
+import json
+import uuid
+import zlib
+from datetime import date, datetime
+from typing import Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack is optional
+    msgpack = None
+
+# Level 1 costs about half the CPU of the default for ~4% larger frames.
+DEFLATE_LEVEL = 1
+# Cap on an inflated client frame; matches uvicorn's default ws_max_size so a
+# compressed frame cannot carry more than an uncompressed one could.
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+
+
+def _default(obj):
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class JsonCodec:
+    name = "json"
+
+    @staticmethod
+    def dumps(obj) -> str:
+        return json.dumps(obj, default=_default, separators=(",", ":"))
+
+    @staticmethod
+    def loads(data: str | bytes):
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    name = "orjson"
+
+    @staticmethod
+    def dumps(obj) -> str:
+        return orjson.dumps(obj, default=_default).decode()
+
+    @staticmethod
+    def loads(data: str | bytes):
+        return orjson.loads(data)
+
+
+def get_codec(name: str = "auto"):
+    if name == "json":
+        return JsonCodec
+    if name == "orjson":
+        if orjson is None:
+            raise RuntimeError("orjson codec requested but orjson is not installed")
+        return OrjsonCodec
+    return OrjsonCodec if orjson is not None else JsonCodec
+
+
+def _uuid_bytes(value):
+    # bytes.fromhex is several times cheaper than uuid.UUID(value).bytes.
+    if (
+        isinstance(value, str)
+        and len(value) == 36
+        and value[8] == value[13] == value[18] == value[23] == "-"
+    ):
+        try:
+            return bytes.fromhex(value.replace("-", ""))
+        except ValueError:
+            return value
+    return value
+
+
+def _pack_ids(obj, key: str = ""):
+    """Turn UUID strings under ``id``/``*_id``/``*_ids``/``*_by_chat`` into bytes."""
+    if isinstance(obj, dict):
+        if key.endswith("_by_chat"):
+            return {_uuid_bytes(k): _pack_ids(v, "_ids") for k, v in obj.items()}
+        return {k: _pack_ids(v, k) for k, v in obj.items()}
+    if isinstance(obj, list):
+        if key.endswith("_ids"):
+            return [_uuid_bytes(item) for item in obj]
+        return [_pack_ids(item, key) for item in obj]
+    if key == "id" or key.endswith("_id") or key.endswith("_ids"):
+        return _uuid_bytes(obj)
+    return obj
+
+
+def _uuid_str(value: bytes) -> str:
+    h = value.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _unpack_ids(obj):
+    if isinstance(obj, dict):
+        return {_unpack_ids(k): _unpack_ids(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_unpack_ids(item) for item in obj]
+    if isinstance(obj, bytes) and len(obj) == 16:
+        return _uuid_str(obj)
+    return obj
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, uuid.UUID):
+        return obj.bytes
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+class MsgpackCodec:
+    """MessagePack with UUIDs as 16-byte binaries; decoding turns them back into strings."""
+
+    name = "msgpack"
+
+    @staticmethod
+    def dumps(obj) -> bytes:
+        return msgpack.packb(_pack_ids(obj), default=_msgpack_default)
+
+    @staticmethod
+    def loads(data: bytes):
+        return _unpack_ids(msgpack.unpackb(data, strict_map_key=False))
+
+
+class WireFormat:
+    """How frames are encoded for one connection.
+
+    Plain JSON goes out as text frames; msgpack and deflated payloads go out as
+    binary frames. Deflate is raw (no zlib header) and stateless per frame, so
+    one compressed payload can be shared by every socket using this format.
+    """
+
+    def __init__(
+        self, encoding: str = "json", compression: Optional[str] = None, json_codec=None
+    ):
+        if encoding not in ("json", "msgpack"):
+            raise ValueError(f"Unsupported encoding: {encoding}")
+        if encoding == "msgpack" and msgpack is None:
+            raise ValueError("msgpack encoding requested but msgpack is not installed")
+        if compression not in (None, "deflate"):
+            raise ValueError(f"Unsupported compression: {compression}")
+        self.encoding = encoding
+        self.compression = compression
+        self.name = encoding + (f"+{compression}" if compression else "")
+        self.binary = encoding == "msgpack" or compression is not None
+        self.json_codec = json_codec or get_codec()
+        self._codec = MsgpackCodec if encoding == "msgpack" else self.json_codec
+
+    def dumps(self, message) -> str | bytes:
+        data = self._codec.dumps(message)
+        if self.compression is None:
+            return data
+        if isinstance(data, str):
+            data = data.encode()
+        compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def loads(self, data: str | bytes):
+        # Text frames are always JSON, whatever was negotiated.
+        if isinstance(data, str):
+            return self.json_codec.loads(data)
+        if self.compression is not None:
+            inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = inflater.decompress(data, MAX_FRAME_BYTES)
+            if inflater.unconsumed_tail or not inflater.eof:
+                raise ValueError("Frame is truncated or inflates past MAX_FRAME_BYTES")
+        return self._codec.loads(data)
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from typing import Optional
+
+from fastapi import HTTPException
+
+from messages.cache import history_cache
+from messages.models import Messages
+from messages.repositories import MessageRepository
+from messages.schemas import MessageCreateSchema
+
+logger = logging.getLogger(__name__)
+
+
+class IngestPipeline:
+    def __init__(
+        self,
+        session_factory,
+        max_batch_size: int = 64,
+        max_delay_ms: float = 5.0,
+    ):
+        self.session_factory = session_factory
+        self.max_batch_size = max_batch_size
+        self.max_delay_sec = max_delay_ms / 1000
+        self._pending: list[tuple[Messages, asyncio.Future]] = []
+        self._in_flight: list[tuple[Messages, asyncio.Future]] = []
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.started_at = time.monotonic()
+        self.batches_total = 0
+        self.items_total = 0
+        self.commits_total = 0
+        self.flush_seconds_total = 0.0
+        self._recent: deque[tuple[float, int, float]] = deque(maxlen=256)
+
+    async def start(self):
+        self.started_at = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # A flush cut short by the cancel already took its batch off _pending.
+        self._fail(self._in_flight)
+        self._in_flight = []
+        while self._pending:
+            await self._flush(self._take())
+
+    async def submit(self, data: MessageCreateSchema, sender_id: uuid.UUID) -> Messages:
+        future = asyncio.get_running_loop().create_future()
+        message = Messages(
+            chat_id=data.chat_id,
+            sender_id=sender_id,
+            text=data.text,
+            client_msg_id=data.client_msg_id,
+        )
+        self._pending.append((message, future))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._full.set()
+        return await future
+
+    def _take(self) -> list[tuple[Messages, asyncio.Future]]:
+        batch = self._pending[: self.max_batch_size]
+        del self._pending[: self.max_batch_size]
+        if len(self._pending) < self.max_batch_size:
+            self._full.clear()
+        if not self._pending:
+            self._has_items.clear()
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            if not self._full.is_set():
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay_sec)
+                except asyncio.TimeoutError:
+                    pass
+            self._in_flight = self._take()
+            await self._flush(self._in_flight)
+            self._in_flight = []
+
+    async def _flush(self, batch: list[tuple[Messages, asyncio.Future]]):
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            created = await self._write([message for message, _ in batch])
+        except Exception:
+            if len(batch) == 1:
+                logger.exception("Message ingest failed")
+                self._fail(batch)
+                return
+            # Isolate the offending row so it does not fail the whole batch.
+            for item in batch:
+                await self._flush([item])
+            return
+
+        for (_, future), row in zip(batch, created):
+            if not future.done():
+                future.set_result(row)
+        elapsed = time.perf_counter() - started
+        self.batches_total += 1
+        self.commits_total += 1
+        self.items_total += len(batch)
+        self.flush_seconds_total += elapsed
+        self._recent.append((time.monotonic(), len(batch), elapsed))
+
+    async def _write(self, messages: list[Messages]) -> list[Messages]:
+        async with self.session_factory() as session:
+            created = await MessageRepository.create_messages(session, messages)
+            await session.commit()
+        history_cache.add_messages(created)
+        return created
+
+    @staticmethod
+    def _fail(batch: list[tuple[Messages, asyncio.Future]]):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(
+                    HTTPException(status_code=500, detail="Message could not be stored")
+                )
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        window = [entry for entry in self._recent if now - entry[0] <= 60.0]
+        window_sec = max(now - window[0][0], 1.0) if window else 1.0
+        return {
+            "batches_total": self.batches_total,
+            "items_total": self.items_total,
+            "commits_total": self.commits_total,
+            "queue_depth": len(self._pending),
+            "avg_batch_size": (
+                self.items_total / self.batches_total if self.batches_total else 0.0
+            ),
+            "avg_flush_ms": (
+                self.flush_seconds_total * 1000 / self.batches_total
+                if self.batches_total
+                else 0.0
+            ),
+            "recent_commits_per_sec": len(window) / window_sec,
+            "recent_avg_batch_size": (
+                sum(e[1] for e in window) / len(window) if window else 0.0
+            ),
+        }
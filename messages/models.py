@@ -1,7 +1,15 @@
 import uuid
 from datetime import datetime, timezone
 
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, String, UniqueConstraint
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    String,
+    UniqueConstraint,
+)
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 
@@ -18,15 +26,27 @@ class Messages(Base):
     timestamp = Column(
         DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
     )
-    is_read = Column(Boolean, default=False)
 
     client_msg_id = Column(
         UUID(as_uuid=True), nullable=False, unique=True, default=uuid.uuid4
     )
+    # Per-chat delivery order, reserved from chats.last_seq at insert.
+    seq = Column(BigInteger, nullable=False)
 
     chat = relationship("Chat", back_populates="messages")
     sender = relationship("User", back_populates="messages")
 
     __table_args__ = (
         UniqueConstraint("client_msg_id", name="uq_messages_client_msg_id"),
+        Index("ix_messages_chat_id_timestamp_id", "chat_id", "timestamp", "id"),
+        UniqueConstraint("chat_id", "seq", name="uq_messages_chat_id_seq"),
     )
+
+
+class ChatReadState(Base):
+    __tablename__ = "chat_read_state"
+
+    chat_id = Column(ForeignKey("chats.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    last_read_at = Column(DateTime(timezone=True), nullable=False)
+    last_read_message_id = Column(UUID(as_uuid=True), nullable=False)
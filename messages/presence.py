@@ -0,0 +1,193 @@
+import asyncio
+import time
+import uuid
+from typing import TYPE_CHECKING, Iterable, Optional
+
+if TYPE_CHECKING:
+    from messages.ws_manager import Connection, ConnectionManager
+
+ONLINE = "online"
+OFFLINE = "offline"
+
+
+class PresenceCoordinator:
+    """Coalesces online/offline changes into one frame per recipient per flush.
+
+    A disconnect lingers for ``grace_sec`` before it becomes ``offline``, so a
+    reconnect inside the window emits nothing. Committed changes are published
+    to other workers once per flush as a ``presence_diff`` broker event.
+    """
+
+    def __init__(
+        self,
+        manager: "ConnectionManager",
+        flush_interval_ms: float = 250.0,
+        grace_sec: float = 10.0,
+    ):
+        self.manager = manager
+        self.flush_interval_sec = flush_interval_ms / 1000
+        self.grace_sec = grace_sec
+        self._pending: dict[uuid.UUID, tuple[str, frozenset[uuid.UUID]]] = {}
+        self._lingering: dict[uuid.UUID, tuple[float, frozenset[uuid.UUID]]] = {}
+        self._published: set[uuid.UUID] = set()
+        self._remote: list[tuple[str, str, list[uuid.UUID]]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.frames_total = 0
+        self.updates_total = 0
+        self.suppressed_total = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_sec)
+            self.flush()
+
+    def connected(self, conn: "Connection"):
+        self._lingering.pop(conn.user_id, None)
+        self._pending[conn.user_id] = (ONLINE, frozenset(conn.subscriptions))
+
+    def disconnected(
+        self,
+        user_id: uuid.UUID,
+        chat_ids: Iterable[uuid.UUID],
+        immediate: bool = False,
+    ):
+        self._lingering.pop(user_id, None)
+        if user_id not in self._published:
+            # Never announced, so there is nothing to take back.
+            self._pending.pop(user_id, None)
+            return
+        chat_ids = frozenset(chat_ids)
+        if self.grace_sec > 0 and not immediate:
+            self._lingering[user_id] = (time.monotonic() + self.grace_sec, chat_ids)
+        else:
+            self._pending[user_id] = (OFFLINE, chat_ids)
+
+    def apply_remote(self, changes: list[dict]):
+        for change in changes:
+            chat_ids = [uuid.UUID(cid) for cid in change["chat_ids"]]
+            if change["status"] == ONLINE:
+                lingering = self._handed_off(uuid.UUID(change["user_id"]))
+                if lingering:
+                    # Subscribers here still see them online in these chats.
+                    chat_ids = [cid for cid in chat_ids if cid not in lingering]
+                    if not chat_ids:
+                        self.suppressed_total += 1
+                        continue
+            self._remote.append((change["user_id"], change["status"], chat_ids))
+
+    def _handed_off(self, user_id: uuid.UUID) -> frozenset[uuid.UUID]:
+        """A user lingering here reconnected on a peer, which now owns their presence."""
+        entry = self._lingering.pop(user_id, None)
+        if entry is None:
+            return frozenset()
+        self._published.discard(user_id)
+        return entry[1]
+
+    def snapshot(self, chat_ids: Iterable[uuid.UUID]) -> dict[str, list[str]]:
+        lingering: dict[uuid.UUID, list[str]] = {}
+        for user_id, (_, user_chats) in self._lingering.items():
+            for chat_id in user_chats:
+                lingering.setdefault(chat_id, []).append(str(user_id))
+        online_by_chat = {}
+        for chat_id in chat_ids:
+            online = {conn.user_key for conn in self.manager.subscribers(chat_id)}
+            online.update(self.manager.remote.users_in_chat(str(chat_id)))
+            online.update(lingering.get(chat_id, ()))
+            online_by_chat[str(chat_id)] = list(online)
+        return online_by_chat
+
+    def flush(self):
+        now = time.monotonic()
+        for user_id, (deadline, chat_ids) in list(self._lingering.items()):
+            if deadline <= now:
+                if self.manager.remote.is_online(str(user_id)):
+                    # Reconnected on a peer; linger until its presence_diff
+                    # hands them off, or they drop there too.
+                    continue
+                del self._lingering[user_id]
+                if user_id not in self.manager.active_users:
+                    self._pending[user_id] = (OFFLINE, chat_ids)
+
+        changes = []
+        for user_id, (status, chat_ids) in self._pending.items():
+            online = status == ONLINE
+            if online == (user_id in self._published):
+                self.suppressed_total += 1
+                continue
+            if online:
+                self._published.add(user_id)
+            else:
+                self._published.discard(user_id)
+            changes.append((str(user_id), status, list(chat_ids)))
+        self._pending.clear()
+
+        if changes and self.manager.broker.has_peers:
+            self.manager.broker.publish(
+                {
+                    "kind": "presence_diff",
+                    "changes": [
+                        {
+                            "user_id": user_key,
+                            "status": status,
+                            "chat_ids": [str(cid) for cid in chat_ids],
+                        }
+                        for user_key, status, chat_ids in changes
+                    ],
+                }
+            )
+        changes.extend(self._remote)
+        self._remote.clear()
+        self._deliver(changes)
+
+    def _deliver(self, changes: list[tuple[str, str, list[uuid.UUID]]]):
+        # recipient -> user -> chat -> status; a later change for the same
+        # chat (a remote online after a local offline) replaces the earlier.
+        by_recipient: dict["Connection", dict[str, dict[str, str]]] = {}
+        for user_key, status, chat_ids in changes:
+            for chat_id in chat_ids:
+                chat_key = None
+                for conn in self.manager.subscribers(chat_id):
+                    if conn.user_key == user_key:
+                        continue
+                    if chat_key is None:
+                        chat_key = str(chat_id)
+                    statuses = by_recipient.setdefault(conn, {}).setdefault(
+                        user_key, {}
+                    )
+                    statuses[chat_key] = status
+
+        for conn, users in by_recipient.items():
+            updates: dict[tuple[str, str], dict] = {}
+            for user_key, statuses in users.items():
+                for chat_key, status in statuses.items():
+                    update = updates.get((user_key, status))
+                    if update is None:
+                        update = updates[(user_key, status)] = {
+                            "user_id": user_key,
+                            "status": status,
+                            "chat_ids": [],
+                        }
+                    update["chat_ids"].append(chat_key)
+            self.manager.send_ephemeral(
+                conn, {"type": "presence.batch", "updates": list(updates.values())}
+            )
+            self.frames_total += 1
+            self.updates_total += len(updates)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "lingering": len(self._lingering),
+            "published_online": len(self._published),
+            "frames_total": self.frames_total,
+            "updates_total": self.updates_total,
+            "suppressed_total": self.suppressed_total,
+        }
@@ -1,38 +1,180 @@
 import uuid
+from datetime import datetime, timedelta, timezone
 
 from fastapi import HTTPException
-from sqlalchemy import select, update
+from sqlalchemy import case, or_, select, tuple_, update
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from chats.models import ChatParticipant
-from messages.models import Messages
+from chats.models import Chat, ChatParticipant
+from messages.models import ChatReadState, Messages
 
 
 class MessageRepository:
 
     @staticmethod
     async def create_message(session: AsyncSession, message: Messages) -> Messages:
+        row = {
+            "id": message.id or uuid.uuid4(),
+            "chat_id": message.chat_id,
+            "sender_id": message.sender_id,
+            "text": message.text,
+            "client_msg_id": message.client_msg_id,
+            "timestamp": datetime.now(timezone.utc),
+        }
+        seqs = await MessageRepository.advance_chats(session, [row])
+        row["seq"] = seqs[message.chat_id]
         stmt = (
             insert(Messages)
-            .values(
-                id=message.id,
-                chat_id=message.chat_id,
-                sender_id=message.sender_id,
-                text=message.text,
-                client_msg_id=message.client_msg_id,
-            )
+            .values(row)
             .on_conflict_do_nothing(index_elements=["client_msg_id"])
             .returning(Messages)
         )
         result = await session.execute(stmt)
-        row = result.fetchone()
-        if row:
-            return row[0]
-        else:
-            return await MessageRepository.get_by_client_id(
-                session, message.client_msg_id
+        created = result.scalars().first()
+        if created:
+            return created
+        await MessageRepository.repair_last_message(session, [message.chat_id])
+        return await MessageRepository.get_by_client_id(session, message.client_msg_id)
+
+    @staticmethod
+    async def create_messages(
+        session: AsyncSession, messages: list[Messages]
+    ) -> list[Messages]:
+        if not messages:
+            return []
+        # Spread timestamps by a microsecond so the batch keeps its order in
+        # (timestamp, id) history pages.
+        now = datetime.now(timezone.utc)
+        rows = [
+            {
+                "id": message.id or uuid.uuid4(),
+                "chat_id": message.chat_id,
+                "sender_id": message.sender_id,
+                "text": message.text,
+                "client_msg_id": message.client_msg_id,
+                "timestamp": now + timedelta(microseconds=index),
+            }
+            for index, message in enumerate(messages)
+        ]
+        seqs = await MessageRepository.advance_chats(session, rows)
+        for row in rows:
+            row["seq"] = seqs[row["chat_id"]]
+            seqs[row["chat_id"]] += 1
+        stmt = (
+            insert(Messages)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=["client_msg_id"])
+            .returning(Messages)
+        )
+        result = await session.execute(stmt)
+        inserted = list(result.scalars().all())
+        by_client_id = {m.client_msg_id: m for m in inserted}
+
+        duplicates = [m for m in messages if m.client_msg_id not in by_client_id]
+        if duplicates:
+            await MessageRepository.repair_last_message(
+                session, list(dict.fromkeys(m.chat_id for m in duplicates))
+            )
+            by_client_id.update(
+                (m.client_msg_id, m)
+                for m in await MessageRepository.get_by_client_ids(
+                    session, [m.client_msg_id for m in duplicates]
+                )
             )
+        return [by_client_id[m.client_msg_id] for m in messages]
+
+    @staticmethod
+    async def advance_chats(
+        session: AsyncSession, rows: list[dict]
+    ) -> dict[uuid.UUID, int]:
+        """Claim seqs for rows about to be inserted and move each chat's last message.
+
+        One UPDATE per chat returns the first of its run of seqs. It locks the
+        chat row until commit, so numbers become visible in order. A retried
+        message that turns out to be a duplicate leaves a gap, so seq is
+        increasing but not dense, and its last-message move is corrected by
+        ``repair_last_message``.
+        """
+        counts: dict[uuid.UUID, int] = {}
+        newest: dict[uuid.UUID, tuple[datetime, uuid.UUID]] = {}
+        for row in rows:
+            chat_id, key = row["chat_id"], (row["timestamp"], row["id"])
+            counts[chat_id] = counts.get(chat_id, 0) + 1
+            if chat_id not in newest or key > newest[chat_id]:
+                newest[chat_id] = key
+
+        first = {}
+        # Fixed lock order so concurrent batches over the same chats cannot deadlock.
+        for chat_id in sorted(counts):
+            timestamp, message_id = newest[chat_id]
+            is_newer = or_(
+                Chat.last_message_at.is_(None),
+                tuple_(Chat.last_message_at, Chat.last_message_id)
+                < tuple_(timestamp, message_id),
+            )
+            result = await session.execute(
+                update(Chat)
+                .where(Chat.id == chat_id)
+                .values(
+                    last_seq=Chat.last_seq + counts[chat_id],
+                    last_message_at=case(
+                        (is_newer, timestamp), else_=Chat.last_message_at
+                    ),
+                    last_message_id=case(
+                        (is_newer, message_id), else_=Chat.last_message_id
+                    ),
+                )
+                .returning(Chat.last_seq)
+            )
+            last_seq = result.scalar_one_or_none()
+            if last_seq is None:
+                raise HTTPException(status_code=404, detail="Chat not found")
+            first[chat_id] = last_seq - counts[chat_id] + 1
+        return first
+
+    @staticmethod
+    async def repair_last_message(session: AsyncSession, chat_ids: list[uuid.UUID]):
+        """Point chats back at their newest stored message after skipped duplicates."""
+        newest = (
+            select(Messages)
+            .where(Messages.chat_id == Chat.id)
+            .order_by(Messages.timestamp.desc(), Messages.id.desc())
+            .limit(1)
+        )
+        await session.execute(
+            update(Chat)
+            .where(Chat.id.in_(chat_ids))
+            .values(
+                last_message_at=newest.with_only_columns(
+                    Messages.timestamp
+                ).scalar_subquery(),
+                last_message_id=newest.with_only_columns(Messages.id).scalar_subquery(),
+            )
+        )
+
+    @staticmethod
+    async def get_last_seqs(
+        session: AsyncSession, chat_ids: list[uuid.UUID]
+    ) -> dict[uuid.UUID, int]:
+        if not chat_ids:
+            return {}
+        result = await session.execute(
+            select(Chat.id, Chat.last_seq).where(Chat.id.in_(chat_ids))
+        )
+        return {chat_id: last_seq for chat_id, last_seq in result.all()}
+
+    @staticmethod
+    async def get_after_seq(
+        session: AsyncSession, chat_id: uuid.UUID, after_seq: int, limit: int
+    ) -> list[Messages]:
+        result = await session.execute(
+            select(Messages)
+            .where(Messages.chat_id == chat_id, Messages.seq > after_seq)
+            .order_by(Messages.seq.asc())
+            .limit(limit)
+        )
+        return list(result.scalars().all())
 
     @staticmethod
     async def get_by_chat(
@@ -47,6 +189,28 @@ class MessageRepository:
         )
         return result.scalars().all()
 
+    @staticmethod
+    async def get_page(
+        session: AsyncSession,
+        chat_id: uuid.UUID,
+        limit: int,
+        before: tuple[datetime, uuid.UUID] | None = None,
+        after: tuple[datetime, uuid.UUID] | None = None,
+        newest_first: bool = True,
+    ) -> list[Messages]:
+        key = tuple_(Messages.timestamp, Messages.id)
+        stmt = select(Messages).where(Messages.chat_id == chat_id)
+        if before is not None:
+            stmt = stmt.where(key < tuple_(*before))
+        if after is not None:
+            stmt = stmt.where(key > tuple_(*after))
+        if newest_first:
+            stmt = stmt.order_by(Messages.timestamp.desc(), Messages.id.desc())
+        else:
+            stmt = stmt.order_by(Messages.timestamp.asc(), Messages.id.asc())
+        result = await session.execute(stmt.limit(limit))
+        return list(result.scalars().all())
+
     @staticmethod
     async def get_by_client_id(
         session: AsyncSession, client_msg_id: uuid.UUID
@@ -57,30 +221,94 @@ class MessageRepository:
         return result.scalars().first()
 
     @staticmethod
-    async def mark_as_read(
-        session: AsyncSession, message_ids: list[uuid.UUID], user_id: uuid.UUID
+    async def get_by_client_ids(
+        session: AsyncSession, client_msg_ids: list[uuid.UUID]
     ) -> list[Messages]:
-        if not message_ids:
-            return []
+        result = await session.execute(
+            select(Messages).where(Messages.client_msg_id.in_(client_msg_ids))
+        )
+        return list(result.scalars().all())
 
-        allowed_ids_subq = (
-            select(Messages.id)
-            .join(ChatParticipant, ChatParticipant.chat_id == Messages.chat_id)
-            .where(
-                ChatParticipant.user_id == user_id,
-                Messages.id.in_(message_ids),
-            )
-            .subquery()
+    @staticmethod
+    async def get_read_state(
+        session: AsyncSession, chat_id: uuid.UUID, user_id: uuid.UUID
+    ) -> ChatReadState | None:
+        return await session.get(ChatReadState, (chat_id, user_id))
+
+    @staticmethod
+    async def get_read_states(
+        session: AsyncSession, chat_id: uuid.UUID
+    ) -> list[ChatReadState]:
+        result = await session.execute(
+            select(ChatReadState).where(ChatReadState.chat_id == chat_id)
         )
+        return list(result.scalars().all())
 
+    @staticmethod
+    async def _upsert_read_state(session: AsyncSession, source) -> list[ChatReadState]:
+        # The WHERE clause keeps watermarks monotonic: a stale or out-of-order
+        # "read up to" never moves one backwards, and returns no row.
+        stmt = insert(ChatReadState).from_select(
+            ["chat_id", "user_id", "last_read_at", "last_read_message_id"], source
+        )
         stmt = (
-            update(Messages)
-            .where(Messages.id.in_(select(allowed_ids_subq.c.id)))
-            .values(
-                is_read=True,
+            stmt.on_conflict_do_update(
+                index_elements=["chat_id", "user_id"],
+                set_={
+                    "last_read_at": stmt.excluded.last_read_at,
+                    "last_read_message_id": stmt.excluded.last_read_message_id,
+                },
+                where=tuple_(
+                    ChatReadState.last_read_at, ChatReadState.last_read_message_id
+                )
+                < tuple_(
+                    stmt.excluded.last_read_at, stmt.excluded.last_read_message_id
+                ),
             )
-            .returning(Messages)
+            .returning(ChatReadState)
+            .execution_options(populate_existing=True)
         )
-
         result = await session.execute(stmt)
         return list(result.scalars().all())
+
+    @staticmethod
+    def _read_source(user_id: uuid.UUID):
+        return select(
+            Messages.chat_id,
+            ChatParticipant.user_id,
+            Messages.timestamp,
+            Messages.id,
+        ).join(
+            ChatParticipant,
+            (ChatParticipant.chat_id == Messages.chat_id)
+            & (ChatParticipant.user_id == user_id),
+        )
+
+    @staticmethod
+    async def mark_read_up_to(
+        session: AsyncSession,
+        chat_id: uuid.UUID,
+        user_id: uuid.UUID,
+        message_id: uuid.UUID,
+    ) -> ChatReadState | None:
+        source = MessageRepository._read_source(user_id).where(
+            Messages.id == message_id, Messages.chat_id == chat_id
+        )
+        states = await MessageRepository._upsert_read_state(session, source)
+        return states[0] if states else None
+
+    @staticmethod
+    async def mark_as_read(
+        session: AsyncSession, message_ids: list[uuid.UUID], user_id: uuid.UUID
+    ) -> list[ChatReadState]:
+        if not message_ids:
+            return []
+
+        # Only the newest of the given messages in each chat matters.
+        source = (
+            MessageRepository._read_source(user_id)
+            .where(Messages.id.in_(message_ids))
+            .distinct(Messages.chat_id)
+            .order_by(Messages.chat_id, Messages.timestamp.desc(), Messages.id.desc())
+        )
+        return await MessageRepository._upsert_read_state(session, source)
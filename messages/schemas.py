@@ -1,8 +1,9 @@
 import uuid
 from datetime import datetime
-from typing import List
+from enum import Enum
+from typing import List, Optional
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class MessageCreateSchema(BaseModel):
@@ -11,16 +12,49 @@ class MessageCreateSchema(BaseModel):
     client_msg_id: uuid.UUID
 
 
+MAX_BATCH_SIZE = 100
+
+
+class MessageBatchCreateSchema(BaseModel):
+    messages: List[MessageCreateSchema] = Field(min_length=1, max_length=MAX_BATCH_SIZE)
+
+
 class MessageReadSchema(BaseModel):
     id: uuid.UUID
     chat_id: uuid.UUID
     sender_id: uuid.UUID
     text: str
     timestamp: datetime
-    is_read: bool
+    seq: int
 
     model_config = ConfigDict(from_attributes=True, json_encoders={uuid.UUID: str})
 
 
+class HistoryOrderSchema(str, Enum):
+    newest = "newest"
+    oldest = "oldest"
+
+
+class MessagePageSchema(BaseModel):
+    items: List[MessageReadSchema]
+    next_cursor: Optional[str] = Field(
+        None,
+        description="Pass as before= for order=newest, as after= for order=oldest.",
+    )
+
+
 class MarkReadSchema(BaseModel):
     message_ids: List[uuid.UUID]
+
+
+class ReadUpToSchema(BaseModel):
+    message_id: uuid.UUID
+
+
+class ReadWatermarkSchema(BaseModel):
+    chat_id: uuid.UUID
+    user_id: uuid.UUID
+    last_read_message_id: uuid.UUID
+    last_read_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
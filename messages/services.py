@@ -1,10 +1,15 @@
 import uuid
+from typing import Optional
 
+from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from messages.models import Messages
+from chats.services import ChatService
+from messages.cache import history_cache
+from messages.models import ChatReadState, Messages
 from messages.repositories import MessageRepository
-from messages.schemas import MessageCreateSchema
+from messages.schemas import HistoryOrderSchema, MessageCreateSchema
+from pagination import decode_cursor, encode_cursor
 
 
 class MessageService:
@@ -20,18 +25,125 @@ class MessageService:
         )
         msg = await MessageRepository.create_message(session, message)
         await session.commit()
+        history_cache.add_messages([msg])
         return msg
 
+    @staticmethod
+    async def create_messages(
+        session: AsyncSession, items: list[MessageCreateSchema], sender_id: uuid.UUID
+    ) -> list[Messages]:
+        for chat_id in dict.fromkeys(item.chat_id for item in items):
+            await ChatService.ensure_member(session, chat_id, sender_id)
+
+        unique: dict[uuid.UUID, MessageCreateSchema] = {}
+        for item in items:
+            unique.setdefault(item.client_msg_id, item)
+        messages = [
+            Messages(
+                chat_id=item.chat_id,
+                sender_id=sender_id,
+                text=item.text,
+                client_msg_id=item.client_msg_id,
+            )
+            for item in unique.values()
+        ]
+        created = await MessageRepository.create_messages(session, messages)
+        await session.commit()
+        history_cache.add_messages(created)
+
+        by_client_id = {m.client_msg_id: m for m in created}
+        return [by_client_id[item.client_msg_id] for item in items]
+
     @staticmethod
     async def get_chat_history(
         session: AsyncSession, chat_id, limit: int, offset: int
     ) -> list[Messages]:
         return await MessageRepository.get_by_chat(session, chat_id, limit, offset)
 
+    @staticmethod
+    async def get_chat_page(
+        session: AsyncSession,
+        chat_id: uuid.UUID,
+        limit: int,
+        before: str | None = None,
+        after: str | None = None,
+        order: HistoryOrderSchema = HistoryOrderSchema.newest,
+    ) -> dict:
+        # next_cursor continues in the same order: it is a before= bound for
+        # newest-first pages and an after= bound for oldest-first ones.
+        if (after if order == HistoryOrderSchema.newest else before) is not None:
+            raise HTTPException(
+                status_code=400,
+                detail="Use before= with order=newest and after= with order=oldest",
+            )
+        messages = await MessageRepository.get_page(
+            session,
+            chat_id,
+            limit + 1,
+            before=decode_cursor(before) if before else None,
+            after=decode_cursor(after) if after else None,
+            newest_first=order == HistoryOrderSchema.newest,
+        )
+        if before is None and after is None and order == HistoryOrderSchema.newest:
+            history_cache.fill(chat_id, messages, exhaustive=len(messages) <= limit)
+        next_cursor = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            last = messages[-1]
+            next_cursor = encode_cursor(last.timestamp, last.id)
+        return {"items": messages, "next_cursor": next_cursor}
+
+    @staticmethod
+    async def get_cached_newest_page(
+        session: AsyncSession, chat_id: uuid.UUID, limit: int
+    ) -> Optional[bytes]:
+        if not history_cache.enabled:
+            return None
+        last_seqs = await MessageRepository.get_last_seqs(session, [chat_id])
+        return history_cache.newest_page(chat_id, limit, last_seqs.get(chat_id, 0))
+
+    @staticmethod
+    async def get_last_seqs(
+        session: AsyncSession, chat_ids: list[uuid.UUID]
+    ) -> dict[uuid.UUID, int]:
+        return await MessageRepository.get_last_seqs(session, chat_ids)
+
+    @staticmethod
+    async def get_messages_after_seq(
+        session: AsyncSession, chat_id: uuid.UUID, after_seq: int, limit: int
+    ) -> list[Messages]:
+        return await MessageRepository.get_after_seq(session, chat_id, after_seq, limit)
+
+    @staticmethod
+    async def mark_read_up_to(
+        session: AsyncSession,
+        chat_id: uuid.UUID,
+        message_id: uuid.UUID,
+        user_id: uuid.UUID,
+    ) -> tuple[ChatReadState, bool]:
+        await ChatService.ensure_member(session, chat_id, user_id)
+        state = await MessageRepository.mark_read_up_to(
+            session, chat_id, user_id, message_id
+        )
+        await session.commit()
+        if state is not None:
+            return state, True
+
+        state = await MessageRepository.get_read_state(session, chat_id, user_id)
+        if state is None:
+            raise HTTPException(status_code=404, detail="Message not found")
+        return state, False
+
+    @staticmethod
+    async def get_read_states(
+        session: AsyncSession, chat_id: uuid.UUID
+    ) -> list[ChatReadState]:
+        return await MessageRepository.get_read_states(session, chat_id)
+
     @staticmethod
     async def mark_as_read(
         session: AsyncSession, message_ids: list[uuid.UUID], user_id: uuid.UUID
-    ) -> list[Messages]:
-        messages = await MessageRepository.mark_as_read(session, message_ids, user_id)
+    ) -> list[ChatReadState]:
+        states = await MessageRepository.mark_as_read(session, message_ids, user_id)
         await session.commit()
-        return messages
+        return states
@@ -0,0 +1,133 @@
+import asyncio
+import math
+import time
+import uuid
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from messages.ws_manager import ConnectionManager
+
+
+class TypingAggregator:
+    """Emits one ``typing.state`` frame per chat per interval instead of relaying.
+
+    Typists expire ``ttl_sec`` after their last ``typing`` frame. Chats larger
+    than ``large_chat_size`` are emitted proportionally less often, and chats
+    above ``suppress_above`` get no typing events at all. Updates are shared
+    with other workers so each one emits the full list to its own subscribers.
+    """
+
+    MAX_INTERVAL_SCALE = 5
+
+    def __init__(
+        self,
+        manager: "ConnectionManager",
+        interval_ms: float = 1000.0,
+        ttl_sec: float = 5.0,
+        large_chat_size: int = 100,
+        suppress_above: int = 1000,
+    ):
+        self.manager = manager
+        self.interval_sec = interval_ms / 1000
+        self.ttl_sec = ttl_sec
+        self.large_chat_size = large_chat_size
+        self.suppress_above = suppress_above
+        self._typing: dict[uuid.UUID, dict[str, float]] = {}
+        self._dirty: set[uuid.UUID] = set()
+        self._next_emit: dict[uuid.UUID, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.frames_total = 0
+        self.suppressed_total = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_sec)
+            self.flush()
+
+    def update(
+        self, chat_id: uuid.UUID, user_key: str, is_typing: bool, publish: bool = True
+    ):
+        now = time.monotonic()
+        typists = self._typing.setdefault(chat_id, {})
+        expires = typists.get(user_key)
+        if is_typing:
+            typists[user_key] = now + self.ttl_sec
+            if expires is None:
+                self._dirty.add(chat_id)
+            # Peers expire typists on their own, so refresh them halfway through.
+            elif expires - now >= self.ttl_sec / 2:
+                return
+        else:
+            if expires is None:
+                if not typists:
+                    del self._typing[chat_id]
+                return
+            del typists[user_key]
+            self._dirty.add(chat_id)
+        if publish and self.manager.broker.has_peers:
+            self.manager.broker.publish(
+                {
+                    "kind": "typing",
+                    "chat_id": str(chat_id),
+                    "user_id": user_key,
+                    "is_typing": is_typing,
+                }
+            )
+
+    def chat_size(self, chat_id: uuid.UUID) -> int:
+        return len(self.manager.subscribers(chat_id)) + len(
+            self.manager.remote.users_in_chat(str(chat_id))
+        )
+
+    def flush(self):
+        now = time.monotonic()
+        for chat_id, typists in self._typing.items():
+            expired = [user for user, expires in typists.items() if expires <= now]
+            for user_key in expired:
+                del typists[user_key]
+            if expired:
+                self._dirty.add(chat_id)
+
+        for chat_id in list(self._dirty):
+            if self._next_emit.get(chat_id, 0.0) > now:
+                continue
+            self._dirty.discard(chat_id)
+            typists = self._typing.get(chat_id, {})
+            size = self.chat_size(chat_id)
+            if not typists:
+                self._typing.pop(chat_id, None)
+                self._next_emit.pop(chat_id, None)
+            else:
+                scale = min(
+                    math.ceil(size / self.large_chat_size), self.MAX_INTERVAL_SCALE
+                )
+                self._next_emit[chat_id] = now + self.interval_sec * max(scale, 1)
+            if size > self.suppress_above:
+                self.suppressed_total += 1
+                continue
+            self.manager.broadcast_local(
+                chat_id,
+                {
+                    "type": "typing.state",
+                    "chat_id": str(chat_id),
+                    "user_ids": list(typists),
+                },
+                ephemeral=True,
+            )
+            self.frames_total += 1
+
+    def stats(self) -> dict:
+        return {
+            "chats_typing": len(self._typing),
+            "typists": sum(len(typists) for typists in self._typing.values()),
+            "frames_total": self.frames_total,
+            "suppressed_total": self.suppressed_total,
+        }
@@ -1,90 +1,525 @@
+import asyncio
+import heapq
 import time
 import uuid
-from typing import Dict, Optional
+from collections import deque
+from typing import Callable, Dict, Iterable, Optional
 
 from fastapi import WebSocket
 
+from messages.broker import InMemoryBroker, RemotePresence
+from messages.codec import WireFormat, get_codec
+from messages.presence import PresenceCoordinator
+from messages.typing_state import TypingAggregator
+from metrics import (
+    WS_BROADCAST_FANOUT,
+    WS_BROADCAST_SECONDS,
+    WS_CONNECTIONS_REAPED,
+    WS_HEARTBEAT_RTT_SECONDS,
+)
+
+SLOW_CONSUMER_CLOSE_CODE = 1013
+IDLE_CLOSE_CODE = 1001
+
+
+class Connection:
+    __slots__ = (
+        "user_id",
+        "user_key",
+        "socket",
+        "wire",
+        "heartbeat",
+        "subscriptions",
+        "outbox",
+        "wakeup",
+        "writer",
+        "dropped",
+        "last_seen",
+        "ping_sent_at",
+        "reaped",
+        "held",
+    )
+
+    def __init__(
+        self,
+        user_id: uuid.UUID,
+        socket: WebSocket,
+        wire: WireFormat,
+        heartbeat: bool = False,
+    ):
+        self.user_id = user_id
+        self.user_key = str(user_id)
+        self.socket = socket
+        self.wire = wire
+        # App-level pings (RTT, idle reaping) are opt-in; every connection
+        # also gets protocol pings from uvicorn, which closes dead peers.
+        self.heartbeat = heartbeat
+        self.subscriptions: set[uuid.UUID] = set()
+        self.outbox: deque[tuple[str | bytes, bool]] = deque()
+        self.wakeup = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.last_seen = time.monotonic()
+        self.ping_sent_at: Optional[float] = None
+        self.reaped = False
+        # Broadcasts parked as (chat_id, seq, frame) while the client resumes.
+        self.held: Optional[list[tuple[uuid.UUID, Optional[int], str | bytes]]] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.outbox)
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_users: Dict[uuid.UUID, Dict] = {}
-        self._typing_last_sent: Dict[tuple[uuid.UUID, uuid.UUID], float] = {}
+    def __init__(
+        self,
+        max_queue_size: int = 256,
+        slow_consumer_policy: str = "drop_ephemeral",
+        codec=None,
+        broker=None,
+        heartbeat_interval_sec: float = 5.0,
+        presence_flush_ms: float = 250.0,
+        presence_grace_sec: float = 10.0,
+        typing_mode: str = "relay",
+        typing_options: Optional[dict] = None,
+        ping_interval_sec: float = 20.0,
+        idle_timeout_sec: float = 60.0,
+    ):
+        self.active_users: Dict[uuid.UUID, Connection] = {}
+        self._chat_subscribers: Dict[uuid.UUID, set[Connection]] = {}
+        # Throttle state lives in two generations; each rotation drops entries
+        # too old to block anything, so memory tracks recent typists only.
+        self._typing_current: Dict[tuple[uuid.UUID, uuid.UUID], float] = {}
+        self._typing_previous: Dict[tuple[uuid.UUID, uuid.UUID], float] = {}
+        self._typing_rotated_at = time.monotonic()
+        self.max_queue_size = max_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.codec = codec or get_codec()
+        self.default_wire = WireFormat(json_codec=self.codec)
+        self._wire_formats = {("json", None): self.default_wire}
+        self._closing: set[asyncio.Task] = set()
+        self.broker = broker or InMemoryBroker()
+        self.remote = RemotePresence(ttl_sec=heartbeat_interval_sec * 3)
+        self.heartbeat_interval_sec = heartbeat_interval_sec
+        self._cluster_task: Optional[asyncio.Task] = None
+        # Extra broker event kinds handled by other components, e.g. "history".
+        self.event_handlers: Dict[str, Callable[[dict], None]] = {}
+        self.ping_interval_sec = ping_interval_sec
+        self.idle_timeout_sec = idle_timeout_sec
+        self._reaper_task: Optional[asyncio.Task] = None
+        self.presence = PresenceCoordinator(
+            self, flush_interval_ms=presence_flush_ms, grace_sec=presence_grace_sec
+        )
+        self.typing = (
+            TypingAggregator(self, **(typing_options or {}))
+            if typing_mode == "aggregate"
+            else None
+        )
+
+    async def start(self):
+        await self.broker.start(self._on_broker_event)
+        self.broker.publish({"kind": "hello"})
+        self._cluster_task = asyncio.create_task(self._cluster_loop())
+        self._reaper_task = asyncio.create_task(self._reaper_loop())
+        self.presence.start()
+        if self.typing is not None:
+            self.typing.start()
+
+    async def stop(self):
+        self.presence.stop()
+        if self.typing is not None:
+            self.typing.stop()
+        if self._cluster_task is not None:
+            self._cluster_task.cancel()
+            self._cluster_task = None
+        if self._reaper_task is not None:
+            self._reaper_task.cancel()
+            self._reaper_task = None
+        if self.broker.has_peers:
+            self.broker.publish({"kind": "bye"})
+        await self.broker.stop()
+
+    async def _cluster_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval_sec)
+            if self.broker.has_peers:
+                self.broker.publish({"kind": "heartbeat"})
+            self.remote.prune()
+
+    async def _reaper_loop(self):
+        interval = min(self.ping_interval_sec, self.idle_timeout_sec / 2)
+        while True:
+            await asyncio.sleep(interval)
+            self.reap()
+
+    def reap(self) -> int:
+        """Ping quiet heartbeat connections and evict the ones idle past the timeout."""
+        now = time.monotonic()
+        idle_before = now - self.idle_timeout_sec
+        ping_before = now - self.ping_interval_sec
+        stale = []
+        pings: dict[WireFormat, str | bytes] = {}
+        for conn in self.active_users.values():
+            if not conn.heartbeat:
+                continue
+            if conn.last_seen < idle_before:
+                stale.append(conn)
+            elif conn.last_seen < ping_before and (
+                conn.ping_sent_at is None or conn.ping_sent_at < ping_before
+            ):
+                ping = pings.get(conn.wire)
+                if ping is None:
+                    ping = pings[conn.wire] = conn.wire.dumps({"type": "ping"})
+                conn.ping_sent_at = now
+                self._enqueue(conn, ping, ephemeral=True)
 
-    async def connect(self, user_id: uuid.UUID, websocket: WebSocket):
+        for conn in stale:
+            conn.reaped = True
+            self._remove(conn)
+            self.presence.disconnected(conn.user_id, conn.subscriptions, immediate=True)
+            self._close_later(conn.socket, IDLE_CLOSE_CODE)
+        if stale:
+            WS_CONNECTIONS_REAPED.inc(amount=len(stale))
+        return len(stale)
+
+    @staticmethod
+    def touch(conn: Connection):
+        conn.last_seen = time.monotonic()
+
+    @staticmethod
+    def record_pong(conn: Connection):
+        if conn.ping_sent_at is not None:
+            WS_HEARTBEAT_RTT_SECONDS.observe(time.monotonic() - conn.ping_sent_at)
+            conn.ping_sent_at = None
+
+    def _on_broker_event(self, event: dict):
+        origin = event["origin"]
+        kind = event["kind"]
+        if kind == "bye":
+            self.remote.drop_node(origin)
+            return
+        self.remote.touch(origin)
+        if kind == "broadcast":
+            exclude = event.get("exclude_user_id")
+            self._deliver(
+                uuid.UUID(event["chat_id"]),
+                event["message"],
+                uuid.UUID(exclude) if exclude else None,
+                event["ephemeral"],
+            )
+        elif kind == "presence":
+            self.remote.set_user(origin, event["user_id"], event["chat_ids"])
+        elif kind == "hello":
+            self.broker.publish({"kind": "sync", "users": self._local_presence()})
+        elif kind == "sync":
+            self.remote.replace_node(origin, event["users"])
+        elif kind == "presence_diff":
+            self.presence.apply_remote(event["changes"])
+        elif kind == "typing" and self.typing is not None:
+            self.typing.update(
+                uuid.UUID(event["chat_id"]),
+                event["user_id"],
+                event["is_typing"],
+                publish=False,
+            )
+        elif kind in self.event_handlers:
+            self.event_handlers[kind](event)
+
+    def _local_presence(self) -> dict[str, list[str]]:
+        return {
+            str(uid): [str(cid) for cid in conn.subscriptions]
+            for uid, conn in self.active_users.items()
+        }
+
+    def _announce(self, conn: Connection, online: bool = True):
+        if not self.broker.has_peers:
+            return
+        self.broker.publish(
+            {
+                "kind": "presence",
+                "user_id": str(conn.user_id),
+                "chat_ids": [str(cid) for cid in conn.subscriptions] if online else [],
+            }
+        )
+
+    def wire_format(
+        self, encoding: str = "json", compression: Optional[str] = None
+    ) -> WireFormat:
+        """Shared instance per format, so fan-out can cache one payload per format."""
+        key = (encoding, compression)
+        wire = self._wire_formats.get(key)
+        if wire is None:
+            wire = self._wire_formats[key] = WireFormat(
+                encoding, compression, json_codec=self.codec
+            )
+        return wire
+
+    async def connect(
+        self,
+        user_id: uuid.UUID,
+        websocket: WebSocket,
+        wire: Optional[WireFormat] = None,
+        heartbeat: bool = False,
+    ) -> Connection:
         old = self.active_users.get(user_id)
         if old:
+            self._remove(old)
             try:
-                await old["socket"].close(code=1000)
+                await old.socket.close(code=1000)
             except Exception:
                 pass
 
-        self.active_users[user_id] = {"socket": websocket, "subscriptions": set()}
+        conn = Connection(user_id, websocket, wire or self.default_wire, heartbeat)
+        conn.writer = asyncio.create_task(self._writer(conn))
+        self.active_users[user_id] = conn
+        return conn
+
+    def disconnect(self, user_id: uuid.UUID, websocket: Optional[WebSocket] = None):
+        conn = self.active_users.get(user_id)
+        if conn is None:
+            return
+        if websocket is not None and conn.socket is not websocket:
+            return
+        self._remove(conn)
+
+    def _remove(self, conn: Connection):
+        if self.active_users.get(conn.user_id) is conn:
+            del self.active_users[conn.user_id]
+            self._announce(conn, online=False)
+        self._unindex(conn, conn.subscriptions)
+        conn.outbox.clear()
+        if conn.writer is not None and conn.writer is not asyncio.current_task():
+            conn.writer.cancel()
+        conn.writer = None
+
+    def _unindex(self, conn: Connection, chat_ids: Iterable[uuid.UUID]):
+        for chat_id in chat_ids:
+            subscribers = self._chat_subscribers.get(chat_id)
+            if subscribers is None:
+                continue
+            subscribers.discard(conn)
+            if not subscribers:
+                del self._chat_subscribers[chat_id]
+
+    async def _writer(self, conn: Connection):
+        try:
+            while True:
+                while conn.outbox:
+                    data, _ = conn.outbox.popleft()
+                    if isinstance(data, str):
+                        await conn.socket.send_text(data)
+                    else:
+                        await conn.socket.send_bytes(data)
+                conn.wakeup.clear()
+                await conn.wakeup.wait()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._remove(conn)
+
+    def _enqueue(self, conn: Connection, data: str | bytes, ephemeral: bool = False):
+        if conn.writer is None:
+            return
+        if len(conn.outbox) >= self.max_queue_size:
+            if self.slow_consumer_policy == "drop_ephemeral":
+                if ephemeral:
+                    conn.dropped += 1
+                    return
+                if self._drop_oldest_ephemeral(conn):
+                    conn.dropped += 1
+                else:
+                    self._evict_slow_consumer(conn)
+                    return
+            else:
+                self._evict_slow_consumer(conn)
+                return
+        conn.outbox.append((data, ephemeral))
+        conn.wakeup.set()
+
+    @staticmethod
+    def _drop_oldest_ephemeral(conn: Connection) -> bool:
+        for index, (_, ephemeral) in enumerate(conn.outbox):
+            if ephemeral:
+                del conn.outbox[index]
+                return True
+        return False
+
+    def _evict_slow_consumer(self, conn: Connection):
+        self._remove(conn)
+        self._close_later(conn.socket, SLOW_CONSUMER_CLOSE_CODE)
 
-    def disconnect(self, user_id: uuid.UUID):
-        if user_id in self.active_users:
-            del self.active_users[user_id]
+    def _close_later(self, socket: WebSocket, code: int):
+        task = asyncio.create_task(self._close(socket, code))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _close(socket: WebSocket, code: int):
+        try:
+            await socket.close(code=code)
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.active_users),
+            "subscribed_chats": len(self._chat_subscribers),
+            "subscriptions": sum(len(s) for s in self._chat_subscribers.values()),
+            "queued_frames": sum(c.queue_depth for c in self.active_users.values()),
+            "max_queue_depth": max(
+                (c.queue_depth for c in self.active_users.values()), default=0
+            ),
+            "typing_throttle_entries": len(self._typing_current)
+            + len(self._typing_previous),
+        }
+
+    def queue_depths(self, limit: Optional[int] = None) -> dict[str, int]:
+        """Outbox depth per user, deepest first."""
+        conns = heapq.nlargest(
+            len(self.active_users) if limit is None else limit,
+            self.active_users.values(),
+            key=lambda c: c.queue_depth,
+        )
+        return {conn.user_key: conn.queue_depth for conn in conns}
 
     def subscribe(self, user_id: uuid.UUID, chat_id: uuid.UUID):
-        if user_id in self.active_users:
-            self.active_users[user_id]["subscriptions"].add(chat_id)
+        conn = self.active_users.get(user_id)
+        if conn is None:
+            return
+        conn.subscriptions.add(chat_id)
+        self._chat_subscribers.setdefault(chat_id, set()).add(conn)
+        self._announce(conn)
 
     def unsubscribe(self, user_id: uuid.UUID, chat_id: uuid.UUID):
-        if user_id in self.active_users:
-            self.active_users[user_id]["subscriptions"].discard(chat_id)
+        conn = self.active_users.get(user_id)
+        if conn is None or chat_id not in conn.subscriptions:
+            return
+        conn.subscriptions.discard(chat_id)
+        self._unindex(conn, (chat_id,))
+        self._announce(conn)
 
     def subscribe_many(self, user_id: uuid.UUID, chat_ids: list[uuid.UUID]):
-        if user_id not in self.active_users:
+        conn = self.active_users.get(user_id)
+        if conn is None:
             return
-        self.active_users[user_id]["subscriptions"].update(chat_ids)
+        conn.subscriptions.update(chat_ids)
+        for chat_id in chat_ids:
+            self._chat_subscribers.setdefault(chat_id, set()).add(conn)
+        self._announce(conn)
 
     def get_user_subscriptions(self, user_id: uuid.UUID) -> set[uuid.UUID]:
-        data = self.active_users.get(user_id)
-        if not data:
+        conn = self.active_users.get(user_id)
+        if conn is None:
             return set()
-        return set(data["subscriptions"])
+        return set(conn.subscriptions)
+
+    def subscribers(self, chat_id: uuid.UUID) -> Iterable[Connection]:
+        return self._chat_subscribers.get(chat_id, ())
 
     def get_online_user_ids_in_chat(self, chat_id: uuid.UUID) -> list[str]:
-        online = []
-        for uid, data in self.active_users.items():
-            if chat_id in data["subscriptions"]:
-                online.append(str(uid))
-        return online
+        online = {conn.user_key for conn in self._chat_subscribers.get(chat_id, ())}
+        online.update(self.remote.users_in_chat(str(chat_id)))
+        return list(online)
 
     def typing_allowed(
         self, user_id: uuid.UUID, chat_id: uuid.UUID, min_interval_sec: float = 1.0
     ) -> bool:
+        now = time.monotonic()
+        elapsed = now - self._typing_rotated_at
+        if elapsed >= min_interval_sec:
+            self._typing_previous = (
+                self._typing_current if elapsed < 2 * min_interval_sec else {}
+            )
+            self._typing_current = {}
+            self._typing_rotated_at = now
         key = (user_id, chat_id)
-        now = time.time()
-        last = self._typing_last_sent.get(key, 0.0)
-        if now - last < min_interval_sec:
+        last = self._typing_current.get(key)
+        if last is None:
+            last = self._typing_previous.get(key)
+        if last is not None and now - last < min_interval_sec:
             return False
-        self._typing_last_sent[key] = now
+        self._typing_current[key] = now
         return True
 
     async def send_to_user(self, user_id: uuid.UUID, message: dict):
-        data = self.active_users.get(user_id)
-        if not data:
+        conn = self.active_users.get(user_id)
+        if conn is None:
             return
-        try:
-            await data["socket"].send_json(message)
-        except Exception:
-            self.disconnect(user_id)
+        self._enqueue(conn, conn.wire.dumps(message))
+
+    def broadcast_local(self, chat_id: uuid.UUID, message: dict, ephemeral=False):
+        self._deliver(chat_id, message, None, ephemeral)
+
+    def send(self, conn: Connection, message: dict):
+        self._enqueue(conn, conn.wire.dumps(message))
+
+    def send_ephemeral(self, conn: Connection, message: dict):
+        self._enqueue(conn, conn.wire.dumps(message), ephemeral=True)
+
+    @staticmethod
+    def hold(conn: Connection):
+        """Park the connection's broadcasts until ``release`` (ephemeral ones still flow)."""
+        conn.held = []
+
+    def release(self, conn: Connection, caught_up: dict[uuid.UUID, int]):
+        """Send parked broadcasts, skipping messages already sent during catch-up."""
+        held, conn.held = conn.held, None
+        for chat_id, seq, data in held or ():
+            if seq is not None and seq <= caught_up.get(chat_id, 0):
+                continue
+            self._enqueue(conn, data)
+
+    @staticmethod
+    async def wait_writable(conn: Connection, max_depth: int, poll_sec: float = 0.01):
+        while conn.writer is not None and len(conn.outbox) > max_depth:
+            await asyncio.sleep(poll_sec)
 
     async def broadcast(
         self,
         chat_id: uuid.UUID,
         message: dict,
         exclude_user_id: Optional[uuid.UUID] = None,
+        ephemeral: bool = False,
     ):
-        dead = []
-        for user_id, data in self.active_users.items():
-            if exclude_user_id and user_id == exclude_user_id:
+        self._deliver(chat_id, message, exclude_user_id, ephemeral)
+        if self.broker.has_peers:
+            self.broker.publish(
+                {
+                    "kind": "broadcast",
+                    "chat_id": str(chat_id),
+                    "message": message,
+                    "exclude_user_id": (
+                        str(exclude_user_id) if exclude_user_id else None
+                    ),
+                    "ephemeral": ephemeral,
+                }
+            )
+
+    def _deliver(
+        self,
+        chat_id: uuid.UUID,
+        message: dict,
+        exclude_user_id: Optional[uuid.UUID],
+        ephemeral: bool,
+    ):
+        subscribers = self._chat_subscribers.get(chat_id)
+        if not subscribers:
+            return
+        started = time.perf_counter()
+        # Encode once per wire format in use, not once per socket.
+        frames: dict[WireFormat, str | bytes] = {}
+        delivered = 0
+        for conn in tuple(subscribers):
+            if exclude_user_id and conn.user_id == exclude_user_id:
                 continue
-            if chat_id in data["subscriptions"]:
-                try:
-                    await data["socket"].send_json(message)
-                except Exception:
-                    dead.append(user_id)
-
-        for user_id in dead:
-            self.disconnect(user_id)
+            wire = conn.wire
+            data = frames.get(wire)
+            if data is None:
+                data = frames[wire] = wire.dumps(message)
+            if conn.held is not None and not ephemeral:
+                conn.held.append((chat_id, message.get("seq"), data))
+            else:
+                self._enqueue(conn, data, ephemeral)
+            delivered += 1
+        WS_BROADCAST_FANOUT.observe(delivered)
+        WS_BROADCAST_SECONDS.observe(time.perf_counter() - started)
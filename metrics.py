@@ -0,0 +1,285 @@
+"""Prometheus text-format metrics kept in process, scraped from GET /metrics.
+
+Histogram buckets are allocated once per label set (routes are registered at
+startup), so observing a value is a bisect and three in-place updates.
+"""
+
+import time
+from bisect import bisect_left
+from typing import Callable, Optional
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+
+from sql_instrumentation import track_queries
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+FAST_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000, 10_000, 100_000)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = (
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _HistogramChild:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: tuple = LATENCY_BUCKETS,
+        labelnames: tuple[str, ...] = (),
+        registry: Optional[Registry] = REGISTRY,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(float(b) for b in buckets)
+        self.labelnames = labelnames
+        self._children: dict[tuple, _HistogramChild] = {}
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values) -> _HistogramChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = _HistogramChild(len(self.buckets) + 1)
+        return child
+
+    def observe(self, value: float, *labels):
+        child = self._children.get(labels)
+        if child is None:
+            child = self.labels(*labels)
+        child.counts[bisect_left(self.buckets, value)] += 1
+        child.sum += value
+        child.count += 1
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                labels = _format_labels(
+                    self.labelnames + ("le",), values + (_format_value(bound),)
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames + ("le",), values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {child.count}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Counter:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        registry: Optional[Registry] = REGISTRY,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        if registry is not None:
+            registry.register(self)
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for values, value in self._values.items():
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+class StatsCollector:
+    """Exposes an existing ``stats()`` dict as gauges (``*_total`` as counters)."""
+
+    def __init__(
+        self,
+        prefix: str,
+        func: Callable[[], dict],
+        registry: Optional[Registry] = REGISTRY,
+    ):
+        self.prefix = prefix
+        self.func = func
+        if registry is not None:
+            registry.register(self)
+
+    def render(self) -> list[str]:
+        lines = []
+        for key, value in self.func().items():
+            name = f"{self.prefix}_{key}"
+            kind = "counter" if key.endswith("_total") else "gauge"
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {_format_value(value)}")
+        return lines
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    LATENCY_BUCKETS,
+    ("route", "method"),
+)
+HTTP_RESPONSES = Counter(
+    "http_responses_total", "HTTP responses by status.", ("route", "method", "status")
+)
+HTTP_REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "SQL statements executed per HTTP request.",
+    COUNT_BUCKETS,
+    ("route", "method"),
+)
+HTTP_REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds",
+    "Time spent in SQL statements per HTTP request.",
+    LATENCY_BUCKETS,
+    ("route", "method"),
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "SQL statement latency.", DB_QUERY_BUCKETS
+)
+WS_FRAME_DB_QUERIES = Histogram(
+    "ws_frame_db_queries",
+    "SQL statements executed per WebSocket frame.",
+    COUNT_BUCKETS,
+    ("action",),
+)
+WS_FRAME_DB_SECONDS = Histogram(
+    "ws_frame_db_seconds",
+    "Time spent in SQL statements per WebSocket frame.",
+    LATENCY_BUCKETS,
+    ("action",),
+)
+WS_HEARTBEAT_RTT_SECONDS = Histogram(
+    "ws_heartbeat_rtt_seconds",
+    "Round trip from a server ping to the client's pong.",
+    LATENCY_BUCKETS,
+)
+WS_CONNECTIONS_REAPED = Counter(
+    "ws_connections_reaped_total", "Connections closed by the idle reaper."
+)
+WS_RESUMED_MESSAGES = Counter(
+    "ws_resumed_messages_total", "Missed messages streamed to resuming clients."
+)
+WS_RESUME_TOO_FAR = Counter(
+    "ws_resume_too_far_total", "Resumed chats too far behind to catch up."
+)
+WS_BROADCAST_FANOUT = Histogram(
+    "ws_broadcast_fanout", "Local recipients per broadcast.", COUNT_BUCKETS
+)
+WS_BROADCAST_SECONDS = Histogram(
+    "ws_broadcast_duration_seconds",
+    "Time to encode and enqueue one broadcast locally.",
+    FAST_BUCKETS,
+)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        with track_queries() as usage:
+            started = time.perf_counter()
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                elapsed = time.perf_counter() - started
+                route = scope.get("route")
+                path = route.path if route is not None else "unmatched"
+                method = scope["method"]
+                usage.label = f"{method} {path}"
+                HTTP_REQUEST_SECONDS.observe(elapsed, path, method)
+                HTTP_REQUEST_DB_QUERIES.observe(usage.count, path, method)
+                HTTP_REQUEST_DB_SECONDS.observe(usage.seconds, path, method)
+                HTTP_RESPONSES.inc(path, method, status)
+
+
+def preallocate_routes(app):
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            for method in route.methods:
+                for histogram in (
+                    HTTP_REQUEST_SECONDS,
+                    HTTP_REQUEST_DB_QUERIES,
+                    HTTP_REQUEST_DB_SECONDS,
+                ):
+                    histogram.labels(route.path, method)
+
+
+metrics_router = APIRouter(tags=["metrics"])
+
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,32 @@
+"""messages history keyset index
+
+Revision ID: 3c7e1a9d52f4
+Revises: 21f8b5fc316b
+Create Date: 2026-10-18 10:12:40.118305
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3c7e1a9d52f4"
+down_revision: Union[str, Sequence[str], None] = "21f8b5fc316b"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        "ix_messages_chat_id_timestamp_id",
+        "messages",
+        ["chat_id", "timestamp", "id"],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_messages_chat_id_timestamp_id", table_name="messages")
@@ -0,0 +1,68 @@
+"""chat read state watermarks
+
+Revision ID: 7d2f4b9e6a10
+Revises: 3c7e1a9d52f4
+Create Date: 2026-10-18 12:31:05.402117
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "7d2f4b9e6a10"
+down_revision: Union[str, Sequence[str], None] = "3c7e1a9d52f4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "chat_read_state",
+        sa.Column("chat_id", sa.UUID(), nullable=False),
+        sa.Column("user_id", sa.UUID(), nullable=False),
+        sa.Column("last_read_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("last_read_message_id", sa.UUID(), nullable=False),
+        sa.ForeignKeyConstraint(["chat_id"], ["chats.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("chat_id", "user_id"),
+    )
+    # is_read was one flag per message, so every participant starts out
+    # having read up to the newest message flagged read in the chat.
+    op.execute("""
+        INSERT INTO chat_read_state (chat_id, user_id, last_read_at, last_read_message_id)
+        SELECT p.chat_id, p.user_id, newest.timestamp, newest.id
+        FROM chat_participants p
+        JOIN (
+            SELECT DISTINCT ON (chat_id) chat_id, timestamp, id
+            FROM messages
+            WHERE is_read AND timestamp IS NOT NULL
+            ORDER BY chat_id, timestamp DESC, id DESC
+        ) AS newest ON newest.chat_id = p.chat_id
+        WHERE p.user_id IS NOT NULL
+        ON CONFLICT DO NOTHING
+        """)
+    op.drop_column("messages", "is_read")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column(
+        "messages",
+        sa.Column("is_read", sa.Boolean(), nullable=True),
+    )
+    op.execute("""
+        UPDATE messages
+        SET is_read = (messages.timestamp, messages.id)
+            <= (latest.last_read_at, latest.last_read_message_id)
+        FROM (
+            SELECT DISTINCT ON (chat_id) chat_id, last_read_at, last_read_message_id
+            FROM chat_read_state
+            ORDER BY chat_id, last_read_at DESC, last_read_message_id DESC
+        ) AS latest
+        WHERE latest.chat_id = messages.chat_id
+        """)
+    op.drop_table("chat_read_state")
@@ -0,0 +1,50 @@
+"""chats last message for inbox
+
+Revision ID: a4e81c2f5b37
+Revises: 7d2f4b9e6a10
+Create Date: 2026-10-18 14:02:51.730264
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a4e81c2f5b37"
+down_revision: Union[str, Sequence[str], None] = "7d2f4b9e6a10"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "chats", sa.Column("last_message_at", sa.DateTime(timezone=True), nullable=True)
+    )
+    op.add_column("chats", sa.Column("last_message_id", sa.UUID(), nullable=True))
+    op.execute("""
+        UPDATE chats
+        SET last_message_at = latest.timestamp, last_message_id = latest.id
+        FROM (
+            SELECT DISTINCT ON (chat_id) chat_id, timestamp, id
+            FROM messages
+            ORDER BY chat_id, timestamp DESC, id DESC
+        ) AS latest
+        WHERE latest.chat_id = chats.id
+        """)
+    op.create_index(
+        "ix_chat_participants_user_id_chat_id",
+        "chat_participants",
+        ["user_id", "chat_id"],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        "ix_chat_participants_user_id_chat_id", table_name="chat_participants"
+    )
+    op.drop_column("chats", "last_message_id")
+    op.drop_column("chats", "last_message_at")
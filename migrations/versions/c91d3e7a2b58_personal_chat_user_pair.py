@@ -0,0 +1,80 @@
+"""personal chat user pair
+
+Revision ID: c91d3e7a2b58
+Revises: a4e81c2f5b37
+Create Date: 2026-10-18 15:20:14.518842
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c91d3e7a2b58"
+down_revision: Union[str, Sequence[str], None] = "a4e81c2f5b37"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("chats", sa.Column("user_low", sa.UUID(), nullable=True))
+    op.add_column("chats", sa.Column("user_high", sa.UUID(), nullable=True))
+    op.create_foreign_key(
+        "chats_user_low_fkey",
+        "chats",
+        "users",
+        ["user_low"],
+        ["id"],
+        ondelete="SET NULL",
+    )
+    op.create_foreign_key(
+        "chats_user_high_fkey",
+        "chats",
+        "users",
+        ["user_high"],
+        ["id"],
+        ondelete="SET NULL",
+    )
+    # uuid has no min/max aggregate; its text form sorts the same way.
+    # Only the oldest chat of a duplicated pair gets the pair.
+    op.execute("""
+        UPDATE chats
+        SET user_low = pairs.user_low, user_high = pairs.user_high
+        FROM (
+            SELECT
+                chat_id,
+                user_low,
+                user_high,
+                row_number() OVER (
+                    PARTITION BY user_low, user_high ORDER BY created_at, chat_id
+                ) AS rank
+            FROM (
+                SELECT
+                    p.chat_id,
+                    c.created_at,
+                    min(p.user_id::text)::uuid AS user_low,
+                    max(p.user_id::text)::uuid AS user_high
+                FROM chat_participants p
+                JOIN chats c ON c.id = p.chat_id
+                WHERE c.type = 'personal'
+                GROUP BY p.chat_id, c.created_at
+                HAVING count(DISTINCT p.user_id) = 2
+            ) AS personal
+        ) AS pairs
+        WHERE pairs.chat_id = chats.id AND pairs.rank = 1
+        """)
+    op.create_unique_constraint(
+        "uq_chats_personal_pair", "chats", ["user_low", "user_high"]
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint("uq_chats_personal_pair", "chats", type_="unique")
+    op.drop_constraint("chats_user_high_fkey", "chats", type_="foreignkey")
+    op.drop_constraint("chats_user_low_fkey", "chats", type_="foreignkey")
+    op.drop_column("chats", "user_high")
+    op.drop_column("chats", "user_low")
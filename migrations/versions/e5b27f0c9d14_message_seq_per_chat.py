@@ -0,0 +1,60 @@
+"""message seq per chat
+
+Revision ID: e5b27f0c9d14
+Revises: c91d3e7a2b58
+Create Date: 2026-10-18 16:41:07.205318
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e5b27f0c9d14"
+down_revision: Union[str, Sequence[str], None] = "c91d3e7a2b58"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "chats",
+        sa.Column("last_seq", sa.BigInteger(), server_default="0", nullable=False),
+    )
+    op.add_column("messages", sa.Column("seq", sa.BigInteger(), nullable=True))
+    # Existing messages are numbered in history order.
+    op.execute("""
+        UPDATE messages
+        SET seq = numbered.seq
+        FROM (
+            SELECT
+                id,
+                row_number() OVER (
+                    PARTITION BY chat_id ORDER BY timestamp, id
+                ) AS seq
+            FROM messages
+        ) AS numbered
+        WHERE numbered.id = messages.id
+        """)
+    op.execute("""
+        UPDATE chats
+        SET last_seq = counted.last_seq
+        FROM (
+            SELECT chat_id, max(seq) AS last_seq FROM messages GROUP BY chat_id
+        ) AS counted
+        WHERE counted.chat_id = chats.id
+        """)
+    op.alter_column("messages", "seq", nullable=False)
+    op.create_unique_constraint(
+        "uq_messages_chat_id_seq", "messages", ["chat_id", "seq"]
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint("uq_messages_chat_id_seq", "messages", type_="unique")
+    op.drop_column("messages", "seq")
+    op.drop_column("chats", "last_seq")
@@ -0,0 +1,21 @@
+import base64
+import binascii
+import uuid
+from datetime import datetime
+
+from fastapi import HTTPException
+
+
+def encode_cursor(timestamp: datetime, row_id: uuid.UUID) -> str:
+    raw = f"{timestamp.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        timestamp, row_id = raw.split("|", 1)
+        return datetime.fromisoformat(timestamp), uuid.UUID(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
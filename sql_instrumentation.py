@@ -0,0 +1,133 @@
+"""SQLAlchemy cursor hooks: per-scope query counting, slow-query log, N+1 warnings.
+
+A scope is one HTTP request or one WebSocket frame (see ``track_queries``).
+"""
+
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+import greenlet
+from sqlalchemy import event
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+_SKIP_FILES = {os.path.abspath(__file__), os.path.join(PROJECT_ROOT, "database.py")}
+
+
+class QueryUsage:
+    __slots__ = ("label", "count", "seconds", "statements")
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: dict[str, int] = {}
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        return [(sql, n) for sql, n in self.statements.items() if n >= threshold]
+
+
+query_usage: ContextVar[Optional[QueryUsage]] = ContextVar("query_usage", default=None)
+
+
+@contextmanager
+def track_queries(label: str = ""):
+    usage = QueryUsage(label)
+    token = query_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        query_usage.reset(token)
+        for statement, times in usage.repeated(settings.sql_repeat_threshold):
+            logger.warning(
+                "Possible N+1 in %s: statement ran %d times: %s",
+                usage.label,
+                times,
+                _shorten(statement),
+            )
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """Test helper: fail if the block runs more than ``limit`` statements."""
+    with track_queries("assert_max_queries") as usage:
+        yield usage
+    statements = "\n".join(
+        f"  {n}x {_shorten(sql)}" for sql, n in usage.statements.items()
+    )
+    assert (
+        usage.count <= limit
+    ), f"{usage.count} queries, expected at most {limit}:\n{statements}"
+
+
+def _shorten(statement: str, size: int = 300) -> str:
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= size else statement[:size] + "..."
+
+
+def _frames():
+    frame = sys._getframe(1)
+    while frame is not None:
+        yield frame
+        frame = frame.f_back
+    # Under the async engine the cursor runs in a child greenlet; the awaiting
+    # coroutine chain lives in the parent's suspended stack.
+    parent = greenlet.getcurrent().parent
+    frame = parent.gr_frame if parent is not None else None
+    while frame is not None:
+        yield frame
+        frame = frame.f_back
+
+
+def call_site() -> str:
+    for frame in _frames():
+        filename = frame.f_code.co_filename
+        if (
+            filename.startswith(PROJECT_ROOT)
+            and filename not in _SKIP_FILES
+            and "site-packages" not in filename
+        ):
+            path = os.path.relpath(filename, PROJECT_ROOT)
+            return f"{path}:{frame.f_lineno} in {frame.f_code.co_name}"
+    return "unknown"
+
+
+def instrument_engine(engine, on_statement: Optional[Callable[[float], None]] = None):
+    sync_engine = getattr(engine, "sync_engine", engine)
+    slow_sec = settings.sql_slow_query_ms / 1000
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        # Kept on the per-statement context rather than the pooled connection,
+        # so a statement that raises (and never reaches _after) leaves nothing.
+        if context is not None:
+            context.query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "query_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        if on_statement is not None:
+            on_statement(elapsed)
+        usage = query_usage.get()
+        if usage is not None:
+            usage.count += 1
+            usage.seconds += elapsed
+            usage.statements[statement] = usage.statements.get(statement, 0) + 1
+        if elapsed >= slow_sec:
+            logger.warning(
+                "Slow query %.1f ms at %s: %s",
+                elapsed * 1000,
+                call_site(),
+                _shorten(statement),
+            )
@@ -0,0 +1,109 @@
+import asyncio
+import base64
+import json
+import os
+import struct
+import subprocess
+import sys
+import time
+
+import pytest
+from test_multiworker import (
+    ROOT,
+    TEST_DATABASE_URL,
+    free_port,
+    register_and_login,
+    reset_schema,
+    wait_ready,
+)
+
+pytestmark = pytest.mark.skipif(
+    not TEST_DATABASE_URL, reason="TEST_DATABASE_URL (postgresql+asyncpg) is not set"
+)
+
+
+def masked_text_frame(text: str) -> bytes:
+    payload = text.encode()
+    mask = os.urandom(4)
+    header = bytes([0x81])
+    if len(payload) < 126:
+        header += bytes([0x80 | len(payload)])
+    else:
+        header += bytes([0x80 | 126]) + struct.pack("!H", len(payload))
+    return header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+async def connected_sockets(client, base_url: str) -> int:
+    body = (await client.get(f"{base_url}/metrics")).text
+    return int(float(body.split("\nws_connections ")[1].split()[0]))
+
+
+@pytest.mark.asyncio
+async def test_client_that_never_answers_pings_is_dropped():
+    import httpx
+
+    os.environ.setdefault("database_url", TEST_DATABASE_URL)
+    os.environ.setdefault("SECRET_KEY", "test-secret")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    await reset_schema()
+
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=TEST_DATABASE_URL,
+        SECRET_KEY=os.environ.get("SECRET_KEY", "test-secret"),
+        ALGORITHM=os.environ.get("ALGORITHM", "HS256"),
+        WS_PING_INTERVAL_SEC="0.5",
+    )
+    worker = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import uvicorn, main; "
+            f"uvicorn.run(main.app, port={port}, **main.UVICORN_WS_OPTIONS)",
+        ],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient() as client:
+            await wait_ready(client, base_url)
+            _, token = await register_and_login(client, base_url, "legacy")
+
+            # A bare socket: it never reads, so it never answers a ping, and
+            # it never asked for app-level heartbeats.
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            key = base64.b64encode(os.urandom(16)).decode()
+            writer.write(
+                (
+                    "GET /ws HTTP/1.1\r\n"
+                    f"Host: 127.0.0.1:{port}\r\n"
+                    "Upgrade: websocket\r\n"
+                    "Connection: Upgrade\r\n"
+                    f"Sec-WebSocket-Key: {key}\r\n"
+                    "Sec-WebSocket-Version: 13\r\n\r\n"
+                ).encode()
+            )
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(
+                masked_text_frame(json.dumps({"action": "auth", "token": token}))
+            )
+            await writer.drain()
+
+            deadline = time.monotonic() + 0.4
+            while await connected_sockets(client, base_url) != 1:
+                assert time.monotonic() < deadline
+                await asyncio.sleep(0.05)
+
+            # Ping timeout plus the 10 s websockets waits for the close handshake.
+            deadline = time.monotonic() + 15
+            while await connected_sockets(client, base_url) != 0:
+                assert time.monotonic() < deadline, "silent client was never dropped"
+                await asyncio.sleep(0.1)
+            writer.close()
+    finally:
+        worker.terminate()
+        worker.wait(timeout=10)
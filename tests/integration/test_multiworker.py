@@ -0,0 +1,158 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+import pytest
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(
+    not TEST_DATABASE_URL, reason="TEST_DATABASE_URL (postgresql+asyncpg) is not set"
+)
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def reset_schema():
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    import chats.models  # noqa: F401
+    import messages.models  # noqa: F401
+    import users.models  # noqa: F401
+    from database import Base
+
+    engine = create_async_engine(TEST_DATABASE_URL)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    await engine.dispose()
+
+
+def start_worker(port: int) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        DATABASE_URL=TEST_DATABASE_URL,
+        SECRET_KEY=os.environ.get("SECRET_KEY", "test-secret"),
+        ALGORITHM=os.environ.get("ALGORITHM", "HS256"),
+        WS_BROKER="postgres",
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(client, base_url: str):
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        try:
+            await client.get(f"{base_url}/api/users/")
+            return
+        except Exception:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{base_url} did not start")
+
+
+async def register_and_login(client, base_url: str, name: str) -> tuple[str, str]:
+    email = f"{name}-{uuid.uuid4().hex[:8]}@example.com"
+    created = await client.post(
+        f"{base_url}/api/users/register",
+        json={"name": name, "email": email, "password": "password123"},
+    )
+    login = await client.post(
+        f"{base_url}/api/users/login",
+        data={"username": email, "password": "password123"},
+    )
+    return created.json()["id"], login.json()["access_token"]
+
+
+async def recv_until(ws, predicate, timeout=5.0):
+    async with asyncio.timeout(timeout):
+        while True:
+            frame = json.loads(await ws.recv())
+            if predicate(frame):
+                return frame
+
+
+@pytest.mark.asyncio
+async def test_two_workers_share_messages_and_presence():
+    import httpx
+    import websockets
+
+    os.environ.setdefault("database_url", TEST_DATABASE_URL)
+    os.environ.setdefault("SECRET_KEY", "test-secret")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    await reset_schema()
+
+    port_a, port_b = free_port(), free_port()
+    workers = [start_worker(port_a), start_worker(port_b)]
+    url_a, url_b = f"http://127.0.0.1:{port_a}", f"http://127.0.0.1:{port_b}"
+    try:
+        async with httpx.AsyncClient() as client:
+            await wait_ready(client, url_a)
+            await wait_ready(client, url_b)
+            alice_id, alice_token = await register_and_login(client, url_a, "alice")
+            bob_id, bob_token = await register_and_login(client, url_a, "bob")
+            chat = await client.post(
+                f"{url_a}/api/chats/",
+                json={"title": "t", "type": "group", "participant_ids": [bob_id]},
+                headers={"Authorization": f"Bearer {alice_token}"},
+            )
+            chat_id = chat.json()["id"]
+
+        async with websockets.connect(f"ws://127.0.0.1:{port_a}/ws") as alice:
+            await alice.send(json.dumps({"action": "auth", "token": alice_token}))
+            await recv_until(alice, lambda f: f.get("type") == "presence.snapshot_all")
+            await asyncio.sleep(0.5)
+
+            async with websockets.connect(f"ws://127.0.0.1:{port_b}/ws") as bob:
+                await bob.send(json.dumps({"action": "auth", "token": bob_token}))
+                snapshot = await recv_until(
+                    bob, lambda f: f.get("type") == "presence.snapshot_all"
+                )
+                assert alice_id in snapshot["online_by_chat"][chat_id]
+
+                await recv_until(
+                    alice,
+                    lambda f: f.get("type") == "presence.batch"
+                    and any(u["user_id"] == bob_id for u in f["updates"]),
+                )
+
+                client_msg_id = str(uuid.uuid4())
+                await alice.send(
+                    json.dumps(
+                        {
+                            "action": "send_message",
+                            "chat_id": chat_id,
+                            "text": "hello from worker A",
+                            "client_msg_id": client_msg_id,
+                        }
+                    )
+                )
+                received = await recv_until(
+                    bob, lambda f: f.get("text") == "hello from worker A"
+                )
+                assert received["chat_id"] == chat_id
+
+                own = await recv_until(
+                    alice, lambda f: f.get("text") == "hello from worker A"
+                )
+                assert own["id"] == received["id"]
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait(timeout=10)
@@ -0,0 +1,51 @@
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from chats.models import Chat, ChatParticipant, ChatType, ParticipantRole
+from config import settings
+from database import Base
+from sql_instrumentation import instrument_engine
+from users.models import User
+
+
+@pytest_asyncio.fixture
+async def db(monkeypatch):
+    monkeypatch.setattr(settings, "sql_slow_query_ms", 0.0)
+    engine = create_async_engine(
+        "sqlite+aiosqlite://",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False},
+    )
+    instrument_engine(engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async with session_factory() as session:
+        owner, member, other = (
+            User(name=name, email=f"{name}@example.com", password="x")
+            for name in ("owner", "member", "other")
+        )
+        chat = Chat(title="group", type=ChatType.group)
+        session.add_all([owner, member, other, chat])
+        await session.flush()
+        session.add_all(
+            [
+                ChatParticipant(
+                    chat_id=chat.id, user_id=owner.id, role=ParticipantRole.owner
+                ),
+                ChatParticipant(chat_id=chat.id, user_id=member.id),
+            ]
+        )
+        await session.commit()
+
+    yield {
+        "sessions": session_factory,
+        "chat_id": chat.id,
+        "owner": owner.id,
+        "member": member.id,
+        "other": other.id,
+    }
+    await engine.dispose()
@@ -0,0 +1,346 @@
+import asyncio
+import json
+import uuid
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from starlette.websockets import WebSocketDisconnect, WebSocketState
+
+import messages.api_ws as api_ws
+from chats.cache import membership_cache
+from users.services import UserService
+
+
+class ScriptedSocket:
+    application_state = WebSocketState.CONNECTED
+
+    def __init__(self, frames):
+        self.frames = [json.dumps(frame) for frame in frames]
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self):
+        await asyncio.sleep(0)
+        if not self.frames:
+            raise WebSocketDisconnect(code=1000)
+        return self.frames.pop(0)
+
+    async def receive(self):
+        try:
+            return {"type": "websocket.receive", "text": await self.receive_text()}
+        except WebSocketDisconnect as e:
+            return {"type": "websocket.disconnect", "code": e.code}
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        self.application_state = WebSocketState.DISCONNECTED
+
+
+@pytest.fixture
+def ws_env(monkeypatch):
+    user_id, chat_id = uuid.uuid4(), uuid.uuid4()
+
+    async def fake_chat_ids(session, uid):
+        return [chat_id]
+
+    class FakeSessionContext:
+        async def __aenter__(self):
+            return Mock()
+
+        async def __aexit__(self, *exc):
+            return False
+
+    session_factory = Mock(side_effect=FakeSessionContext)
+    monkeypatch.setattr(api_ws, "async_session", session_factory)
+    monkeypatch.setattr("messages.api_ws.ChatService.list_user_chat_ids", fake_chat_ids)
+    token = UserService.create_access_token({"sub": str(user_id)})
+    return {
+        "token": token,
+        "user_id": user_id,
+        "chat_id": str(chat_id),
+        "sessions": session_factory,
+    }
+
+
+@pytest.mark.asyncio
+async def test_ephemeral_frames_run_no_statements(ws_env, monkeypatch):
+    membership_cache.set(uuid.UUID(ws_env["chat_id"]), ws_env["user_id"], True)
+    is_participant = AsyncMock()
+    monkeypatch.setattr("chats.services.ChatRepository.is_participant", is_participant)
+    socket = ScriptedSocket(
+        [
+            {"action": "auth", "token": ws_env["token"]},
+            {"action": "typing", "chat_id": ws_env["chat_id"]},
+            {"action": "ping", "ts": 1},
+            {"action": "unsubscribe", "chat_id": ws_env["chat_id"]},
+        ]
+    )
+
+    await api_ws.websocket_endpoint(socket)
+    await asyncio.sleep(0)
+
+    # the chat list lookup on connect, plus typing's cached membership check
+    assert ws_env["sessions"].call_count == 2
+    is_participant.assert_not_awaited()
+    assert {"type": "pong", "ts": 1} in socket.sent
+    assert not [frame for frame in socket.sent if frame.get("type") == "error"]
+
+
+@pytest.mark.asyncio
+async def test_typing_is_rejected_after_leaving_the_chat(ws_env):
+    chat_id = uuid.UUID(ws_env["chat_id"])
+    membership_cache.invalidate(chat_id, [ws_env["user_id"]])
+    membership_cache.set(chat_id, ws_env["user_id"], False)
+    socket = ScriptedSocket(
+        [
+            {"action": "auth", "token": ws_env["token"]},
+            {"action": "typing", "chat_id": ws_env["chat_id"]},
+        ]
+    )
+
+    await api_ws.websocket_endpoint(socket)
+    await asyncio.sleep(0)
+
+    errors = [frame for frame in socket.sent if frame.get("type") == "error"]
+    assert [e["status"] for e in errors] == [403]
+
+
+@pytest.mark.asyncio
+async def test_bad_frame_returns_error_and_keeps_connection(ws_env):
+    socket = ScriptedSocket(
+        [
+            {"action": "auth", "token": ws_env["token"]},
+            {"action": "typing", "chat_id": "not-a-uuid"},
+            {"action": "typing", "chat_id": str(uuid.uuid4())},
+            {"action": "ping", "ts": 2},
+        ]
+    )
+
+    await api_ws.websocket_endpoint(socket)
+    await asyncio.sleep(0)
+
+    errors = [frame for frame in socket.sent if frame.get("type") == "error"]
+    assert [e["status"] for e in errors] == [400, 403]
+    assert {"type": "pong", "ts": 2} in socket.sent
+
+
+@pytest.mark.asyncio
+async def test_read_messages_sends_one_watermark_per_chat(ws_env, monkeypatch):
+    chat_id = uuid.UUID(ws_env["chat_id"])
+    state = Mock(
+        chat_id=chat_id,
+        user_id=uuid.uuid4(),
+        last_read_message_id=uuid.uuid4(),
+        last_read_at=datetime.now(timezone.utc),
+    )
+    monkeypatch.setattr(
+        "messages.api_ws.MessageService.mark_as_read", AsyncMock(return_value=[state])
+    )
+    socket = ScriptedSocket(
+        [
+            {"action": "auth", "token": ws_env["token"]},
+            {
+                "action": "read_messages",
+                "message_ids": [str(uuid.uuid4()) for _ in range(50)],
+            },
+            {"action": "ping", "ts": 3},
+        ]
+    )
+
+    await api_ws.websocket_endpoint(socket)
+    await asyncio.sleep(0)
+
+    events = [frame for frame in socket.sent if frame.get("type") == "read.watermark"]
+    assert len(events) == 1
+    assert events[0]["chat_id"] == ws_env["chat_id"]
+    assert events[0]["last_read_message_id"] == str(state.last_read_message_id)
+
+
+@pytest.mark.asyncio
+async def test_batch_repeating_a_client_msg_id_broadcasts_the_message_once(
+    ws_env, monkeypatch
+):
+    chat_id = uuid.UUID(ws_env["chat_id"])
+    client_msg_id = uuid.uuid4()
+    message = Mock(
+        id=uuid.uuid4(),
+        chat_id=chat_id,
+        sender_id=ws_env["user_id"],
+        text="hi",
+        timestamp=datetime.now(timezone.utc),
+        seq=1,
+    )
+    create = AsyncMock(return_value=[message, message])
+    monkeypatch.setattr("messages.api_ws.MessageService.create_messages", create)
+    item = {"chat_id": str(chat_id), "text": "hi", "client_msg_id": str(client_msg_id)}
+    socket = ScriptedSocket(
+        [
+            {"action": "auth", "token": ws_env["token"]},
+            {"action": "send_messages", "messages": [item, item]},
+            {"action": "ping", "ts": 3},
+        ]
+    )
+
+    await api_ws.websocket_endpoint(socket)
+    await asyncio.sleep(0)
+
+    assert len(create.await_args.args[1]) == 2
+    delivered = [frame for frame in socket.sent if frame.get("text") == "hi"]
+    assert [frame["id"] for frame in delivered] == [str(message.id)]
+
+
+@pytest.mark.asyncio
+async def test_pool_timeout_returns_busy_and_keeps_connection(ws_env, monkeypatch):
+    monkeypatch.setattr(
+        "messages.api_ws.MessageService.mark_as_read",
+        AsyncMock(side_effect=PoolTimeoutError("QueuePool limit reached")),
+    )
+    socket = ScriptedSocket(
+        [
+            {"action": "auth", "token": ws_env["token"]},
+            {"action": "read_messages", "message_ids": [str(uuid.uuid4())]},
+            {"action": "ping", "ts": 4},
+        ]
+    )
+
+    await api_ws.websocket_endpoint(socket)
+    await asyncio.sleep(0)
+
+    errors = [frame for frame in socket.sent if frame.get("type") == "error"]
+    assert [e["status"] for e in errors] == [503]
+    assert {"type": "pong", "ts": 4} in socket.sent
+
+
+@pytest.mark.asyncio
+async def test_auth_negotiates_binary_wire_format(ws_env):
+    pytest.importorskip("msgpack")
+    socket = ScriptedSocket(
+        [
+            {
+                "action": "auth",
+                "token": ws_env["token"],
+                "encoding": "msgpack",
+                "compression": "deflate",
+            },
+            {"action": "ping", "ts": 5},
+        ]
+    )
+
+    await api_ws.websocket_endpoint(socket)
+    await asyncio.sleep(0)
+
+    ack, *frames = socket.sent
+    assert ack == {"type": "auth.ok", "encoding": "msgpack", "compression": "deflate"}
+    wire = api_ws.manager.wire_format("msgpack", "deflate")
+    decoded = [wire.loads(frame) for frame in frames]
+    assert decoded[0]["type"] == "presence.snapshot_all"
+    assert {"type": "pong", "ts": 5} in decoded
+
+
+def _seq_rows(chat_id, seqs):
+    return [
+        Mock(
+            id=uuid.uuid4(),
+            chat_id=chat_id,
+            sender_id=uuid.uuid4(),
+            text=f"m{seq}",
+            timestamp=datetime.now(timezone.utc),
+            seq=seq,
+        )
+        for seq in seqs
+    ]
+
+
+@pytest.mark.asyncio
+async def test_resume_streams_missed_messages_in_batches(ws_env, monkeypatch):
+    chat_id = uuid.UUID(ws_env["chat_id"])
+    monkeypatch.setattr(api_ws.settings, "ws_resume_batch_size", 2)
+    monkeypatch.setattr(
+        "messages.api_ws.MessageService.get_last_seqs",
+        AsyncMock(return_value={chat_id: 13}),
+    )
+    after_seq = AsyncMock(
+        side_effect=lambda session, cid, after, limit: _seq_rows(
+            cid, range(after + 1, min(after + limit, 13) + 1)
+        )
+    )
+    monkeypatch.setattr(
+        "messages.api_ws.MessageService.get_messages_after_seq", after_seq
+    )
+    socket = ScriptedSocket(
+        [
+            {
+                "action": "auth",
+                "token": ws_env["token"],
+                "resume": {ws_env["chat_id"]: 10, str(uuid.uuid4()): 1},
+            },
+            {"action": "ping", "ts": 6},
+        ]
+    )
+
+    await api_ws.websocket_endpoint(socket)
+    await asyncio.sleep(0)
+
+    batches = [f for f in socket.sent if f.get("type") == "resume.batch"]
+    assert [[m["seq"] for m in b["messages"]] for b in batches] == [[11, 12], [13]]
+    # Chats the user is not a member of are ignored.
+    assert after_seq.await_count == 2
+    assert {"type": "resume.done", "last_seq": {ws_env["chat_id"]: 13}} in socket.sent
+    assert api_ws.manager.active_users == {}
+
+
+@pytest.mark.asyncio
+async def test_resume_too_far_behind_asks_client_to_refetch(ws_env, monkeypatch):
+    chat_id = uuid.UUID(ws_env["chat_id"])
+    monkeypatch.setattr(api_ws.settings, "ws_resume_max_gap", 100)
+    monkeypatch.setattr(
+        "messages.api_ws.MessageService.get_last_seqs",
+        AsyncMock(return_value={chat_id: 500}),
+    )
+    after_seq = AsyncMock()
+    monkeypatch.setattr(
+        "messages.api_ws.MessageService.get_messages_after_seq", after_seq
+    )
+    socket = ScriptedSocket(
+        [{"action": "auth", "token": ws_env["token"], "resume": {str(chat_id): 3}}]
+    )
+
+    await api_ws.websocket_endpoint(socket)
+    await asyncio.sleep(0)
+
+    assert {
+        "type": "resume.too_far",
+        "chat_id": str(chat_id),
+        "last_seq": 500,
+    } in socket.sent
+    after_seq.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_auth_opts_in_to_heartbeats(ws_env, monkeypatch):
+    connect = AsyncMock(side_effect=api_ws.manager.connect)
+    monkeypatch.setattr(api_ws.manager, "connect", connect)
+    socket = ScriptedSocket(
+        [{"action": "auth", "token": ws_env["token"], "heartbeat": True}]
+    )
+
+    await api_ws.websocket_endpoint(socket)
+    await asyncio.sleep(0)
+
+    assert socket.sent[0] == {
+        "type": "auth.ok",
+        "encoding": "json",
+        "compression": None,
+        "ping_interval_sec": api_ws.manager.ping_interval_sec,
+        "idle_timeout_sec": api_ws.manager.idle_timeout_sec,
+    }
+    assert connect.await_args.args[-1] is True
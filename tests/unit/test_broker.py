@@ -0,0 +1,125 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from messages.broker import InMemoryBroker, InMemoryHub, PostgresBroker
+from messages.ws_manager import ConnectionManager
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+    async def close(self, code=1000):
+        pass
+
+
+async def drain():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def start_cluster(size):
+    hub = InMemoryHub()
+    managers = [ConnectionManager(broker=InMemoryBroker(hub)) for _ in range(size)]
+    for manager in managers:
+        await manager.start()
+    await drain()
+    return managers
+
+
+@pytest.mark.asyncio
+async def test_broadcast_reaches_subscribers_on_other_workers_once():
+    worker_a, worker_b = await start_cluster(2)
+    chat_id = uuid.uuid4()
+    alice, bob = uuid.uuid4(), uuid.uuid4()
+    alice_ws, bob_ws = FakeSocket(), FakeSocket()
+    await worker_a.connect(alice, alice_ws)
+    await worker_b.connect(bob, bob_ws)
+    worker_a.subscribe(alice, chat_id)
+    worker_b.subscribe(bob, chat_id)
+
+    await worker_a.broadcast(chat_id, {"text": "hi"})
+    await drain()
+
+    assert alice_ws.sent == [{"text": "hi"}]
+    assert bob_ws.sent == [{"text": "hi"}]
+    await worker_a.stop()
+    await worker_b.stop()
+
+
+@pytest.mark.asyncio
+async def test_presence_is_shared_and_dropped_when_worker_leaves():
+    worker_a, worker_b = await start_cluster(2)
+    chat_id = uuid.uuid4()
+    alice, bob = uuid.uuid4(), uuid.uuid4()
+    await worker_a.connect(alice, FakeSocket())
+    await worker_b.connect(bob, FakeSocket())
+    worker_a.subscribe_many(alice, [chat_id])
+    worker_b.subscribe_many(bob, [chat_id])
+    await drain()
+
+    assert sorted(worker_a.get_online_user_ids_in_chat(chat_id)) == sorted(
+        [str(alice), str(bob)]
+    )
+
+    await worker_b.stop()
+    await drain()
+    assert worker_a.get_online_user_ids_in_chat(chat_id) == [str(alice)]
+    await worker_a.stop()
+
+
+@pytest.mark.asyncio
+async def test_late_worker_receives_presence_snapshot():
+    (worker_a,) = await start_cluster(1)
+    chat_id, alice = uuid.uuid4(), uuid.uuid4()
+    await worker_a.connect(alice, FakeSocket())
+    worker_a.subscribe(alice, chat_id)
+
+    worker_b = ConnectionManager(broker=InMemoryBroker(worker_a.broker.hub))
+    await worker_b.start()
+    await drain()
+
+    assert worker_b.get_online_user_ids_in_chat(chat_id) == [str(alice)]
+    await worker_a.stop()
+    await worker_b.stop()
+
+
+def test_postgres_broker_chunks_large_payloads_and_ignores_own_events():
+    sender = PostgresBroker(engine=None)
+    receiver = PostgresBroker(engine=None)
+    received = []
+    receiver._handler = received.append
+    sender._handler = received.append
+    text = "x" * 20000 + "ё" * 5000
+
+    sender.publish({"kind": "broadcast", "message": {"text": text}})
+
+    assert len(sender._pending) > 1
+    assert all(len(p.encode()) < 8000 for p in sender._pending)
+    for payload in sender._pending:
+        sender._on_notify(None, 0, "chat_events", payload)
+        receiver._on_notify(None, 0, "chat_events", payload)
+    assert [event["message"]["text"] for event in received] == [text]
+
+
+@pytest.mark.asyncio
+async def test_postgres_broker_runs_reconnect_callbacks_once_listening_again(mocker):
+    broker = PostgresBroker(engine=None)
+    mocker.patch.object(broker, "_close_connection", mocker.AsyncMock())
+    listen = mocker.patch.object(
+        broker, "_listen", mocker.AsyncMock(side_effect=[OSError, None])
+    )
+    mocker.patch("messages.broker.asyncio.sleep", mocker.AsyncMock())
+    callback = mocker.Mock()
+    broker.on_reconnect.append(callback)
+
+    await broker._reconnect()
+
+    assert listen.await_count == 2
+    callback.assert_called_once_with()
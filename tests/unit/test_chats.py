@@ -47,3 +47,192 @@ async def test_create_chat_adds_creator_and_participants(mocker):
     assert result == fake_chat
     mock_add.assert_awaited()
     fake_session.commit.assert_awaited()
+
+
+@pytest.mark.asyncio
+async def test_open_existing_personal_chat_is_one_lookup(mocker):
+    fake_session = mocker.AsyncMock()
+    existing = mocker.Mock()
+    find = mocker.patch(
+        "chats.services.ChatRepository.find_personal_chat", return_value=existing
+    )
+    create = mocker.patch("chats.services.ChatRepository.create_personal_chat")
+    data = mocker.Mock(type="personal", participant_ids=[uuid.uuid4()])
+
+    result = await ChatService.create_chat(fake_session, data, creator_id=uuid.uuid4())
+
+    assert result is existing
+    find.assert_awaited_once()
+    create.assert_not_awaited()
+    fake_session.commit.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_personal_chat_create_race_returns_winner(mocker):
+    fake_session = mocker.AsyncMock()
+    winner = mocker.Mock()
+    mocker.patch(
+        "chats.services.ChatRepository.find_personal_chat",
+        side_effect=[None, winner],
+    )
+    mocker.patch(
+        "chats.services.ChatRepository.create_personal_chat", return_value=None
+    )
+    add = mocker.patch("chats.services.ChatRepository.add_participants")
+    data = mocker.Mock(type="personal", participant_ids=[uuid.uuid4()])
+
+    result = await ChatService.create_chat(fake_session, data, creator_id=uuid.uuid4())
+
+    assert result is winner
+    add.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_personal_chat_can_be_reopened_after_leaving(db):
+    data = type(
+        "Data",
+        (),
+        {"title": "dm", "type": "personal", "participant_ids": [db["other"]]},
+    )
+    async with db["sessions"]() as session:
+        left = await ChatService.create_chat(session, data, db["owner"])
+        await ChatService.leave_chat(session, left.id, db["owner"])
+
+    async with db["sessions"]() as session:
+        reopened = await ChatService.create_chat(session, data, db["owner"])
+        await ChatService.ensure_member(session, reopened.id, db["owner"])
+        await ChatService.ensure_member(session, reopened.id, db["other"])
+    assert reopened.id != left.id
+    assert (left.title, reopened.title) == ("dm", "dm")
+
+
+def test_personal_pair_is_order_independent():
+    from chats.repositories import ChatRepository
+
+    a, b = uuid.uuid4(), uuid.uuid4()
+    assert ChatRepository.personal_pair(a, b) == ChatRepository.personal_pair(b, a)
+
+
+@pytest.mark.asyncio
+async def test_ensure_member_is_cached(mocker):
+    fake_session = mocker.Mock()
+    is_participant = mocker.patch(
+        "chats.services.ChatRepository.is_participant", return_value=True
+    )
+    chat_id, user_id = uuid.uuid4(), uuid.uuid4()
+
+    await ChatService.ensure_member(fake_session, chat_id, user_id)
+    await ChatService.ensure_member(fake_session, chat_id, user_id)
+
+    assert is_participant.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_leave_chat_invalidates_membership(mocker):
+    fake_session = mocker.AsyncMock()
+    mocker.patch("chats.services.ChatRepository.is_participant", return_value=True)
+    mocker.patch("chats.services.ChatRepository.get_participant", return_value=object())
+    mocker.patch("chats.services.ChatRepository.remove_participant")
+    chat_id, user_id = uuid.uuid4(), uuid.uuid4()
+    await ChatService.ensure_member(fake_session, chat_id, user_id)
+
+    await ChatService.leave_chat(fake_session, chat_id, user_id)
+    mocker.patch("chats.services.ChatRepository.is_participant", return_value=False)
+
+    with pytest.raises(HTTPException) as e:
+        await ChatService.ensure_member(fake_session, chat_id, user_id)
+    assert e.value.status_code == 403
+
+
+def test_membership_cache_is_bounded_lru():
+    from chats.cache import MembershipCache
+
+    cache = MembershipCache(max_size=2)
+    chat_id = uuid.uuid4()
+    first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    cache.set(chat_id, first, True)
+    cache.set(chat_id, second, True)
+    cache.get(chat_id, first)
+    cache.set(chat_id, third, False)
+
+    assert cache.get(chat_id, second) is None
+    assert cache.get(chat_id, first) is True
+    assert cache.get(chat_id, third) is False
+    assert cache.stats() == {"size": 2, "hits": 3, "misses": 1}
+
+
+@pytest.mark.asyncio
+async def test_membership_invalidation_reaches_other_workers():
+    import asyncio
+
+    from chats.cache import MembershipCache
+    from messages.broker import InMemoryBroker, InMemoryHub
+
+    hub = InMemoryHub()
+    local, remote = MembershipCache(), MembershipCache()
+    for cache in (local, remote):
+        cache.broker = InMemoryBroker(hub)
+        await cache.broker.start(cache.apply_remote)
+    chat_id, user_id = uuid.uuid4(), uuid.uuid4()
+    remote.set(chat_id, user_id, True)
+
+    local.invalidate(chat_id, [user_id])
+    await asyncio.sleep(0)
+
+    assert remote.get(chat_id, user_id) is None
+
+
+@pytest.mark.asyncio
+async def test_miss_racing_an_invalidation_is_not_cached(mocker):
+    from chats.cache import membership_cache
+
+    chat_id, user_id = uuid.uuid4(), uuid.uuid4()
+
+    async def removed_while_reading(session, chat_id, user_id):
+        # remove_member commits and invalidates while this read is in flight.
+        membership_cache.invalidate(chat_id, [user_id])
+        return True
+
+    mocker.patch(
+        "chats.services.ChatRepository.is_participant",
+        side_effect=removed_while_reading,
+    )
+
+    await ChatService.ensure_member(mocker.Mock(), chat_id, user_id)
+
+    assert membership_cache.get(chat_id, user_id) is None
+
+
+@pytest.mark.asyncio
+async def test_get_inbox_builds_items_and_cursor(mocker):
+    from datetime import datetime, timezone
+
+    def chat(minute):
+        return mocker.Mock(
+            id=uuid.uuid4(),
+            last_message_at=datetime(2026, 1, 1, 12, minute, tzinfo=timezone.utc),
+        )
+
+    chats = [chat(3), chat(2), chat(1)]
+    read_state = mocker.Mock(last_read_message_id=uuid.uuid4())
+    rows = [(c, mocker.Mock(), read_state, i) for i, c in enumerate(chats)]
+    get_inbox = mocker.patch(
+        "chats.services.ChatRepository.get_inbox",
+        mocker.AsyncMock(return_value=rows),
+    )
+
+    page = await ChatService.get_inbox(mocker.Mock(), uuid.uuid4(), limit=2)
+
+    assert get_inbox.await_args.args[2] == 3
+    assert [item["chat"] for item in page["items"]] == chats[:2]
+    assert page["items"][1]["unread_count"] == 1
+    assert page["items"][0]["last_read_message_id"] == read_state.last_read_message_id
+
+    more = await ChatService.get_inbox(
+        mocker.Mock(), uuid.uuid4(), limit=2, cursor=page["next_cursor"]
+    )
+    assert get_inbox.await_args.kwargs["before"] == (
+        chats[1].last_message_at,
+        chats[1].id,
+    )
+    assert len(more["items"]) == 2
@@ -0,0 +1,58 @@
+import uuid
+import zlib
+
+import pytest
+
+from messages import codec
+from messages.codec import MsgpackCodec, WireFormat
+
+pytest.importorskip("msgpack")
+
+
+def test_msgpack_packs_ids_as_16_bytes_and_leaves_text_alone():
+    chat_id, user_id = uuid.uuid4(), uuid.uuid4()
+    frame = {
+        "type": "presence.snapshot_all",
+        "online_by_chat": {str(chat_id): [str(user_id)]},
+        "message": {"id": str(user_id), "text": str(chat_id)},
+    }
+
+    packed = MsgpackCodec.dumps(frame)
+
+    assert chat_id.bytes in packed and user_id.bytes in packed
+    assert str(chat_id).encode() in packed
+    decoded = MsgpackCodec.loads(packed)
+    assert decoded["online_by_chat"] == {str(chat_id): [str(user_id)]}
+    assert decoded["message"] == frame["message"]
+
+
+@pytest.mark.parametrize("encoding", ["json", "msgpack"])
+def test_deflated_formats_round_trip_as_binary(encoding):
+    wire = WireFormat(encoding, "deflate")
+    frame = {"type": "typing.state", "user_ids": [str(uuid.uuid4()) for _ in range(20)]}
+
+    data = wire.dumps(frame)
+
+    assert wire.binary and isinstance(data, bytes)
+    assert wire.loads(data) == frame
+    assert wire.loads('{"action": "ping"}') == {"action": "ping"}
+
+
+def test_unknown_formats_are_rejected():
+    with pytest.raises(ValueError):
+        WireFormat("xml")
+    with pytest.raises(ValueError):
+        WireFormat("json", "brotli")
+
+
+def test_inflating_past_the_frame_limit_is_rejected(monkeypatch):
+    monkeypatch.setattr(codec, "MAX_FRAME_BYTES", 1024)
+    wire = WireFormat("json", "deflate")
+    bomb = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = bomb.compress(b'{"text": "' + b"a" * 10_000 + b'"}') + bomb.flush()
+
+    assert len(data) < 1024
+    with pytest.raises(ValueError):
+        wire.loads(data)
+    with pytest.raises(ValueError):
+        wire.loads(data[:-4])
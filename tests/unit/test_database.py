@@ -0,0 +1,34 @@
+import pytest
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from config import Settings
+from database import build_engine, db_options
+
+
+def test_db_options_profile_with_overrides():
+    config = Settings(db_profile="prod", db_pool_size=7, db_echo=True)
+
+    options = db_options(config)
+
+    assert options["pool_size"] == 7
+    assert options["echo"] is True
+    assert options["pool_pre_ping"] is True
+
+
+@pytest.mark.asyncio
+async def test_pool_counts_waits_and_timeouts():
+    config = Settings(
+        db_pool_size=1, db_max_overflow=0, db_pool_timeout_sec=0.05, db_echo=False
+    )
+    engine = build_engine("sqlite+aiosqlite://", config)
+
+    held = await engine.connect()
+    with pytest.raises(PoolTimeoutError):
+        await engine.connect()
+    await held.close()
+
+    stats = engine.pool.stats
+    assert stats.timeouts_total == 1
+    assert stats.waits_total == 2
+    assert stats.max_wait_sec >= 0.05
+    await engine.dispose()
@@ -0,0 +1,97 @@
+import asyncio
+import uuid
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from fastapi import HTTPException
+
+from messages.ingest import IngestPipeline
+
+
+class FakeSessionContext:
+    def __init__(self):
+        self.session = AsyncMock()
+
+    async def __aenter__(self):
+        return self.session
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def item():
+    return Mock(chat_id=uuid.uuid4(), text="hi", client_msg_id=uuid.uuid4())
+
+
+@pytest.mark.asyncio
+async def test_concurrent_submits_share_one_commit(monkeypatch):
+    calls = []
+
+    async def fake_create_messages(session, messages):
+        calls.append(len(messages))
+        return messages
+
+    monkeypatch.setattr(
+        "messages.ingest.MessageRepository.create_messages", fake_create_messages
+    )
+    pipeline = IngestPipeline(FakeSessionContext, max_batch_size=10, max_delay_ms=50)
+    await pipeline.start()
+    items = [item() for _ in range(5)]
+
+    rows = await asyncio.gather(*(pipeline.submit(i, uuid.uuid4()) for i in items))
+
+    assert calls == [5]
+    assert [r.client_msg_id for r in rows] == [i.client_msg_id for i in items]
+    assert pipeline.stats()["commits_total"] == 1
+    assert pipeline.stats()["avg_batch_size"] == 5
+    await pipeline.stop()
+
+
+@pytest.mark.asyncio
+async def test_failing_row_does_not_fail_its_batch(monkeypatch):
+    bad = item()
+
+    async def fake_create_messages(session, messages):
+        if any(m.client_msg_id == bad.client_msg_id for m in messages):
+            raise RuntimeError("fk violation")
+        return messages
+
+    monkeypatch.setattr(
+        "messages.ingest.MessageRepository.create_messages", fake_create_messages
+    )
+    pipeline = IngestPipeline(FakeSessionContext, max_batch_size=3, max_delay_ms=50)
+    await pipeline.start()
+    good = item()
+
+    results = await asyncio.gather(
+        pipeline.submit(good, uuid.uuid4()),
+        pipeline.submit(bad, uuid.uuid4()),
+        return_exceptions=True,
+    )
+
+    assert results[0].client_msg_id == good.client_msg_id
+    assert isinstance(results[1], HTTPException)
+    await pipeline.stop()
+
+
+@pytest.mark.asyncio
+async def test_stop_fails_a_batch_whose_flush_was_cancelled(monkeypatch):
+    started = asyncio.Event()
+
+    async def hanging_create_messages(session, messages):
+        started.set()
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(
+        "messages.ingest.MessageRepository.create_messages", hanging_create_messages
+    )
+    pipeline = IngestPipeline(FakeSessionContext, max_batch_size=1, max_delay_ms=1)
+    await pipeline.start()
+    submitted = asyncio.create_task(pipeline.submit(item(), uuid.uuid4()))
+    await started.wait()
+
+    await pipeline.stop()
+
+    with pytest.raises(HTTPException) as exc:
+        await asyncio.wait_for(submitted, 1)
+    assert exc.value.status_code == 500
@@ -63,3 +63,257 @@ async def test_mark_as_read_commits(monkeypatch):
 
     assert result == fake_messages
     fake_session.commit.assert_awaited()
+
+
+@pytest.mark.asyncio
+async def test_mark_read_up_to_reports_advanced_watermark(mocker):
+    fake_session = AsyncMock()
+    state = Mock()
+    mocker.patch("messages.services.ChatService.ensure_member", AsyncMock())
+    mocker.patch(
+        "messages.services.MessageRepository.mark_read_up_to",
+        AsyncMock(return_value=state),
+    )
+
+    result = await MessageService.mark_read_up_to(
+        fake_session, uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    )
+
+    assert result == (state, True)
+    fake_session.commit.assert_awaited()
+
+
+@pytest.mark.asyncio
+async def test_mark_read_up_to_keeps_newer_watermark(mocker):
+    fake_session = AsyncMock()
+    current = Mock()
+    mocker.patch("messages.services.ChatService.ensure_member", AsyncMock())
+    mocker.patch(
+        "messages.services.MessageRepository.mark_read_up_to",
+        AsyncMock(return_value=None),
+    )
+    mocker.patch(
+        "messages.services.MessageRepository.get_read_state",
+        AsyncMock(return_value=current),
+    )
+
+    result = await MessageService.mark_read_up_to(
+        fake_session, uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    )
+
+    assert result == (current, False)
+
+
+@pytest.mark.asyncio
+async def test_get_chat_page_returns_next_cursor_when_more_rows(monkeypatch):
+    from datetime import datetime, timezone
+
+    from pagination import decode_cursor
+
+    rows = [
+        Mock(
+            id=uuid.uuid4(), timestamp=datetime(2026, 1, 1, 12, i, tzinfo=timezone.utc)
+        )
+        for i in range(3, 0, -1)
+    ]
+    calls = {}
+
+    async def fake_get_page(session, chat_id, limit, before, after, newest_first):
+        calls.update(limit=limit, before=before, newest_first=newest_first)
+        return rows
+
+    monkeypatch.setattr("messages.services.MessageRepository.get_page", fake_get_page)
+
+    page = await MessageService.get_chat_page(AsyncMock(), uuid.uuid4(), limit=2)
+
+    assert calls == {"limit": 3, "before": None, "newest_first": True}
+    assert page["items"] == rows[:2]
+    assert decode_cursor(page["next_cursor"]) == (rows[1].timestamp, rows[1].id)
+
+
+@pytest.mark.asyncio
+async def test_get_chat_page_last_page_has_no_cursor(monkeypatch):
+    async def fake_get_page(session, chat_id, limit, before, after, newest_first):
+        return [Mock()]
+
+    monkeypatch.setattr("messages.services.MessageRepository.get_page", fake_get_page)
+
+    page = await MessageService.get_chat_page(AsyncMock(), uuid.uuid4(), limit=2)
+
+    assert page["next_cursor"] is None
+
+
+@pytest.mark.asyncio
+async def test_get_chat_page_rejects_invalid_cursor():
+    from fastapi import HTTPException
+
+    with pytest.raises(HTTPException) as e:
+        await MessageService.get_chat_page(
+            AsyncMock(), uuid.uuid4(), limit=10, before="not-a-cursor"
+        )
+
+    assert e.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_chat_page_rejects_a_cursor_against_the_order():
+    from datetime import datetime, timezone
+
+    from fastapi import HTTPException
+
+    from messages.schemas import HistoryOrderSchema
+    from pagination import encode_cursor
+
+    cursor = encode_cursor(datetime.now(timezone.utc), uuid.uuid4())
+    for order, bound in (
+        (HistoryOrderSchema.newest, {"after": cursor}),
+        (HistoryOrderSchema.oldest, {"before": cursor}),
+    ):
+        with pytest.raises(HTTPException) as e:
+            await MessageService.get_chat_page(
+                AsyncMock(), uuid.uuid4(), limit=10, order=order, **bound
+            )
+        assert e.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_chat_page_walks_forward_across_pages(db):
+    from datetime import datetime, timedelta, timezone
+
+    from messages.models import Messages
+    from messages.schemas import HistoryOrderSchema
+
+    base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    async with db["sessions"]() as session:
+        session.add_all(
+            Messages(
+                chat_id=db["chat_id"],
+                sender_id=db["owner"],
+                text=f"m{i}",
+                timestamp=base + timedelta(seconds=i),
+                seq=i + 1,
+            )
+            for i in range(5)
+        )
+        await session.commit()
+
+        texts, cursor = [], None
+        while True:
+            page = await MessageService.get_chat_page(
+                session,
+                db["chat_id"],
+                limit=2,
+                after=cursor,
+                order=HistoryOrderSchema.oldest,
+            )
+            texts += [m.text for m in page["items"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+
+    assert texts == ["m0", "m1", "m2", "m3", "m4"]
+
+
+@pytest.mark.asyncio
+async def test_create_messages_checks_each_chat_once_and_commits_once(mocker):
+    fake_session = AsyncMock()
+    ensure_member = mocker.patch("messages.services.ChatService.ensure_member")
+    chat_a, chat_b = uuid.uuid4(), uuid.uuid4()
+    dup_id = uuid.uuid4()
+    items = [
+        Mock(chat_id=chat_a, text="1", client_msg_id=dup_id),
+        Mock(chat_id=chat_b, text="2", client_msg_id=uuid.uuid4()),
+        Mock(chat_id=chat_a, text="1 again", client_msg_id=dup_id),
+    ]
+
+    async def fake_create_messages(session, messages):
+        return messages
+
+    create = mocker.patch(
+        "messages.services.MessageRepository.create_messages",
+        side_effect=fake_create_messages,
+    )
+    sender_id = uuid.uuid4()
+
+    result = await MessageService.create_messages(fake_session, items, sender_id)
+
+    assert ensure_member.await_count == 2
+    assert create.await_count == 1
+    assert [m.text for m in create.await_args.args[1]] == ["1", "2"]
+    assert [m.client_msg_id for m in result] == [i.client_msg_id for i in items]
+    fake_session.commit.assert_awaited_once()
+
+
+def _rows(chat_id, count, start=0):
+    from datetime import datetime, timedelta, timezone
+    from types import SimpleNamespace
+
+    base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    return [
+        SimpleNamespace(
+            id=uuid.uuid4(),
+            chat_id=chat_id,
+            sender_id=uuid.uuid4(),
+            text=f"m{i}",
+            timestamp=base + timedelta(seconds=i),
+            seq=i + 1,
+        )
+        for i in range(start, start + count)
+    ]
+
+
+def test_history_cache_serves_newest_page_after_read_through_and_writes():
+    import json
+
+    from messages.cache import HistoryCache
+    from pagination import decode_cursor
+
+    cache = HistoryCache(per_chat=10)
+    chat_id = uuid.uuid4()
+    rows = _rows(chat_id, 4)
+    assert cache.newest_page(chat_id, 3, 4) is None
+
+    cache.fill(chat_id, rows[::-1], exhaustive=False)
+    (new,) = _rows(chat_id, 1, start=4)
+    cache.add_messages([new, rows[-1]])
+
+    page = json.loads(cache.newest_page(chat_id, 3, 5))
+    assert [item["text"] for item in page["items"]] == ["m4", "m3", "m2"]
+    assert decode_cursor(page["next_cursor"]) == (rows[2].timestamp, rows[2].id)
+    assert cache.newest_page(chat_id, 5, 5) is None
+    assert cache.stats()["hits_total"] == 1
+
+
+def test_history_cache_small_chat_is_complete_and_budget_evicts_lru():
+    import json
+
+    from messages.cache import HistoryCache
+
+    cache = HistoryCache(per_chat=10)
+    small, other = uuid.uuid4(), uuid.uuid4()
+    cache.fill(small, _rows(small, 2)[::-1], exhaustive=True)
+    assert json.loads(cache.newest_page(small, 50, 2))["next_cursor"] is None
+
+    cache.max_bytes = cache.bytes + 1
+    cache.fill(other, _rows(other, 2)[::-1], exhaustive=True)
+
+    assert cache.newest_page(small, 50, 2) is None
+    assert cache.newest_page(other, 50, 2) is not None
+    assert cache.stats()["evictions_total"] == 1
+    assert cache.bytes <= cache.max_bytes
+
+
+def test_history_cache_drops_a_ring_that_missed_a_write():
+    from messages.cache import HistoryCache
+
+    cache = HistoryCache(per_chat=10)
+    chat_id = uuid.uuid4()
+    cache.fill(chat_id, _rows(chat_id, 3)[::-1], exhaustive=True)
+
+    # Another worker wrote seq 4 and the broker event never arrived.
+    assert cache.newest_page(chat_id, 50, 4) is None
+    assert cache.stats()["chats"] == 0
+
+    disabled = HistoryCache(per_chat=10, enabled=False)
+    disabled.fill(chat_id, _rows(chat_id, 3)[::-1], exhaustive=True)
+    assert disabled.newest_page(chat_id, 50, 3) is None
@@ -0,0 +1,46 @@
+import uuid
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from metrics import (
+    HTTP_REQUEST_SECONDS,
+    HTTP_RESPONSES,
+    Histogram,
+    MetricsMiddleware,
+    Registry,
+)
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = Histogram("demo_seconds", "Demo.", (0.1, 1.0), registry=registry)
+
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(0.5)
+    histogram.observe(3)
+
+    text = registry.render()
+    assert 'demo_seconds_bucket{le="0.1"} 2' in text
+    assert 'demo_seconds_bucket{le="1"} 3' in text
+    assert 'demo_seconds_bucket{le="+Inf"} 4' in text
+    assert "demo_seconds_count 4" in text
+
+
+def test_middleware_labels_by_route_template():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: uuid.UUID):
+        return {"id": str(item_id)}
+
+    client = TestClient(app)
+    client.get(f"/items/{uuid.uuid4()}")
+    client.get(f"/items/{uuid.uuid4()}")
+    client.get("/items/not-a-uuid")
+
+    assert HTTP_REQUEST_SECONDS.labels("/items/{item_id}", "GET").count == 3
+    assert HTTP_RESPONSES._values[("/items/{item_id}", "GET", 200)] == 2
+    assert HTTP_RESPONSES._values[("/items/{item_id}", "GET", 422)] == 1
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from messages.broker import InMemoryBroker, InMemoryHub
+from messages.ws_manager import ConnectionManager
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+    async def close(self, code=1000):
+        pass
+
+
+async def drain():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def join(manager, user_id, chat_ids):
+    socket = FakeSocket()
+    conn = await manager.connect(user_id, socket)
+    manager.subscribe_many(user_id, chat_ids)
+    manager.presence.connected(conn)
+    return socket
+
+
+def leave(manager, user_id):
+    subscriptions = manager.get_user_subscriptions(user_id)
+    manager.disconnect(user_id)
+    manager.presence.disconnected(user_id, subscriptions)
+
+
+def batches(socket):
+    return [frame for frame in socket.sent if frame["type"] == "presence.batch"]
+
+
+@pytest.mark.asyncio
+async def test_changes_are_coalesced_into_one_frame_per_recipient():
+    manager = ConnectionManager()
+    chats = [uuid.uuid4() for _ in range(300)]
+    watcher, alice, bob = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    watcher_ws = await join(manager, watcher, chats)
+    manager.presence.flush()
+    await join(manager, alice, chats)
+    await join(manager, bob, chats[:2])
+
+    manager.presence.flush()
+    await drain()
+
+    (frame,) = batches(watcher_ws)
+    updates = {u["user_id"]: u for u in frame["updates"]}
+    assert updates[str(alice)]["status"] == "online"
+    assert len(updates[str(alice)]["chat_ids"]) == 300
+    assert sorted(updates[str(bob)]["chat_ids"]) == sorted(map(str, chats[:2]))
+
+
+@pytest.mark.asyncio
+async def test_reconnect_within_grace_emits_nothing():
+    manager = ConnectionManager(presence_grace_sec=60)
+    chat_id = uuid.uuid4()
+    watcher, alice = uuid.uuid4(), uuid.uuid4()
+    watcher_ws = await join(manager, watcher, [chat_id])
+    await join(manager, alice, [chat_id])
+    manager.presence.flush()
+    await drain()
+    watcher_ws.sent.clear()
+
+    leave(manager, alice)
+    manager.presence.flush()
+    assert manager.presence.snapshot([chat_id])[str(chat_id)].count(str(alice)) == 1
+    await join(manager, alice, [chat_id])
+    manager.presence.flush()
+    await drain()
+
+    assert batches(watcher_ws) == []
+    assert manager.presence.suppressed_total == 1
+
+
+@pytest.mark.asyncio
+async def test_offline_is_sent_after_grace_and_flapping_before_announce_is_silent():
+    manager = ConnectionManager(presence_grace_sec=0.01)
+    chat_id = uuid.uuid4()
+    watcher, alice, bob = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    watcher_ws = await join(manager, watcher, [chat_id])
+    await join(manager, alice, [chat_id])
+    manager.presence.flush()
+    await drain()
+    watcher_ws.sent.clear()
+
+    leave(manager, alice)
+    await join(manager, bob, [chat_id])
+    leave(manager, bob)
+    await asyncio.sleep(0.02)
+    manager.presence.flush()
+    await drain()
+
+    (frame,) = batches(watcher_ws)
+    assert frame["updates"] == [
+        {"user_id": str(alice), "status": "offline", "chat_ids": [str(chat_id)]}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_presence_diffs_reach_subscribers_on_other_workers():
+    hub = InMemoryHub()
+    worker_a = ConnectionManager(broker=InMemoryBroker(hub))
+    worker_b = ConnectionManager(broker=InMemoryBroker(hub))
+    await worker_a.start()
+    await worker_b.start()
+    chat_id = uuid.uuid4()
+    alice, bob = uuid.uuid4(), uuid.uuid4()
+    alice_ws = await join(worker_a, alice, [chat_id])
+    await join(worker_b, bob, [chat_id])
+
+    worker_b.presence.flush()
+    await drain()
+    worker_a.presence.flush()
+    await drain()
+
+    (frame,) = batches(alice_ws)
+    assert frame["updates"][0]["user_id"] == str(bob)
+    await worker_a.stop()
+    await worker_b.stop()
+
+
+@pytest.mark.asyncio
+async def test_reconnect_on_another_worker_within_grace_emits_nothing():
+    hub = InMemoryHub()
+    worker_a = ConnectionManager(broker=InMemoryBroker(hub), presence_grace_sec=0.05)
+    worker_b = ConnectionManager(broker=InMemoryBroker(hub), presence_grace_sec=0.05)
+    await worker_a.start()
+    await worker_b.start()
+    chat_id = uuid.uuid4()
+    alice, bob = uuid.uuid4(), uuid.uuid4()
+    bob_ws = await join(worker_a, bob, [chat_id])
+    await join(worker_a, alice, [chat_id])
+    worker_a.presence.flush()
+    await drain()
+    bob_ws.sent.clear()
+
+    leave(worker_a, alice)
+    await join(worker_b, alice, [chat_id])
+    worker_b.presence.flush()
+    await drain()
+    worker_a.presence.flush()
+    await asyncio.sleep(0.06)
+    worker_a.presence.flush()
+    await drain()
+    assert batches(bob_ws) == []
+
+    # Back on worker A later, she is announced again.
+    leave(worker_b, alice)
+    await asyncio.sleep(0.06)
+    worker_b.presence.flush()
+    await drain()
+    worker_a.presence.flush()
+    await join(worker_a, alice, [chat_id])
+    worker_a.presence.flush()
+    await drain()
+    statuses = [u["status"] for frame in batches(bob_ws) for u in frame["updates"]]
+    assert statuses == ["offline", "online"]
+    await worker_a.stop()
+    await worker_b.stop()
+
+
+@pytest.mark.asyncio
+async def test_local_offline_and_remote_online_in_one_flush_stay_apart():
+    manager = ConnectionManager()
+    kept, moved = uuid.uuid4(), uuid.uuid4()
+    alice, bob = uuid.uuid4(), uuid.uuid4()
+    bob_ws = await join(manager, bob, [kept, moved])
+    await join(manager, alice, [kept, moved])
+    manager.presence.flush()
+    await drain()
+    bob_ws.sent.clear()
+
+    # Reaped here, and already back on a peer in one of the chats.
+    subscriptions = manager.get_user_subscriptions(alice)
+    manager.disconnect(alice)
+    manager.presence.disconnected(alice, subscriptions, immediate=True)
+    manager.presence.apply_remote(
+        [{"user_id": str(alice), "status": "online", "chat_ids": [str(moved)]}]
+    )
+    manager.presence.flush()
+    await drain()
+
+    (frame,) = batches(bob_ws)
+    assert sorted((u["status"], u["chat_ids"]) for u in frame["updates"]) == [
+        ("offline", [str(kept)]),
+        ("online", [str(moved)]),
+    ]
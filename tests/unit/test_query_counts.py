@@ -0,0 +1,87 @@
+import logging
+
+import pytest
+
+from chats.services import ChatService
+from config import settings
+from sql_instrumentation import assert_max_queries, track_queries
+
+
+@pytest.mark.asyncio
+async def test_add_member_query_budget(db):
+    async with db["sessions"]() as session:
+        with assert_max_queries(2):
+            await ChatService.add_member(
+                session, db["chat_id"], db["other"], db["owner"]
+            )
+
+
+@pytest.mark.asyncio
+async def test_remove_member_query_budget(db):
+    async with db["sessions"]() as session:
+        with assert_max_queries(2):
+            await ChatService.remove_member(
+                session, db["chat_id"], db["member"], db["owner"]
+            )
+
+
+@pytest.mark.asyncio
+async def test_open_existing_personal_chat_query_budget(db):
+    data = type(
+        "Data",
+        (),
+        {"title": None, "type": "personal", "participant_ids": [db["other"]]},
+    )
+    async with db["sessions"]() as session:
+        created = await ChatService.create_chat(session, data, db["owner"])
+    async with db["sessions"]() as session:
+        with assert_max_queries(1):
+            opened = await ChatService.create_chat(session, data, db["owner"])
+    assert opened.id == created.id
+
+
+@pytest.mark.asyncio
+async def test_assert_max_queries_reports_overrun(db):
+    async with db["sessions"]() as session:
+        with pytest.raises(AssertionError, match="3 queries, expected at most 2"):
+            with assert_max_queries(2):
+                for _ in range(3):
+                    await ChatService.get_participants(session, db["chat_id"])
+
+
+@pytest.mark.asyncio
+async def test_repeated_statements_and_slow_queries_are_logged(db, caplog, monkeypatch):
+    monkeypatch.setattr(settings, "sql_repeat_threshold", 3)
+    caplog.set_level(logging.WARNING, logger="sql_instrumentation")
+
+    async with db["sessions"]() as session:
+        with track_queries("GET /test") as usage:
+            for _ in range(3):
+                await ChatService.get_participants(session, db["chat_id"])
+
+    assert usage.count == 3
+    messages = [record.getMessage() for record in caplog.records]
+    assert any(
+        "Possible N+1 in GET /test: statement ran 3 times" in m for m in messages
+    )
+    assert any(
+        "chats/repositories.py" in m and "get_participants" in m for m in messages
+    )
+
+
+@pytest.mark.asyncio
+async def test_failed_statements_leave_no_timing_state_on_the_connection(db):
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    async with db["sessions"]() as session:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                await session.execute(text("SELECT * FROM missing_table"))
+            await session.rollback()
+        with track_queries("GET /test") as usage:
+            await ChatService.get_participants(session, db["chat_id"])
+        info = (await session.connection()).info
+
+    assert usage.count == 1
+    assert not any(isinstance(value, list) and value for value in info.values())
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from messages.broker import InMemoryBroker, InMemoryHub
+from messages.ws_manager import ConnectionManager
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+    async def close(self, code=1000):
+        pass
+
+
+async def drain():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def typing_frames(socket):
+    return [frame for frame in socket.sent if frame["type"] == "typing.state"]
+
+
+async def members(manager, chat_id, count):
+    sockets = []
+    for _ in range(count):
+        user_id, socket = uuid.uuid4(), FakeSocket()
+        await manager.connect(user_id, socket)
+        manager.subscribe(user_id, chat_id)
+        sockets.append(socket)
+    return sockets
+
+
+@pytest.mark.asyncio
+async def test_typists_are_aggregated_and_expire():
+    manager = ConnectionManager(
+        typing_mode="aggregate", typing_options={"ttl_sec": 0.01, "interval_ms": 0}
+    )
+    chat_id = uuid.uuid4()
+    (watcher,) = await members(manager, chat_id, 1)
+    typists = [str(uuid.uuid4()) for _ in range(20)]
+    for user_key in typists:
+        manager.typing.update(chat_id, user_key, True)
+        manager.typing.update(chat_id, user_key, True)
+
+    manager.typing.flush()
+    await drain()
+    (frame,) = typing_frames(watcher)
+    assert sorted(frame["user_ids"]) == sorted(typists)
+
+    await asyncio.sleep(0.02)
+    manager.typing.flush()
+    manager.typing.flush()
+    await drain()
+    assert typing_frames(watcher)[-1]["user_ids"] == []
+    assert len(typing_frames(watcher)) == 2
+    assert manager.typing.stats()["chats_typing"] == 0
+
+
+@pytest.mark.asyncio
+async def test_large_chats_are_slowed_down_and_huge_ones_suppressed():
+    manager = ConnectionManager(
+        typing_mode="aggregate",
+        typing_options={"large_chat_size": 2, "suppress_above": 5},
+    )
+    large, huge = uuid.uuid4(), uuid.uuid4()
+    large_sockets = await members(manager, large, 4)
+    huge_sockets = await members(manager, huge, 6)
+
+    manager.typing.update(large, "a", True)
+    manager.typing.update(huge, "a", True)
+    manager.typing.flush()
+    manager.typing.update(large, "b", True)
+    manager.typing.flush()
+    await drain()
+
+    assert len(typing_frames(large_sockets[0])) == 1
+    assert typing_frames(huge_sockets[0]) == []
+    assert manager.typing.suppressed_total == 1
+
+
+@pytest.mark.asyncio
+async def test_typing_is_shared_with_other_workers():
+    hub = InMemoryHub()
+    options = {"typing_mode": "aggregate", "typing_options": {"interval_ms": 0}}
+    worker_a = ConnectionManager(broker=InMemoryBroker(hub), **options)
+    worker_b = ConnectionManager(broker=InMemoryBroker(hub), **options)
+    await worker_a.start()
+    await worker_b.start()
+    chat_id = uuid.uuid4()
+    (watcher,) = await members(worker_b, chat_id, 1)
+
+    worker_a.typing.update(chat_id, "alice", True)
+    await drain()
+    worker_b.typing.flush()
+    await drain()
+
+    assert typing_frames(watcher)[0]["user_ids"] == ["alice"]
+    await worker_a.stop()
+    await worker_b.stop()
@@ -2,7 +2,7 @@ from unittest.mock import AsyncMock, Mock
 
 import pytest
 
-from users.services import UserService
+from users.services import UserService, jwt
 
 
 def test_hash_and_verify_password():
@@ -34,3 +34,64 @@ async def test_register_user_calls_repo(monkeypatch):
 
     result = await UserService.register_user(fake_session, user_in)
     assert result.email == "alice@example.com"
+
+
+def test_principal_is_cached_until_token_expires(mocker):
+    import uuid
+
+    from users.auth import token_cache
+
+    user_id = uuid.uuid4()
+    token = UserService.create_access_token({"sub": str(user_id)})
+    decode = mocker.spy(jwt, "decode")
+
+    first = UserService.get_principal_by_token(token)
+    second = UserService.get_principal_by_token(token)
+
+    assert first.id == user_id
+    assert second is first
+    assert decode.call_count == 1
+
+    first.expires_at = 0.0
+    UserService.get_principal_by_token(token)
+    assert decode.call_count == 2
+    token_cache.clear()
+
+
+def test_invalid_token_is_rejected():
+    from fastapi import HTTPException
+
+    with pytest.raises(HTTPException) as e:
+        UserService.get_principal_by_token("not-a-jwt")
+
+    assert e.value.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_verify_password_async_runs_off_loop():
+    hashed = await UserService.hash_password_async("secret123")
+
+    assert await UserService.verify_password_async("secret123", hashed) is True
+    assert await UserService.verify_password_async("wrong", hashed) is False
+
+
+@pytest.mark.asyncio
+async def test_password_pool_fails_fast_when_saturated():
+    import asyncio
+    import threading
+
+    from fastapi import HTTPException
+
+    from users.auth import PasswordHashPool
+
+    pool = PasswordHashPool(max_workers=1, max_pending=1)
+    release = threading.Event()
+    blocked = asyncio.create_task(pool.run(release.wait))
+    await asyncio.sleep(0)
+
+    with pytest.raises(HTTPException) as e:
+        await pool.run(lambda: None)
+
+    assert e.value.status_code == 503
+    release.set()
+    await blocked
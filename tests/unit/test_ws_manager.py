@@ -0,0 +1,282 @@
+import asyncio
+import json
+import time
+import uuid
+
+import pytest
+
+from messages.ws_manager import ConnectionManager
+
+
+class FakeSocket:
+    def __init__(self, blocked=False):
+        self.sent = []
+        self.closed = False
+        self.close_code = None
+        self.gate = asyncio.Event()
+        if not blocked:
+            self.gate.set()
+
+    async def send_text(self, data):
+        await self.gate.wait()
+        self.sent.append(json.loads(data))
+
+    async def close(self, code=1000):
+        self.closed = True
+        self.close_code = code
+
+
+async def drain():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_reaches_only_chat_subscribers():
+    manager = ConnectionManager()
+    chat_id = uuid.uuid4()
+    alice, bob = uuid.uuid4(), uuid.uuid4()
+    alice_ws, bob_ws = FakeSocket(), FakeSocket()
+    await manager.connect(alice, alice_ws)
+    await manager.connect(bob, bob_ws)
+    manager.subscribe_many(alice, [chat_id, uuid.uuid4()])
+
+    await manager.broadcast(chat_id, {"text": "hi"})
+    await drain()
+
+    assert alice_ws.sent == [{"text": "hi"}]
+    assert bob_ws.sent == []
+
+
+@pytest.mark.asyncio
+async def test_index_follows_unsubscribe_and_disconnect():
+    manager = ConnectionManager()
+    chat_id = uuid.uuid4()
+    alice, bob = uuid.uuid4(), uuid.uuid4()
+    await manager.connect(alice, FakeSocket())
+    await manager.connect(bob, FakeSocket())
+    manager.subscribe(alice, chat_id)
+    manager.subscribe(bob, chat_id)
+
+    manager.unsubscribe(alice, chat_id)
+    assert manager.get_online_user_ids_in_chat(chat_id) == [str(bob)]
+
+    manager.disconnect(bob)
+    assert manager.get_online_user_ids_in_chat(chat_id) == []
+    assert chat_id not in manager._chat_subscribers
+
+
+@pytest.mark.asyncio
+async def test_stale_disconnect_keeps_replacement_connection():
+    manager = ConnectionManager()
+    chat_id = uuid.uuid4()
+    user_id = uuid.uuid4()
+    old_ws, new_ws = FakeSocket(), FakeSocket()
+    await manager.connect(user_id, old_ws)
+    manager.subscribe(user_id, chat_id)
+
+    await manager.connect(user_id, new_ws)
+    manager.subscribe(user_id, chat_id)
+    manager.disconnect(user_id, old_ws)
+
+    assert old_ws.closed
+    assert manager.get_online_user_ids_in_chat(chat_id) == [str(user_id)]
+
+
+@pytest.mark.asyncio
+async def test_slow_consumer_does_not_block_others():
+    manager = ConnectionManager()
+    chat_id = uuid.uuid4()
+    slow, fast = uuid.uuid4(), uuid.uuid4()
+    slow_ws, fast_ws = FakeSocket(blocked=True), FakeSocket()
+    await manager.connect(slow, slow_ws)
+    await manager.connect(fast, fast_ws)
+    manager.subscribe_many(slow, [chat_id])
+    manager.subscribe_many(fast, [chat_id])
+
+    await manager.broadcast(chat_id, {"n": 1})
+    await manager.broadcast(chat_id, {"n": 2})
+    await drain()
+
+    assert fast_ws.sent == [{"n": 1}, {"n": 2}]
+    assert manager.queue_depths()[str(slow)] == 1
+    assert manager.queue_depths(limit=1) == {str(slow): 1}
+    assert manager.stats()["max_queue_depth"] == 1
+
+    slow_ws.gate.set()
+    await drain()
+    assert slow_ws.sent == [{"n": 1}, {"n": 2}]
+
+
+@pytest.mark.asyncio
+async def test_full_queue_drops_oldest_ephemeral_first():
+    manager = ConnectionManager(max_queue_size=2)
+    chat_id, user_id = uuid.uuid4(), uuid.uuid4()
+    ws = FakeSocket(blocked=True)
+    await manager.connect(user_id, ws)
+    manager.subscribe(user_id, chat_id)
+    await manager.broadcast(chat_id, {"n": 0})
+    await drain()
+
+    await manager.broadcast(chat_id, {"type": "typing"}, ephemeral=True)
+    await manager.broadcast(chat_id, {"n": 1})
+    await manager.broadcast(chat_id, {"n": 2})
+
+    conn = manager.active_users[user_id]
+    assert [json.loads(d) for d, _ in conn.outbox] == [{"n": 1}, {"n": 2}]
+    assert conn.dropped == 1
+
+
+@pytest.mark.asyncio
+async def test_disconnect_policy_evicts_over_high_water_mark():
+    manager = ConnectionManager(max_queue_size=1, slow_consumer_policy="disconnect")
+    chat_id, user_id = uuid.uuid4(), uuid.uuid4()
+    ws = FakeSocket(blocked=True)
+    await manager.connect(user_id, ws)
+    manager.subscribe(user_id, chat_id)
+    await manager.broadcast(chat_id, {"n": 0})
+    await drain()
+
+    await manager.broadcast(chat_id, {"n": 1})
+    await manager.broadcast(chat_id, {"n": 2})
+    await drain()
+
+    assert user_id not in manager.active_users
+    assert manager.get_online_user_ids_in_chat(chat_id) == []
+    assert ws.close_code == 1013
+
+
+@pytest.mark.asyncio
+async def test_broadcast_encodes_payload_once(mocker):
+    manager = ConnectionManager()
+    chat_id = uuid.uuid4()
+    sockets = [FakeSocket() for _ in range(3)]
+    for ws in sockets:
+        user_id = uuid.uuid4()
+        await manager.connect(user_id, ws)
+        manager.subscribe(user_id, chat_id)
+    dumps = mocker.spy(manager.codec, "dumps")
+
+    await manager.broadcast(chat_id, {"chat_id": chat_id})
+    await drain()
+
+    assert dumps.call_count == 1
+    assert all(ws.sent == [{"chat_id": str(chat_id)}] for ws in sockets)
+
+
+def test_codecs_agree_on_uuid_and_datetime():
+    from datetime import datetime, timezone
+
+    from messages.codec import JsonCodec, OrjsonCodec, orjson
+
+    payload = {"id": uuid.uuid4(), "ts": datetime(2026, 1, 1, tzinfo=timezone.utc)}
+    expected = JsonCodec.loads(JsonCodec.dumps(payload))
+
+    assert expected == {"id": str(payload["id"]), "ts": "2026-01-01T00:00:00+00:00"}
+    if orjson is not None:
+        assert OrjsonCodec.loads(OrjsonCodec.dumps(payload)) == expected
+
+
+def test_typing_throttle_forgets_idle_pairs():
+    manager = ConnectionManager()
+    chat_id = uuid.uuid4()
+    users = [uuid.uuid4() for _ in range(1000)]
+    for user_id in users:
+        assert manager.typing_allowed(user_id, chat_id, min_interval_sec=0.01)
+    assert not manager.typing_allowed(users[0], chat_id, min_interval_sec=0.01)
+
+    time.sleep(0.025)
+    assert manager.typing_allowed(users[0], chat_id, min_interval_sec=0.01)
+    assert manager.stats()["typing_throttle_entries"] == 1
+
+
+@pytest.mark.asyncio
+async def test_reaper_pings_quiet_connections_and_evicts_dead_ones():
+    manager = ConnectionManager(ping_interval_sec=10, idle_timeout_sec=30)
+    chat_id = uuid.uuid4()
+    alive, quiet, dead = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    listener = uuid.uuid4()
+    sockets = {user_id: FakeSocket() for user_id in (alive, quiet, dead, listener)}
+    conns = {}
+    for user_id, socket in sockets.items():
+        conns[user_id] = await manager.connect(
+            user_id, socket, heartbeat=user_id != listener
+        )
+        manager.subscribe(user_id, chat_id)
+        manager.presence.connected(conns[user_id])
+    manager.presence.flush()
+    await drain()
+    conns[quiet].last_seen -= 15
+    conns[dead].last_seen -= 31
+    # Clients that never opted in to heartbeats are neither pinged nor reaped.
+    conns[listener].last_seen -= 300
+
+    assert manager.reap() == 1
+    assert manager.reap() == 0
+    manager.presence.flush()
+    await drain()
+
+    assert dead not in manager.active_users
+    assert sockets[dead].close_code == 1001
+    assert {"type": "ping"} in sockets[quiet].sent
+    assert {"type": "ping"} not in sockets[alive].sent
+    assert sockets[quiet].sent.count({"type": "ping"}) == 1
+    assert listener in manager.active_users
+    assert {"type": "ping"} not in sockets[listener].sent
+    offline = sockets[alive].sent[-1]
+    assert offline["updates"] == [
+        {"user_id": str(dead), "status": "offline", "chat_ids": [str(chat_id)]}
+    ]
+
+    manager.record_pong(conns[quiet])
+    assert conns[quiet].ping_sent_at is None
+
+
+@pytest.mark.asyncio
+async def test_broadcast_encodes_once_per_wire_format(mocker):
+    manager = ConnectionManager()
+    chat_id = uuid.uuid4()
+    formats = [manager.default_wire, manager.wire_format("json", "deflate")]
+    spies = [mocker.spy(wire, "dumps") for wire in formats]
+    sockets = []
+    for index in range(10):
+        user_id, socket = uuid.uuid4(), FakeSocket()
+        socket.send_bytes = mocker.AsyncMock()
+        await manager.connect(user_id, socket, formats[index % 2])
+        manager.subscribe(user_id, chat_id)
+        sockets.append(socket)
+
+    await manager.broadcast(chat_id, {"text": "hi"})
+    await drain()
+
+    assert [spy.call_count for spy in spies] == [1, 1]
+    assert sockets[0].sent == [{"text": "hi"}]
+    data = sockets[1].send_bytes.await_args.args[0]
+    assert formats[1].loads(data) == {"text": "hi"}
+
+
+@pytest.mark.asyncio
+async def test_held_broadcasts_skip_messages_covered_by_catch_up():
+    manager = ConnectionManager()
+    chat_id, user_id = uuid.uuid4(), uuid.uuid4()
+    socket = FakeSocket()
+    conn = await manager.connect(user_id, socket)
+    manager.hold(conn)
+    manager.subscribe(user_id, chat_id)
+
+    for seq in (4, 5, 6):
+        await manager.broadcast(chat_id, {"seq": seq})
+    await manager.broadcast(chat_id, {"type": "typing"}, ephemeral=True)
+    await drain()
+    assert socket.sent == [{"type": "typing"}]
+
+    manager.send(conn, {"type": "resume.batch", "seqs": [4, 5]})
+    manager.release(conn, {chat_id: 5})
+    await manager.broadcast(chat_id, {"seq": 7})
+    await drain()
+
+    assert socket.sent[1:] == [
+        {"type": "resume.batch", "seqs": [4, 5]},
+        {"seq": 6},
+        {"seq": 7},
+    ]
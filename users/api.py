@@ -4,7 +4,7 @@ from fastapi import APIRouter, Depends, HTTPException, Response
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from dependencies import get_current_user, get_session
+from dependencies import get_current_user_model, get_session
 from users.schemas import TokenSchema, UserCreateSchema, UserReadSchema
 from users.services import UserService
 
@@ -30,7 +30,7 @@ async def login_user(
     session: AsyncSession = Depends(get_session),
 ):
     user = await UserService.get_user_by_email(session, creds.username)
-    if user and UserService.verify_password(creds.password, user.password):
+    if user and await UserService.verify_password_async(creds.password, user.password):
         access_token = UserService.create_access_token(data={"sub": str(user.id)})
         response.set_cookie("access_token", access_token)
         return {"access_token": access_token, "token_type": "bearer"}
@@ -39,7 +39,7 @@ async def login_user(
 
 
 @user_router.get("/me", response_model=UserReadSchema)
-async def read_users_me(current_user=Depends(get_current_user)):
+async def read_users_me(current_user=Depends(get_current_user_model)):
     return current_user
 
 
@@ -0,0 +1,81 @@
+import asyncio
+import hashlib
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from fastapi import HTTPException
+
+from config import settings
+
+
+class Principal:
+    __slots__ = ("id", "expires_at")
+
+    def __init__(self, user_id: uuid.UUID, expires_at: float):
+        self.id = user_id
+        self.expires_at = expires_at
+
+
+class TokenCache:
+    def __init__(self, max_size: int = 50_000):
+        self.max_size = max_size
+        self._entries: OrderedDict[bytes, Principal] = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[Principal]:
+        key = self._key(token)
+        principal = self._entries.get(key)
+        if principal is None:
+            return None
+        if principal.expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return principal
+
+    def set(self, token: str, principal: Principal):
+        key = self._key(token)
+        self._entries[key] = principal
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class PasswordHashPool:
+    def __init__(self, max_workers: int = 2, max_pending: int = 64):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="password-hash"
+        )
+
+    async def run(self, func: Callable, *args):
+        if self.pending >= self.max_pending:
+            raise HTTPException(
+                status_code=503,
+                detail="Server busy, try again later",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+
+
+token_cache = TokenCache()
+password_pool = PasswordHashPool(
+    max_workers=settings.password_hash_workers,
+    max_pending=settings.password_hash_max_pending,
+)
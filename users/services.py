@@ -7,6 +7,7 @@ from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import get_auth_data
+from users.auth import Principal, password_pool, token_cache
 from users.models import User
 from users.repositories import UserRepository
 from users.schemas import UserCreateSchema
@@ -23,6 +24,16 @@ class UserService:
     def verify_password(plain_password: str, hashed_password: str) -> bool:
         return pwd_context.verify(plain_password, hashed_password)
 
+    @staticmethod
+    async def hash_password_async(password: str) -> str:
+        return await password_pool.run(pwd_context.hash, password)
+
+    @staticmethod
+    async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+        return await password_pool.run(
+            pwd_context.verify, plain_password, hashed_password
+        )
+
     @staticmethod
     def create_access_token(data: dict) -> str:
         to_encode = data.copy()
@@ -35,7 +46,10 @@ class UserService:
         return encode_jwt
 
     @staticmethod
-    async def get_current_user_by_token(session: AsyncSession, token: str):
+    def get_principal_by_token(token: str) -> Principal:
+        principal = token_cache.get(token)
+        if principal is not None:
+            return principal
         try:
             auth_data = get_auth_data()
             payload = jwt.decode(
@@ -44,10 +58,17 @@ class UserService:
             user_id: str = payload.get("sub")
             if user_id is None:
                 raise HTTPException(status_code=401, detail="Invalid token")
-        except JWTError:
+            principal = Principal(uuid.UUID(user_id), payload.get("exp", 0))
+        except (JWTError, ValueError):
             raise HTTPException(status_code=401, detail="Invalid token")
 
-        user = await UserRepository.get_by_id(session, uuid.UUID(user_id))
+        if principal.expires_at:
+            token_cache.set(token, principal)
+        return principal
+
+    @staticmethod
+    async def get_user_by_principal(session: AsyncSession, principal: Principal):
+        user = await UserRepository.get_by_id(session, principal.id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         return user
@@ -55,7 +76,7 @@ class UserService:
     @staticmethod
     async def register_user(session: AsyncSession, user: UserCreateSchema):
         data = user.model_dump()
-        data["password"] = UserService.hash_password(data["password"])
+        data["password"] = await UserService.hash_password_async(data["password"])
         new_user = User(**data)
         created_user = await UserRepository.create(session, new_user)
         await session.commit()